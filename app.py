@@ -1,11 +1,17 @@
-from flask import Flask, render_template
+from flask import Flask, render_template, g
 from auth.auth import login_required, obtener_usuario_actual
+from models.database import validar_registro_permisos, ErrorConexion
+from utils.db_utils import liberar_conexiones_retenidas
+from utils.indice_credenciales_utils import indice_credenciales
+from utils.escritura_diferida_utils import escritura_diferida
+import config
 from controllers import (
     auth_controller, dashboard_controller, visitantes_controller, 
     acceso_controller, usuarios_controller, alertas_controller, 
-    reportes_controller, roles_controller
+    reportes_controller, roles_controller, sistema_controller
 )
 import os
+import multiprocessing
 from datetime import timedelta
 
 app = Flask(__name__)
@@ -21,10 +27,44 @@ app.secret_key = os.environ.get('SECRET_KEY', app.config.get('SECRET_KEY', 'clav
 # Configurar duración de sesión usando la configuración (si fue sobrescrita en config.py)
 app.config['PERMANENT_SESSION_LIFETIME'] = app.config.get('PERMANENT_SESSION_LIFETIME', timedelta(hours=24))
 
+# Servicios del proceso web. Un hijo de multiprocessing ('spawn', p. ej. el
+# pool de credenciales) vuelve a importar este módulo si es __main__: no
+# debe consultar la base de datos ni tomar un diario de escritura diferida
+if multiprocessing.parent_process() is None:
+    # Validar que cada constante de permiso tenga su fila en la tabla `permisos`
+    # (los bits de las máscaras se asignan según auth.permissions.REGISTRO_PERMISOS)
+    validar_registro_permisos()
+
+    # Cargar el índice de credenciales activas antes de la primera lectura de
+    # credencial (si la base de datos no responde, se cargará en la primera)
+    indice_credenciales.disponible()
+
+    # Escritura diferida de accesos: recuperar el diario pendiente y arrancar el volcado
+    if config.ACCESOS_ESCRITURA_DIFERIDA:
+        escritura_diferida.iniciar(al_volcar=dashboard_controller.publicar_volcado)
+
 # Context processor para inyectar usuario actual en todas las plantillas
 @app.context_processor
 def inject_user():
-    return dict(usuario_actual=obtener_usuario_actual())
+    try:
+        return dict(usuario_actual=obtener_usuario_actual())
+    except ErrorConexion:
+        # Base de datos caída: la página (p. ej. la de error 503) se muestra sin usuario
+        return dict(usuario_actual=None)
+
+# En modo debug, exponer el contador de consultas por petición para verificar
+# que una página típica realiza una sola consulta de autenticación
+@app.after_request
+def exponer_contador_consultas(response):
+    if app.debug:
+        contador = g.get('contador_consultas', {})
+        response.headers['X-Consultas-Auth'] = str(contador.get('auth', 0))
+    return response
+
+# Recuperar conexiones que un controlador haya olvidado devolver al pool
+@app.teardown_request
+def liberar_conexiones(error=None):
+    liberar_conexiones_retenidas()
 
 # Nota: no forzamos session.permanent aquí para no sobrescribir la preferencia del usuario
 
@@ -35,15 +75,19 @@ app.add_url_rule('/logout', view_func=auth_controller.logout)
 
 # ==================== RUTAS DEL DASHBOARD ====================
 app.add_url_rule('/dashboard', view_func=dashboard_controller.dashboard)
+app.add_url_rule('/dashboard/stats', view_func=dashboard_controller.estadisticas_dashboard)
+app.add_url_rule('/dashboard/eventos', view_func=dashboard_controller.eventos_dashboard)
 
 # ==================== RUTAS DE VISITANTES ====================
 app.add_url_rule('/visitantes', view_func=visitantes_controller.listar_visitantes)
 app.add_url_rule('/visitantes/agregar', view_func=visitantes_controller.agregar_visitante, methods=['GET', 'POST'])
 app.add_url_rule('/visitantes/editar/<int:id>', view_func=visitantes_controller.editar_visitante, methods=['GET', 'POST'])
 app.add_url_rule('/visitantes/estado/<int:id>', view_func=visitantes_controller.cambiar_estado_visitante)
+app.add_url_rule('/visitantes/credenciales/imprimir', view_func=visitantes_controller.imprimir_credenciales, methods=['POST'])
 
 # ==================== RUTAS DE CONTROL DE ACCESO ====================
 app.add_url_rule('/control_acceso', view_func=acceso_controller.control_acceso, methods=['GET', 'POST'])
+app.add_url_rule('/control_acceso/lote', view_func=acceso_controller.registrar_lote_accesos, methods=['POST'])
 app.add_url_rule('/accesos', view_func=acceso_controller.listar_accesos)
 
 # ==================== RUTAS DE USUARIOS ====================
@@ -69,8 +113,13 @@ app.add_url_rule('/reportes', view_func=reportes_controller.generar_reporte, met
 app.add_url_rule('/reportes/ver', view_func=reportes_controller.ver_reporte)
 app.add_url_rule('/reportes/exportar/csv', view_func=reportes_controller.exportar_reporte_csv)
 app.add_url_rule('/reportes/exportar/pdf', view_func=reportes_controller.exportar_reporte_pdf)
+app.add_url_rule('/reportes/pdf/<clave>', view_func=reportes_controller.estado_reporte_pdf)
+app.add_url_rule('/reportes/pdf/<clave>/descargar', view_func=reportes_controller.descargar_reporte_pdf)
 app.add_url_rule('/reportes/estadisticas', view_func=reportes_controller.reporte_estadisticas)
 
+# ==================== RUTAS DEL SISTEMA ====================
+app.add_url_rule('/sistema/metricas', view_func=sistema_controller.metricas)
+
 # ==================== MANEJO DE ERRORES ====================
 @app.errorhandler(404)
 def pagina_no_encontrada(error):
@@ -84,6 +133,10 @@ def acceso_denegado(error):
 def error_interno(error):
     return render_template('errors/500.html'), 500
 
+@app.errorhandler(503)
+def servicio_no_disponible(error):
+    return render_template('errors/500.html'), 503
+
 if __name__ == '__main__':
     print("🚀 Iniciando Sistema de Control de Acceso...")
     print("📊 Base de datos configurada")
@@ -1,10 +1,9 @@
-from flask import session
+from flask import session, abort
 from functools import wraps
-from models.database import tiene_permiso, obtener_usuario_actual
-import time
-
-# Diccionario para control de intentos de login
-login_attempts = {}
+import hmac
+from models.database import obtener_usuario_actual, cargar_usuario, ErrorConexion
+from utils.limite_intentos_utils import limite_login
+import config
 
 def login_required(f):
     """Decorador para requerir autenticación"""
@@ -14,6 +13,19 @@ def login_required(f):
             from flask import redirect, url_for, flash
             flash('Debe iniciar sesión para acceder a esta página', 'warning')
             return redirect(url_for('login'))
+        
+        # Carga única por petición (memorizada en flask.g); la comparten
+        # permiso_requerido, el context processor y los controladores.
+        # Una base de datos caída no invalida la sesión: se responde 503
+        try:
+            usuario = obtener_usuario_actual()
+        except ErrorConexion:
+            abort(503)
+        if usuario is None:
+            from flask import redirect, url_for, flash
+            session.clear()
+            flash('Su sesión ya no es válida, inicie sesión nuevamente', 'warning')
+            return redirect(url_for('login'))
         return f(*args, **kwargs)
     return decorated_function
 
@@ -27,7 +39,11 @@ def permiso_requerido(permiso):
                 flash('Debe iniciar sesión para acceder a esta página', 'warning')
                 return redirect(url_for('login'))
             
-            if not tiene_permiso(session['usuario_id'], permiso):
+            try:
+                usuario = obtener_usuario_actual()
+            except ErrorConexion:
+                abort(503)
+            if not usuario or permiso not in usuario['permisos']:
                 from flask import redirect, url_for, flash
                 flash('No tiene permisos para acceder a esta funcionalidad', 'danger')
                 return redirect(url_for('dashboard'))
@@ -36,33 +52,73 @@ def permiso_requerido(permiso):
         return decorated_function
     return decorator
 
-def limpiar_intentos_login():
-    """Limpiar intentos de login antiguos"""
-    global login_attempts
-    current_time = time.time()
-    login_attempts = {ip: data for ip, data in login_attempts.items() 
-                     if current_time - data['timestamp'] < 900}  # 15 minutos
+def _estacion_por_token(token):
+    """(estacion, usuario_id) del token configurado en ESTACIONES_TOKENS, o None"""
+    for entrada in config.ESTACIONES_TOKENS.split(','):
+        partes = entrada.strip().split(':', 2)
+        if len(partes) != 3 or not partes[1].isdigit():
+            continue
+        estacion, usuario_id, esperado = partes
+        if esperado and hmac.compare_digest(token.encode(), esperado.encode()):
+            return estacion, int(usuario_id)
+    return None
+
+def api_requerida(permiso):
+    """Decorador para APIs JSON de estaciones: token de estación o sesión, errores 401/403 en JSON
+
+    Con "Authorization: Bearer <token>" la petición actúa como el usuario
+    asociado a la estación (g.estacion_api guarda su nombre); sin cabecera
+    se usa la sesión interactiva. Nunca redirige al login: un cliente
+    automático necesita el código de estado, no una página HTML. El
+    usuario autenticado queda en g.usuario_api.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            from flask import request, jsonify, g
+            encabezado = request.headers.get('Authorization', '')
+            try:
+                if encabezado.startswith('Bearer '):
+                    estacion = _estacion_por_token(encabezado[len('Bearer '):].strip())
+                    if estacion is None:
+                        return jsonify({'error': 'Token de estación inválido'}), 401
+                    g.estacion_api, usuario_id = estacion
+                    usuario = cargar_usuario(usuario_id)
+                else:
+                    usuario = obtener_usuario_actual()
+            except ErrorConexion:
+                return jsonify({'error': 'Error de conexión a la base de datos'}), 503
+            
+            if usuario is None:
+                return jsonify({'error': 'Autenticación requerida'}), 401
+            if permiso not in usuario['permisos']:
+                return jsonify({'error': 'No tiene permisos para esta operación'}), 403
+            
+            g.usuario_api = usuario
+            return f(*args, **kwargs)
+        return decorated_function
+    return decorator
+
+def _claves_login(ip, correo):
+    claves = [(f"ip:{ip}", config.MAX_LOGIN_ATTEMPTS_IP)]
+    if correo:
+        claves.append((f"cuenta:{correo.strip().lower()}", config.MAX_LOGIN_ATTEMPTS))
+    return claves
+
+def registrar_intento_login(ip, correo=None):
+    """Registrar un intento de login fallido (por IP y por cuenta)"""
+    for clave, _ in _claves_login(ip, correo):
+        limite_login.registrar(clave)
 
-def registrar_intento_login(ip):
-    """Registrar un intento de login fallido"""
-    global login_attempts
-    limpiar_intentos_login()
-    
-    if ip not in login_attempts:
-        login_attempts[ip] = {'count': 0, 'timestamp': time.time()}
-    
-    login_attempts[ip]['count'] += 1
-    login_attempts[ip]['timestamp'] = time.time()
+def esta_bloqueado(ip, correo=None):
+    """Verificar si la IP o la cuenta superaron los intentos fallidos de la ventana"""
+    return any(limite_login.intentos(clave) >= maximo for clave, maximo in _claves_login(ip, correo))
 
-def esta_bloqueado(ip):
-    """Verificar si una IP está bloqueada por muchos intentos fallidos"""
-    limpiar_intentos_login()
-    if ip in login_attempts and login_attempts[ip]['count'] >= 5:
-        return True
-    return False
+def resetear_intentos_login(ip, correo=None):
+    """Resetear los intentos de la cuenta tras un login correcto
 
-def resetear_intentos_login(ip):
-    """Resetear intentos de login para una IP"""
-    global login_attempts
-    if ip in login_attempts:
-        del login_attempts[ip]
\ No newline at end of file
+    Los de la IP no se borran: un atacante con una cuenta válida podría
+    reiniciar su contador; expiran solos al salir de la ventana.
+    """
+    if correo:
+        limite_login.resetear(f"cuenta:{correo.strip().lower()}")
@@ -1,4 +1,5 @@
 # Constantes de permisos para uso en decoradores y verificaciones
+import zlib
 
 # Módulo Dashboard
 VER_DASHBOARD = "dashboard.ver_dashboard"
@@ -37,4 +38,52 @@ EXPORTAR_REPORTES = "reportes.exportar_reportes"
 # Módulo Configuración
 GESTIONAR_ROLES = "configuracion.gestionar_roles"
 GESTIONAR_PERMISOS = "configuracion.gestionar_permisos"
-CONFIGURAR_SISTEMA = "configuracion.configurar_sistema"
\ No newline at end of file
+CONFIGURAR_SISTEMA = "configuracion.configurar_sistema"
+
+# ==================== REGISTRO COMPILADO DE PERMISOS ====================
+# Cada permiso recibe un bit estable según su posición en esta tupla.
+# IMPORTANTE: solo agregar al final; reordenar cambia el significado de las
+# máscaras guardadas en las cookies de sesión (la huella las invalida).
+
+REGISTRO_PERMISOS = (
+    VER_DASHBOARD,
+    VER_VISITANTES, CREAR_VISITANTES, EDITAR_VISITANTES, ELIMINAR_VISITANTES,
+    CAMBIAR_ESTADO_VISITANTES, GENERAR_CREDENCIALES,
+    CONTROL_ACCESO, VER_REGISTRO_ACCESOS,
+    VER_USUARIOS, CREAR_USUARIOS, EDITAR_USUARIOS, ELIMINAR_USUARIOS,
+    CAMBIAR_ESTADO_USUARIOS, ASIGNAR_ROLES,
+    VER_ALERTAS, CREAR_ALERTAS, EDITAR_ALERTAS, ELIMINAR_ALERTAS,
+    VER_REPORTES, GENERAR_REPORTES, EXPORTAR_REPORTES,
+    GESTIONAR_ROLES, GESTIONAR_PERMISOS, CONFIGURAR_SISTEMA,
+)
+
+BITS_PERMISOS = {permiso: 1 << indice for indice, permiso in enumerate(REGISTRO_PERMISOS)}
+
+# Huella del registro: cambia si se altera el orden o el contenido
+HUELLA_REGISTRO = format(zlib.crc32("|".join(REGISTRO_PERMISOS).encode()), '08x')
+
+
+class MascaraPermisos(int):
+    """Conjunto de permisos representado como entero de bits.
+    
+    Soporta `'modulo.nombre' in mascara` en tiempo constante, por lo que
+    sustituye a la lista de cadenas en decoradores, controladores y plantillas.
+    """
+    
+    def __contains__(self, permiso):
+        bit = BITS_PERMISOS.get(permiso)
+        return bit is not None and (self & bit) != 0
+    
+    def __iter__(self):
+        return (permiso for permiso in REGISTRO_PERMISOS if self & BITS_PERMISOS[permiso])
+    
+    def __len__(self):
+        return bin(self).count('1')
+
+
+def compilar_mascara(permisos):
+    """Compilar un iterable de "modulo.nombre" en una MascaraPermisos"""
+    mascara = 0
+    for permiso in permisos:
+        mascara |= BITS_PERMISOS.get(permiso, 0)
+    return MascaraPermisos(mascara)
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Benchmark del generador de PDF de reportes de accesos
+
+Compara generar_pdf_reporte con la implementación anterior (una sola Table
+con todas las filas, estilos y strftime por llamada) midiendo tiempo y pico
+de memoria con datos sintéticos.
+
+Uso:
+    python benchmark_pdf.py                # 10000 y 100000 filas
+    python benchmark_pdf.py 5000 20000     # tamaños propios
+    python benchmark_pdf.py --sin-anterior 100000
+"""
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from io import BytesIO
+
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.lib.units import inch
+from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
+
+from utils.pdf_utils import generar_pdf_reporte
+
+
+def generar_pdf_anterior(accesos, tipo_reporte, fecha_inicio, fecha_fin, titulo="Reporte de Accesos"):
+    """Implementación anterior, conservada solo como referencia de comparación"""
+    buffer = BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=A4, topMargin=30)
+    elements = []
+    styles = getSampleStyleSheet()
+    title_style = ParagraphStyle('CustomTitle', parent=styles['Heading1'], fontSize=16, spaceAfter=30, alignment=1)
+    elements.append(Paragraph(titulo, title_style))
+    elements.append(Paragraph(f"<b>Total de registros:</b> {len(accesos)}", styles['Normal']))
+    elements.append(Spacer(1, 20))
+    data = [['Fecha/Hora', 'Visitante', 'Tipo', 'Autorizado', 'Guardia']]
+    for acceso in accesos:
+        data.append([
+            acceso['fecha_hora'].strftime('%Y-%m-%d %I:%M %p'),
+            acceso.get('visitante', 'N/A'),
+            acceso['tipo'].capitalize(),
+            'Sí' if acceso['autorizado'] else 'No',
+            acceso.get('guardia', 'Sistema')
+        ])
+    table = Table(data, colWidths=[1.5*inch, 2*inch, 0.8*inch, 0.8*inch, 1.5*inch])
+    table.setStyle(TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, 0), 10),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+        ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+        ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
+        ('FONTSIZE', (0, 1), (-1, -1), 8),
+        ('GRID', (0, 0), (-1, -1), 1, colors.black)
+    ]))
+    elements.append(table)
+    doc.build(elements)
+    return buffer.getvalue()
+
+
+def accesos_sinteticos(total):
+    """Accesos ficticios repartidos cada 37 segundos hacia atrás"""
+    inicio = datetime(2025, 1, 1, 8, 0)
+    return [{
+        'fecha_hora': inicio - timedelta(seconds=37 * i),
+        'visitante': f'Visitante {i % 500}',
+        'tipo': 'entrada' if i % 2 else 'salida',
+        'autorizado': i % 13 != 0,
+        'guardia': f'Guardia {i % 7}'
+    } for i in range(total)]
+
+
+def medir(funcion, accesos):
+    """Devolver (segundos, pico de memoria en MB, tamaño del PDF en KB)
+
+    El tiempo se mide en una ejecución sin tracemalloc (que la ralentiza
+    varias veces) y la memoria en una segunda ejecución trazada.
+    """
+    comienzo = time.perf_counter()
+    pdf = funcion(accesos, 'mensual', '2024-12-01', '2025-01-01', 'Benchmark')
+    segundos = time.perf_counter() - comienzo
+    tracemalloc.start()
+    funcion(accesos, 'mensual', '2024-12-01', '2025-01-01', 'Benchmark')
+    _, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return segundos, pico / 1024 / 1024, len(pdf) / 1024
+
+
+def main():
+    argumentos = sys.argv[1:]
+    con_anterior = '--sin-anterior' not in argumentos
+    tamanos = [int(a) for a in argumentos if a.isdigit()] or [10000, 100000]
+
+    implementaciones = [('actual', generar_pdf_reporte)]
+    if con_anterior:
+        implementaciones.append(('anterior', generar_pdf_anterior))
+
+    print(f"{'filas':>8}  {'implementación':<14}{'segundos':>10}{'pico MB':>10}{'PDF KB':>10}")
+    for total in tamanos:
+        accesos = accesos_sinteticos(total)
+        for nombre, funcion in implementaciones:
+            segundos, pico, tamano = medir(funcion, accesos)
+            print(f"{total:>8}  {nombre:<14}{segundos:>10.2f}{pico:>10.1f}{tamano:>10.0f}")
+
+
+if __name__ == '__main__':
+    main()
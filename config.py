@@ -63,13 +63,30 @@ else:
 # Si config.py define SECRET_KEY, se usará; de lo contrario `app.py` usará la variable de entorno.
 DEBUG = True
 
+# Detección de conexiones no devueltas al pool: guarda la pila de cada préstamo
+# (activa por defecto en desarrollo; las fugas se cuentan y recuperan siempre)
+DB_LEAK_DETECTION = os.environ.get('DB_LEAK_DETECTION', '1' if DEBUG else '0') == '1'
+
+# Pool de conexiones (por worker). El reciclado debe ser menor que el
+# `wait_timeout` de MySQL (28800 s por defecto) para no prestar conexiones muertas.
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+DB_POOL_MAX_OVERFLOW = int(os.environ.get('DB_POOL_MAX_OVERFLOW', 5))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 10))  # segundos esperando conexión libre
+DB_POOL_MAX_WAITERS = int(os.environ.get('DB_POOL_MAX_WAITERS', 50))
+DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 3600))  # segundos de vida máxima
+DB_POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', '1') != '0'
+DB_POOL_PING_INTERVAL = int(os.environ.get('DB_POOL_PING_INTERVAL', 30))  # inactividad antes de verificar
+
 # Configuración de sesiones y cookies
 PERMANENT_SESSION_LIFETIME = timedelta(hours=24)
 SESSION_COOKIE_SECURE = False  # True en producción con HTTPS
 SESSION_COOKIE_HTTPONLY = True
 SESSION_COOKIE_SAMESITE = 'Lax'
 
-# Configuración de horarios
+# Configuración de horarios (ver utils/horarios_utils.py). Además del horario
+# general admite 'dias' ('lun-vie'), 'festivos' (['2026-12-25']),
+# 'franjas_festivo' y 'reglas' por rol ('rol:guardia') o tipo de visitante
+# ('tipo:contratista'), p. ej. {'rol:administrador': {'todos': [('06:00', '22:00')]}}
 HORARIOS_ACCESO = {
     'hora_inicio': '08:00',
     'hora_fin': '18:00'
@@ -81,6 +98,95 @@ APP_TIMEZONE = os.environ.get('APP_TIMEZONE', 'America/Bogota')
 # Configuración de credenciales
 DURACION_CREDENCIAL_HORAS = 8
 
+# Caché de permisos: cada cuántos segundos un worker consulta la versión compartida
+PERMISOS_CACHE_SEGUNDOS = int(os.environ.get('PERMISOS_CACHE_SEGUNDOS', 5))
+
+# Índice de credenciales activas en memoria: segundos entre comprobaciones de
+# la versión compartida (demora máxima con la que otro worker ve un cambio)
+CREDENCIALES_INDICE_SEGUNDOS = int(os.environ.get('CREDENCIALES_INDICE_SEGUNDOS', 2))
+
+# Registro de lecturas por lote (torniquetes / lectores sin conexión): máximo de eventos por petición
+ACCESOS_LOTE_MAXIMO = int(os.environ.get('ACCESOS_LOTE_MAXIMO', 500))
+# Tokens de las estaciones para esa API (cabecera "Authorization: Bearer <token>"):
+# "estacion:usuario_id:token" separados por comas; cada estación registra a nombre de su usuario
+ESTACIONES_TOKENS = os.environ.get('ESTACIONES_TOKENS', '')
+
+# Escritura diferida de accesos: las lecturas del control de acceso se guardan
+# en un diario local (con fsync) y un hilo las vuelca a MySQL en lotes.
+# Desactivada por defecto; requiere el índice de credenciales disponible.
+ACCESOS_ESCRITURA_DIFERIDA = os.environ.get('ACCESOS_ESCRITURA_DIFERIDA', '0') == '1'
+DIARIO_ACCESOS_DIR = os.environ.get('DIARIO_ACCESOS_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'datos', 'diario_accesos'))
+ESCRITURA_DIFERIDA_INTERVALO_MS = int(os.environ.get('ESCRITURA_DIFERIDA_INTERVALO_MS', 200))
+ESCRITURA_DIFERIDA_LOTE = int(os.environ.get('ESCRITURA_DIFERIDA_LOTE', 200))
+ESCRITURA_DIFERIDA_MAX_PENDIENTES = int(os.environ.get('ESCRITURA_DIFERIDA_MAX_PENDIENTES', 5000))
+
+# Contadores del dashboard: segundos que se comparte la misma lectura entre todos los usuarios
+DASHBOARD_STATS_SEGUNDOS = int(os.environ.get('DASHBOARD_STATS_SEGUNDOS', 15))
+
+# Caché en memoria de consultas (utils.cache_utils): máximo de entradas por
+# proceso y segmentos con lock propio
+CACHE_MAX_ENTRADAS = int(os.environ.get('CACHE_MAX_ENTRADAS', 1024))
+CACHE_SEGMENTOS = int(os.environ.get('CACHE_SEGMENTOS', 16))
+# Segundo nivel compartido por los workers del servidor (SQLite + generaciones en memoria compartida)
+CACHE_COMPARTIDA = os.environ.get('CACHE_COMPARTIDA', '1') != '0'
+CACHE_COMPARTIDA_DIR = os.environ.get('CACHE_COMPARTIDA_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'compartida'))
+
+# Reporte de estadísticas generales: segundos que se comparte el mismo cálculo
+ESTADISTICAS_CACHE_SEGUNDOS = int(os.environ.get('ESTADISTICAS_CACHE_SEGUNDOS', 60))
+
+# Eventos en vivo (Server-Sent Events)
+SSE_MAX_SUSCRIPTORES = int(os.environ.get('SSE_MAX_SUSCRIPTORES', 200))
+SSE_MAX_PENDIENTES = int(os.environ.get('SSE_MAX_PENDIENTES', 100))
+SSE_LATIDO_SEGUNDOS = int(os.environ.get('SSE_LATIDO_SEGUNDOS', 15))
+SSE_REINTENTO_MS = int(os.environ.get('SSE_REINTENTO_MS', 5000))
+
+# Exportaciones en streaming: filas leídas por viaje a la base de datos y
+# tiempo máximo (s) que MySQL espera a un cliente lento antes de cortar
+EXPORTACION_LOTE_FILAS = int(os.environ.get('EXPORTACION_LOTE_FILAS', 1000))
+EXPORTACION_NET_WRITE_TIMEOUT = int(os.environ.get('EXPORTACION_NET_WRITE_TIMEOUT', 600))
+
+# Reportes por rango: días por tramo al recorrer rangos largos y filas de detalle por página
+REPORTE_TRAMO_DIAS = int(os.environ.get('REPORTE_TRAMO_DIAS', 7))
+REPORTE_DETALLE_POR_PAGINA = int(os.environ.get('REPORTE_DETALLE_POR_PAGINA', 100))
+# PDF de reportes: con más registros que esto solo se incluye el resumen (el detalle, por CSV)
+REPORTE_PDF_MAX_FILAS = int(os.environ.get('REPORTE_PDF_MAX_FILAS', 200000))
+
+# Reportes PDF en segundo plano: hilos generadores, carpeta de resultados y días de retención
+REPORTES_PDF_HILOS = int(os.environ.get('REPORTES_PDF_HILOS', 2))
+REPORTES_CACHE_DIR = os.environ.get('REPORTES_CACHE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'reportes'))
+REPORTES_CACHE_DIAS = int(os.environ.get('REPORTES_CACHE_DIAS', 30))
+# Segundos tras los que una marca .tmp sin trabajo vivo se da por abandonada (worker caído)
+REPORTES_PDF_TIMEOUT = int(os.environ.get('REPORTES_PDF_TIMEOUT', 1800))
+
+# Caché de reportes por período: los períodos cerrados se guardan en disco sin
+# vencimiento; los que incluyen hoy, en memoria durante estos segundos
+REPORTES_PERIODOS_DIR = os.environ.get('REPORTES_PERIODOS_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'periodos'))
+REPORTES_CACHE_HOY_SEGUNDOS = int(os.environ.get('REPORTES_CACHE_HOY_SEGUNDOS', 60))
+
+# Impresión de credenciales por lote: máximo de credenciales por PDF, tamaño
+# de lote a partir del cual se reparte entre procesos, procesos y carpeta de
+# páginas ya renderizadas (reimprimir una credencial no la vuelve a renderizar)
+CREDENCIALES_LOTE_MAXIMO = int(os.environ.get('CREDENCIALES_LOTE_MAXIMO', 500))
+CREDENCIALES_LOTE_PARALELO = int(os.environ.get('CREDENCIALES_LOTE_PARALELO', 40))
+CREDENCIALES_PROCESOS = int(os.environ.get('CREDENCIALES_PROCESOS', max(1, min(4, (os.cpu_count() or 1)))))
+CREDENCIALES_CACHE_DIR = os.environ.get('CREDENCIALES_CACHE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'credenciales'))
+# Días que se conserva una página renderizada (contiene datos personales del visitante)
+CREDENCIALES_CACHE_DIAS = int(os.environ.get('CREDENCIALES_CACHE_DIAS', 7))
+
+# Paginación de listados (por cursor)
+ACCESOS_POR_PAGINA = int(os.environ.get('ACCESOS_POR_PAGINA', 50))
+VISITANTES_POR_PAGINA = int(os.environ.get('VISITANTES_POR_PAGINA', 50))
+
+# Búsqueda de visitantes: máximo de resultados devueltos, ordenados por relevancia
+VISITANTES_BUSQUEDA_LIMITE = int(os.environ.get('VISITANTES_BUSQUEDA_LIMITE', 100))
+
 # Configuración de seguridad
-MAX_LOGIN_ATTEMPTS = 5
-LOCKOUT_TIME = 15  # minutos
+MAX_LOGIN_ATTEMPTS = int(os.environ.get('MAX_LOGIN_ATTEMPTS', 5))  # por cuenta
+MAX_LOGIN_ATTEMPTS_IP = int(os.environ.get('MAX_LOGIN_ATTEMPTS_IP', 20))  # por IP (varias cuentas detrás de un NAT)
+LOCKOUT_TIME = int(os.environ.get('LOCKOUT_TIME', 15))  # minutos (ventana deslizante)
+
+# Almacén de intentos fallidos: 'sqlite' (archivo local compartido por los
+# workers del servidor), 'redis' (varios servidores) o 'memoria' (un proceso)
+LIMITE_INTENTOS_BACKEND = os.environ.get('LIMITE_INTENTOS_BACKEND', 'sqlite')
+LIMITE_INTENTOS_SQLITE = os.environ.get('LIMITE_INTENTOS_SQLITE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'datos', 'limite_intentos.sqlite3'))
+LIMITE_INTENTOS_REDIS_URL = os.environ.get('LIMITE_INTENTOS_REDIS_URL', 'redis://localhost:6379/0')
@@ -51,7 +51,8 @@ CREATE TABLE IF NOT EXISTS `visitantes` (
     `motivo` TEXT,
     `fecha_registro` TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     `fecha_creacion` TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    `estado` ENUM('activo', 'inactivo') NOT NULL DEFAULT 'activo'
+    `estado` ENUM('activo', 'inactivo') NOT NULL DEFAULT 'activo',
+    `total_visitas` INT NOT NULL DEFAULT 0
 );
 
 -- TABLA DE CREDENCIALES
@@ -63,6 +64,7 @@ CREATE TABLE IF NOT EXISTS `credenciales` (
     `fecha_emision` TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     `fecha_expiracion` DATETIME,
     `fecha_creacion` TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    `modificado` TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
     FOREIGN KEY (`visitante_id`) REFERENCES `visitantes`(`id`)
 );
 
@@ -74,6 +76,7 @@ CREATE TABLE IF NOT EXISTS `accesos` (
     `tipo` ENUM('entrada', 'salida') NOT NULL,
     `fecha_hora` TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     `autorizado` BOOLEAN DEFAULT TRUE,
+    `estacion` VARCHAR(50) NULL,
     `fecha_creacion` TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     FOREIGN KEY (`usuario_id`) REFERENCES `usuarios`(`id`),
     FOREIGN KEY (`visitante_id`) REFERENCES `visitantes`(`id`)
@@ -92,6 +95,58 @@ CREATE TABLE IF NOT EXISTS `alertas` (
     FOREIGN KEY (`visitante_id`) REFERENCES `visitantes`(`id`)
 );
 
+-- TABLA DE PRESENCIA (visitantes actualmente dentro, mantenida por control de acceso)
+CREATE TABLE IF NOT EXISTS `presencia` (
+    `visitante_id` INT PRIMARY KEY,
+    `acceso_id` INT NOT NULL,
+    `usuario_id` INT,
+    `fecha_entrada` TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (`visitante_id`) REFERENCES `visitantes`(`id`),
+    FOREIGN KEY (`acceso_id`) REFERENCES `accesos`(`id`)
+);
+
+-- RESUMEN DIARIO DE ACCESOS (rollup de días cerrados, ver utils/rollup_utils.py)
+CREATE TABLE IF NOT EXISTS `accesos_diarios` (
+    `fecha` DATE PRIMARY KEY,
+    `total_accesos` INT NOT NULL DEFAULT 0,
+    `accesos_autorizados` INT NOT NULL DEFAULT 0,
+    `accesos_denegados` INT NOT NULL DEFAULT 0,
+    `total_entradas` INT NOT NULL DEFAULT 0,
+    `total_salidas` INT NOT NULL DEFAULT 0,
+    `visitantes_unicos` INT NOT NULL DEFAULT 0,
+    `accesos_fuera_horario` INT NOT NULL DEFAULT 0
+);
+
+-- Visitantes distintos por día, para contar únicos en rangos de varios días
+CREATE TABLE IF NOT EXISTS `accesos_visitantes_dia` (
+    `fecha` DATE NOT NULL,
+    `visitante_id` INT NOT NULL,
+    PRIMARY KEY (`fecha`, `visitante_id`)
+);
+
+-- Marcas de agua de los procesos de rollup
+CREATE TABLE IF NOT EXISTS `rollup_estado` (
+    `clave` VARCHAR(50) PRIMARY KEY,
+    `procesado_hasta` DATE NULL,
+    `fecha_actualizacion` TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+);
+
+-- TABLA DE VERSIONES DE CACHÉ (invalidación entre workers)
+CREATE TABLE IF NOT EXISTS `cache_versiones` (
+    `clave` VARCHAR(50) PRIMARY KEY,
+    `version` BIGINT NOT NULL DEFAULT 1,
+    `fecha_actualizacion` TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+);
+
+INSERT IGNORE INTO `cache_versiones` (`clave`, `version`) VALUES ('permisos', 1), ('credenciales', 1);
+
+-- Última secuencia del diario de escritura diferida ya volcada (por diario local)
+CREATE TABLE IF NOT EXISTS `diario_accesos_estado` (
+    `clave` VARCHAR(100) PRIMARY KEY,
+    `secuencia` BIGINT NOT NULL DEFAULT 0,
+    `fecha_actualizacion` TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+);
+
 -- INSERTAR ROLES BÁSICOS
 INSERT IGNORE INTO `roles` (`id`, `nombre`, `descripcion`) VALUES
 (1, 'administrador', 'Administrador completo del sistema con todos los permisos'),
@@ -224,6 +279,37 @@ INSERT IGNORE INTO `alertas` (`descripcion`, `nivel`, `usuario_id`) VALUES
 ('Visitante con credencial expirada intentó ingresar', 'alto', 2),
 ('Acceso denegado por identificación no válida', 'alto', 2);
 
+-- MIGRACIÓN: contador desnormalizado de visitas (entradas autorizadas)
+ALTER TABLE `visitantes` ADD COLUMN IF NOT EXISTS `total_visitas` INT NOT NULL DEFAULT 0;
+
+UPDATE `visitantes` v
+SET v.`total_visitas` = (
+    SELECT COUNT(*) FROM `accesos` a
+    WHERE a.`visitante_id` = v.`id` AND a.`tipo` = 'entrada' AND a.`autorizado` = 1
+);
+
+-- MIGRACIÓN: poblar presencia con los visitantes cuyo último acceso autorizado fue una entrada
+INSERT IGNORE INTO `presencia` (`visitante_id`, `acceso_id`, `usuario_id`, `fecha_entrada`)
+SELECT a.`visitante_id`, a.`id`, a.`usuario_id`, a.`fecha_hora`
+FROM `accesos` a
+JOIN (
+    SELECT `visitante_id`, MAX(`id`) as `ultimo_id`
+    FROM `accesos`
+    WHERE `autorizado` = 1 AND `visitante_id` IS NOT NULL
+    GROUP BY `visitante_id`
+) u ON a.`id` = u.`ultimo_id`
+WHERE a.`tipo` = 'entrada';
+
+-- MIGRACIÓN: estación (torniquete / lector) que registró el acceso, para lecturas por lote
+ALTER TABLE `accesos` ADD COLUMN IF NOT EXISTS `estacion` VARCHAR(50) NULL;
+
+-- MIGRACIÓN: accesos fuera de horario en el rollup diario (init_db.py recalcula
+-- los días ya cargados cuando agrega la columna, conservando la marca de agua)
+ALTER TABLE `accesos_diarios` ADD COLUMN IF NOT EXISTS `accesos_fuera_horario` INT NOT NULL DEFAULT 0;
+
+-- MIGRACIÓN: marca de última modificación, para que el índice de credenciales recargue solo lo cambiado
+ALTER TABLE `credenciales` ADD COLUMN IF NOT EXISTS `modificado` TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP;
+
 -- CREAR ÍNDICES PARA MEJOR RENDIMIENTO
 CREATE INDEX IF NOT EXISTS `idx_usuarios_estado` ON `usuarios`(`estado`);
 CREATE INDEX IF NOT EXISTS `idx_usuarios_rol` ON `usuarios`(`rol_id`);
@@ -232,12 +318,19 @@ CREATE INDEX IF NOT EXISTS `idx_visitantes_identificacion` ON `visitantes`(`iden
 CREATE INDEX IF NOT EXISTS `idx_credenciales_estado` ON `credenciales`(`estado`);
 CREATE INDEX IF NOT EXISTS `idx_credenciales_codigo` ON `credenciales`(`codigo`);
 CREATE INDEX IF NOT EXISTS `idx_credenciales_expiracion` ON `credenciales`(`fecha_expiracion`);
+CREATE INDEX IF NOT EXISTS `idx_credenciales_modificado` ON `credenciales`(`modificado`);
 CREATE INDEX IF NOT EXISTS `idx_accesos_fecha` ON `accesos`(`fecha_hora`);
 CREATE INDEX IF NOT EXISTS `idx_accesos_visitante` ON `accesos`(`visitante_id`);
 CREATE INDEX IF NOT EXISTS `idx_alertas_fecha` ON `alertas`(`fecha`);
 CREATE INDEX IF NOT EXISTS `idx_alertas_nivel` ON `alertas`(`nivel`);
 CREATE INDEX IF NOT EXISTS `idx_rol_permisos_rol` ON `rol_permisos`(`rol_id`);
 CREATE INDEX IF NOT EXISTS `idx_rol_permisos_permiso` ON `rol_permisos`(`permiso_id`);
+CREATE INDEX IF NOT EXISTS `idx_visitantes_estado_nombre` ON `visitantes`(`estado`, `nombre`);
+CREATE INDEX IF NOT EXISTS `idx_visitantes_estado_visitas` ON `visitantes`(`estado`, `total_visitas`);
+CREATE INDEX IF NOT EXISTS `idx_presencia_entrada` ON `presencia`(`fecha_entrada`);
+CREATE INDEX IF NOT EXISTS `idx_visitantes_visitas` ON `visitantes`(`total_visitas`);
+CREATE INDEX IF NOT EXISTS `idx_accesos_estacion_fecha` ON `accesos`(`estacion`, `fecha_hora`);
+CREATE FULLTEXT INDEX IF NOT EXISTS `ft_visitantes_busqueda` ON `visitantes`(`nombre`, `identificacion`, `empresa`);
 
 -- CONSULTA PARA VERIFICAR LA ESTRUCTURA COMPLETA
 SELECT 
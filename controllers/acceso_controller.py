@@ -1,16 +1,33 @@
-from flask import render_template, request, redirect, url_for, session, flash
-from models.database import Database
-from auth.auth import login_required, permiso_requerido
+from flask import render_template, request, redirect, url_for, session, flash, jsonify, g
+from models.database import Database, ErrorConexion
+from auth.auth import login_required, permiso_requerido, api_requerida
 from auth.permissions import *
-from datetime import datetime
+from collections import Counter
+from datetime import datetime, timedelta
 import config
-try:
-    # Python 3.9+: use zoneinfo
-    from zoneinfo import ZoneInfo
-except Exception:
-    ZoneInfo = None
-from utils.acceso_utils import normalizar_tipo_acceso
-from utils.time_utils import app_now_time
+from utils.acceso_utils import normalizar_tipo_acceso, clasificar_lectura, guardar_lecturas
+from utils.time_utils import app_now, rango_fechas
+from utils.paginacion_utils import tamano_pagina, decodificar_cursor, clausula_keyset, paginar_keyset
+from utils.indice_credenciales_utils import indice_credenciales, notificar_cambio
+from utils.cache_reportes_utils import cache_reportes
+from utils.escritura_diferida_utils import escritura_diferida, ColaLlena
+from utils.horarios_utils import motor_horarios
+from controllers.dashboard_controller import publicar_eventos, evento_alerta
+
+CONSULTA_CREDENCIAL = """
+    SELECT v.*, c.id as credencial_id 
+    FROM credenciales c 
+    JOIN visitantes v ON c.visitante_id = v.id 
+    WHERE c.codigo = %s AND c.estado = 'activa' 
+    AND (c.fecha_expiracion IS NULL OR c.fecha_expiracion > NOW())
+    AND v.estado = 'activo'
+"""
+
+_MENSAJES_LECTURA = {
+    'autorizado': lambda r: (f'Acceso registrado: {r["nombre"]} ({r["tipo"]})', 'success'),
+    'denegado': lambda r: (f'Acceso denegado: Fuera del horario permitido ({r["horario"]})', 'warning'),
+    'invalido': lambda r: ('Código inválido, expirado o visitante inactivo', 'danger'),
+}
 
 @login_required
 @permiso_requerido(CONTROL_ACCESO)
@@ -21,85 +38,114 @@ def control_acceso():
         tipo = normalizar_tipo_acceso(request.form['tipo'])  # normalizar a 'entrada' o 'salida'
         
         db = Database()
-        conn = db.conectar()
-        if not conn:
-            flash('Error de conexión a la base de datos', 'danger')
-            return redirect(url_for('control_acceso'))
-        
+        eventos = []  # se publican en vivo solo después del commit
+        desactivada = None  # credencial a quitar del índice tras el commit
+        version_indice = None
         try:
-            cursor = conn.cursor(dictionary=True)
-            
-            # Verificar credencial
-            cursor.execute("""
-                SELECT v.*, c.id as credencial_id 
-                FROM credenciales c 
-                JOIN visitantes v ON c.visitante_id = v.id 
-                WHERE c.codigo = %s AND c.estado = 'activa' 
-                AND (c.fecha_expiracion IS NULL OR c.fecha_expiracion > NOW())
-                AND v.estado = 'activo'
-            """, (codigo,))
-            
-            credencial = cursor.fetchone()
+            # Verificar credencial en el índice en memoria; solo si no está
+            # disponible se consulta la base de datos dentro de la transacción
+            usar_indice = indice_credenciales.disponible()
+            credencial = indice_credenciales.buscar(codigo) if usar_indice else None
             
-            if credencial:
-                # Verificar horario (8:00 AM - 6:00 PM) usando la zona horaria de la app
-                if ZoneInfo is not None:
-                    try:
-                        tz = ZoneInfo(config.APP_TIMEZONE)
-                        hora_actual = datetime.now(tz).time()
-                    except Exception:
-                        # Fallback a hora de la app (sensible a TZ)
-                        hora_actual = app_now_time()
+            # Escritura diferida: la lectura queda en el diario local y se vuelca
+            # en lote; si la cola está llena se sigue por la escritura directa
+            if usar_indice and config.ACCESOS_ESCRITURA_DIFERIDA and escritura_diferida.activa():
+                registro = clasificar_lectura(codigo, tipo, credencial, app_now().replace(tzinfo=None, microsecond=0),
+                                              None, session['usuario_id'], session.get('usuario_rol'))
+                try:
+                    # Los eventos en vivo se publican cuando el lote queda en la base de datos
+                    escritura_diferida.registrar([registro], _eventos_lectura(registro))
+                except (ColaLlena, OSError) as e:
+                    print(f"Escritura diferida no disponible, se registra directo: {e!r}")
                 else:
-                    # zoneinfo no disponible, fallback a hora de la app
-                    hora_actual = app_now_time()
-                hora_inicio = datetime.strptime('08:00', '%H:%M').time()
-                hora_fin = datetime.strptime('18:00', '%H:%M').time()
+                    if registro['estado'] == 'autorizado' and tipo == 'salida':
+                        indice_credenciales.quitar(codigo)
+                    flash(*_MENSAJES_LECTURA[registro['estado']](registro))
+                    return redirect(url_for('control_acceso'))
+            
+            with db.transaccion() as cursor:
+                if not usar_indice:
+                    cursor.execute(CONSULTA_CREDENCIAL, (codigo,))
+                    credencial = cursor.fetchone()
                 
-                if hora_actual < hora_inicio or hora_actual > hora_fin:
-                    # Registrar acceso no autorizado por horario
-                    cursor.execute("""
-                        INSERT INTO accesos (usuario_id, visitante_id, tipo, autorizado)
-                        VALUES (%s, %s, %s, %s)
-                    """, (session['usuario_id'], credencial['id'], tipo, 0))
-                    
-                    # Registrar alerta
-                    cursor.execute("""
-                        INSERT INTO alertas (descripcion, nivel, usuario_id, visitante_id)
-                        VALUES (%s, %s, %s, %s)
-                    """, (f'Intento de acceso fuera de horario: {credencial["nombre"]}', 'medio', session['usuario_id'], credencial['id']))
+                if credencial:
+                    # Verificar horario (reglas de config.HORARIOS_ACCESO, ya compiladas) en la hora de la app
+                    ahora = app_now().replace(tzinfo=None)
+                    rol = session.get('usuario_rol')
                     
-                    conn.commit()
-                    flash(f'Acceso denegado: Fuera del horario permitido (8:00 AM - 6:00 PM)', 'warning')
+                    if not motor_horarios.permitido(ahora, rol=rol, tipo=credencial.get('tipo')):
+                        # Registrar acceso no autorizado por horario
+                        cursor.execute("""
+                            INSERT INTO accesos (usuario_id, visitante_id, tipo, autorizado)
+                            VALUES (%s, %s, %s, %s)
+                        """, (session['usuario_id'], credencial['id'], tipo, 0))
+                        
+                        # Registrar alerta
+                        descripcion = f'Intento de acceso fuera de horario: {credencial["nombre"]}'
+                        cursor.execute("""
+                            INSERT INTO alertas (descripcion, nivel, usuario_id, visitante_id)
+                            VALUES (%s, %s, %s, %s)
+                        """, (descripcion, 'medio', session['usuario_id'], credencial['id']))
+                        
+                        eventos.append(('acceso', {'visitante': credencial['nombre'], 'tipo': tipo, 'autorizado': False,
+                                                   'incrementos': {'accesos_hoy': 1}}))
+                        eventos.append(evento_alerta(descripcion, 'medio'))
+                        
+                        horario = motor_horarios.describir(ahora, rol=rol, tipo=credencial.get('tipo'))
+                        mensaje = (f'Acceso denegado: Fuera del horario permitido ({horario})', 'warning')
+                    else:
+                        # Registrar acceso autorizado
+                        cursor.execute("""
+                            INSERT INTO accesos (usuario_id, visitante_id, tipo, autorizado)
+                            VALUES (%s, %s, %s, %s)
+                        """, (session['usuario_id'], credencial['id'], tipo, 1))
+                        acceso_id = cursor.lastrowid
+                        
+                        # Mantener contador de visitas y presencia en la misma transacción
+                        dentro = 0
+                        if tipo == 'entrada':
+                            cursor.execute("UPDATE visitantes SET total_visitas = total_visitas + 1 WHERE id = %s", (credencial['id'],))
+                            cursor.execute("""
+                                INSERT INTO presencia (visitante_id, acceso_id, usuario_id, fecha_entrada)
+                                VALUES (%s, %s, %s, NOW())
+                                ON DUPLICATE KEY UPDATE acceso_id = VALUES(acceso_id),
+                                    usuario_id = VALUES(usuario_id), fecha_entrada = VALUES(fecha_entrada)
+                            """, (credencial['id'], acceso_id, session['usuario_id']))
+                            dentro = 1 if cursor.rowcount == 1 else 0  # 2 = ya estaba dentro
+                        
+                        # Si es salida, desactivar credencial y marcar al visitante fuera
+                        if tipo == 'salida':
+                            cursor.execute("UPDATE credenciales SET estado = 'inactiva' WHERE id = %s", (credencial['credencial_id'],))
+                            version_indice = notificar_cambio(cursor)
+                            desactivada = codigo
+                            cursor.execute("DELETE FROM presencia WHERE visitante_id = %s", (credencial['id'],))
+                            dentro = -cursor.rowcount
+                        
+                        eventos.append(('acceso', {'visitante': credencial['nombre'], 'tipo': tipo, 'autorizado': True,
+                                                   'incrementos': {'accesos_hoy': 1, 'visitantes_dentro': dentro}}))
+                        
+                        mensaje = (f'Acceso registrado: {credencial["nombre"]} ({tipo})', 'success')
                 else:
-                    # Registrar acceso autorizado
+                    # Registrar intento de acceso no autorizado
+                    descripcion = f'Intento de acceso con código inválido: {codigo}'
                     cursor.execute("""
-                        INSERT INTO accesos (usuario_id, visitante_id, tipo, autorizado)
-                        VALUES (%s, %s, %s, %s)
-                    """, (session['usuario_id'], credencial['id'], tipo, 1))
+                        INSERT INTO alertas (descripcion, nivel, usuario_id)
+                        VALUES (%s, %s, %s)
+                    """, (descripcion, 'alto', session['usuario_id']))
+                    eventos.append(evento_alerta(descripcion, 'alto'))
                     
-                    # Si es salida, desactivar credencial
-                    if tipo == 'salida':
-                        cursor.execute("UPDATE credenciales SET estado = 'inactiva' WHERE id = %s", (credencial['credencial_id'],))
-                    
-                    conn.commit()
-                    flash(f'Acceso registrado: {credencial["nombre"]} ({tipo})', 'success')
-            else:
-                # Registrar intento de acceso no autorizado
-                cursor.execute("""
-                    INSERT INTO alertas (descripcion, nivel, usuario_id)
-                    VALUES (%s, %s, %s)
-                """, (f'Intento de acceso con código inválido: {codigo}', 'alto', session['usuario_id']))
-                
-                conn.commit()
-                flash('Código inválido, expirado o visitante inactivo', 'danger')
+                    mensaje = ('Código inválido, expirado o visitante inactivo', 'danger')
             
-            cursor.close()
-            conn.close()
+            if desactivada:
+                indice_credenciales.quitar(desactivada, version=version_indice)
+            publicar_eventos(eventos)
+            flash(*mensaje)
             return redirect(url_for('control_acceso'))
             
+        except ErrorConexion:
+            flash('Error de conexión a la base de datos', 'danger')
+            return redirect(url_for('control_acceso'))
         except Exception as e:
-            conn.rollback()
             print(f"Error en control de acceso: {e}")
             flash('Error al procesar el acceso', 'danger')
             return redirect(url_for('control_acceso'))
@@ -111,19 +157,22 @@ def control_acceso():
 def listar_accesos():
     """Listar historial de accesos"""
     db = Database()
-    conn = db.conectar()
-    if not conn:
-        flash('Error de conexión a la base de datos', 'danger')
-        return render_template('acceso/listar.html', accesos=[])
-    
     try:
-        cursor = conn.cursor(dictionary=True)
-        
         # Obtener parámetros de filtrado
         fecha_desde = request.args.get('fecha_desde', '')
         fecha_hasta = request.args.get('fecha_hasta', '')
         tipo = request.args.get('tipo', '')
         autorizado = request.args.get('autorizado', '')
+        por_pagina = tamano_pagina(request.args.get('por_pagina'), config.ACCESOS_POR_PAGINA)
+        antes = decodificar_cursor(request.args.get('antes'))
+        despues = None if antes else decodificar_cursor(request.args.get('despues'))
+        
+        try:
+            inicio, fin = rango_fechas(fecha_desde, fecha_hasta)
+        except ValueError:
+            flash('Formato de fecha inválido', 'warning')
+            fecha_desde = fecha_hasta = ''
+            inicio = fin = None
         
         # Construir consulta base
         query = """
@@ -135,14 +184,14 @@ def listar_accesos():
         """
         params = []
         
-        # Aplicar filtros
-        if fecha_desde:
-            query += " AND DATE(a.fecha_hora) >= %s"
-            params.append(fecha_desde)
+        # Aplicar filtros (rango semiabierto para que se use idx_accesos_fecha)
+        if inicio:
+            query += " AND a.fecha_hora >= %s"
+            params.append(inicio)
         
-        if fecha_hasta:
-            query += " AND DATE(a.fecha_hora) <= %s"
-            params.append(fecha_hasta)
+        if fin:
+            query += " AND a.fecha_hora < %s"
+            params.append(fin)
         
         if tipo:
             query += " AND a.tipo = %s"
@@ -152,22 +201,208 @@ def listar_accesos():
             query += " AND a.autorizado = %s"
             params.append(1 if autorizado == 'si' else 0)
         
-        query += " ORDER BY a.fecha_hora DESC"
+        # Paginación por cursor (fecha_hora, id): sin OFFSET, coste constante por página
+        condicion, params_cursor, orden = clausula_keyset(
+            'a.fecha_hora', 'a.id', antes or despues, descendente=True, retroceder=despues is not None)
+        if condicion:
+            query += f" AND {condicion}"
+            params.extend(params_cursor)
+        query += f" ORDER BY {orden}"
         
-        cursor.execute(query, params)
-        accesos = cursor.fetchall()
+        query += " LIMIT %s"
+        params.append(por_pagina + 1)
         
-        cursor.close()
-        conn.close()
+        with db.cursor() as cursor:
+            cursor.execute(query, params)
+            accesos = cursor.fetchall()
+        
+        accesos, cursor_anterior, cursor_siguiente = paginar_keyset(
+            accesos, por_pagina, hay_cursor=bool(antes or despues), retroceder=despues is not None)
+        
+        filtros = {k: v for k, v in {
+            'fecha_desde': fecha_desde,
+            'fecha_hasta': fecha_hasta,
+            'tipo': tipo,
+            'autorizado': autorizado,
+            'por_pagina': request.args.get('por_pagina', ''),
+        }.items() if v}
         
         return render_template('acceso/listar.html', 
                              accesos=accesos,
                              fecha_desde=fecha_desde,
                              fecha_hasta=fecha_hasta,
                              tipo_seleccionado=tipo,
-                             autorizado_seleccionado=autorizado)
+                             autorizado_seleccionado=autorizado,
+                             filtros=filtros,
+                             cursor_anterior=cursor_anterior,
+                             cursor_siguiente=cursor_siguiente)
         
+    except ErrorConexion:
+        flash('Error de conexión a la base de datos', 'danger')
+        return render_template('acceso/listar.html', accesos=[])
     except Exception as e:
         print(f"Error al listar accesos: {e}")
         flash('Error al cargar el historial de accesos', 'danger')
         return render_template('acceso/listar.html', accesos=[])
+
+# Desfase de reloj admitido en lecturas "del futuro" enviadas por las estaciones
+TOLERANCIA_RELOJ = timedelta(minutes=5)
+
+
+def _leer_evento(evento, ahora):
+    """Validar un evento del lote y devolver (codigo, tipo, fecha_hora, estacion)"""
+    if not isinstance(evento, dict):
+        raise ValueError('Evento con formato inválido')
+    codigo = str(evento.get('codigo') or '').strip()
+    if not codigo:
+        raise ValueError('Falta el código')
+    tipo = normalizar_tipo_acceso(evento.get('tipo', 'entrada'))
+    
+    fecha_hora = ahora
+    if evento.get('fecha_hora'):
+        try:
+            fecha_hora = datetime.fromisoformat(str(evento['fecha_hora']))
+        except ValueError:
+            raise ValueError('fecha_hora debe tener formato ISO 8601')
+        if fecha_hora.tzinfo is not None:
+            fecha_hora = fecha_hora.astimezone(ahora.tzinfo)
+    fecha_hora = fecha_hora.replace(tzinfo=None, microsecond=0)
+    if fecha_hora > ahora.replace(tzinfo=None) + TOLERANCIA_RELOJ:
+        raise ValueError('fecha_hora en el futuro')
+    
+    estacion = str(evento['estacion']).strip()[:50] if evento.get('estacion') else None
+    return codigo, tipo, fecha_hora, estacion
+
+
+def _credenciales_lote(cursor, codigos):
+    """codigo -> credencial (id, nombre, credencial_id) de las credenciales válidas del lote"""
+    if indice_credenciales.disponible():
+        return {codigo: indice_credenciales.buscar(codigo) for codigo in codigos}
+    marcadores = ', '.join(['%s'] * len(codigos))
+    cursor.execute(f"""
+        SELECT c.codigo, v.id, v.nombre, c.id as credencial_id
+        FROM credenciales c
+        JOIN visitantes v ON c.visitante_id = v.id
+        WHERE c.codigo IN ({marcadores}) AND c.estado = 'activa'
+        AND (c.fecha_expiracion IS NULL OR c.fecha_expiracion > NOW())
+        AND v.estado = 'activo'
+    """, list(codigos))
+    return {fila['codigo']: fila for fila in cursor.fetchall()}
+
+
+def _resultado_lectura(registro):
+    """Resultado de una lectura para la respuesta de la API"""
+    if registro['estado'] == 'autorizado':
+        return {'estado': 'autorizado', 'visitante': registro['nombre']}
+    if registro['estado'] == 'denegado':
+        return {'estado': 'denegado', 'mensaje': 'Fuera del horario permitido'}
+    return {'estado': 'invalido', 'mensaje': 'Código inválido, expirado o visitante inactivo'}
+
+
+def _eventos_lectura(registro, dentro=0):
+    """Eventos en vivo de una lectura (acceso y/o alerta)"""
+    eventos = []
+    if registro['autorizado'] is not None:
+        incrementos = {'accesos_hoy': 1}
+        if dentro:
+            incrementos['visitantes_dentro'] = dentro
+        eventos.append(('acceso', {'visitante': registro['nombre'], 'tipo': registro['tipo'],
+                                   'autorizado': registro['autorizado'], 'incrementos': incrementos}))
+    if registro['alerta']:
+        eventos.append(evento_alerta(*registro['alerta']))
+    return eventos
+
+
+def _accesos_existentes(cursor, lecturas):
+    """(visitante_id, tipo, fecha_hora, estacion) ya registrados: lecturas reenviadas por la estación"""
+    con_estacion = [l for l in lecturas if l[4]]
+    if not con_estacion:
+        return set()
+    estaciones = sorted({l[4] for l in con_estacion})
+    marcadores = ', '.join(['%s'] * len(estaciones))
+    cursor.execute(f"""
+        SELECT visitante_id, tipo, fecha_hora, estacion
+        FROM accesos
+        WHERE fecha_hora >= %s AND fecha_hora <= %s AND estacion IN ({marcadores})
+    """, [min(l[3] for l in con_estacion), max(l[3] for l in con_estacion)] + estaciones)
+    return {(f['visitante_id'], f['tipo'], f['fecha_hora'], f['estacion']) for f in cursor.fetchall()}
+
+
+@api_requerida(CONTROL_ACCESO)
+def registrar_lote_accesos():
+    """
+    API JSON: registrar un lote de lecturas en una sola transacción
+
+    Cuerpo: {"eventos": [{"codigo": "AB12CD34", "tipo": "entrada",
+    "fecha_hora": "2025-01-31T08:15:00", "estacion": "torniquete-1"}, ...]}.
+    `fecha_hora` (hora de la lectura, por defecto ahora) y `estacion` son
+    opcionales. Las lecturas se procesan en orden cronológico y los accesos
+    y alertas se insertan con executemany. La respuesta trae un resultado
+    por evento, en el orden recibido: autorizado, denegado, invalido,
+    duplicado (reenvío de una lectura ya registrada) o error.
+
+    Las estaciones se autentican con su token (ESTACIONES_TOKENS); sus
+    lecturas sin `estacion` se atribuyen a la estación del token.
+    """
+    datos = request.get_json(silent=True) or {}
+    eventos_lote = datos.get('eventos') if isinstance(datos, dict) else None
+    if not isinstance(eventos_lote, list) or not eventos_lote:
+        return jsonify({'error': 'Se esperaba una lista "eventos" no vacía'}), 400
+    if len(eventos_lote) > config.ACCESOS_LOTE_MAXIMO:
+        return jsonify({'error': f'Máximo {config.ACCESOS_LOTE_MAXIMO} eventos por lote'}), 413
+    
+    ahora = app_now()
+    hoy = ahora.date()
+    usuario_id = g.usuario_api['id']
+    rol = g.usuario_api['rol_nombre']
+    estacion_token = g.get('estacion_api')
+    resultados = [None] * len(eventos_lote)
+    lecturas = []  # (indice, codigo, tipo, fecha_hora, estacion)
+    for indice, evento in enumerate(eventos_lote):
+        try:
+            codigo, tipo, fecha_hora, estacion = _leer_evento(evento, ahora)
+            lecturas.append((indice, codigo, tipo, fecha_hora, estacion or estacion_token))
+        except ValueError as e:
+            resultados[indice] = {'estado': 'error', 'mensaje': str(e)}
+    lecturas.sort(key=lambda l: (l[3], l[0]))
+    
+    db = Database()
+    eventos = []  # se publican en vivo solo después del commit
+    desactivadas = set()
+    try:
+        with db.transaccion() as cursor:
+            credenciales = _credenciales_lote(cursor, {l[1] for l in lecturas}) if lecturas else {}
+            existentes = _accesos_existentes(cursor, lecturas)
+            
+            registros = []
+            for indice, codigo, tipo, fecha_hora, estacion in lecturas:
+                credencial = None if codigo in desactivadas else credenciales.get(codigo)
+                if credencial and (credencial['id'], tipo, fecha_hora, estacion) in existentes:
+                    resultados[indice] = {'estado': 'duplicado', 'mensaje': 'Lectura ya registrada'}
+                    continue
+                
+                registro = clasificar_lectura(codigo, tipo, credencial, fecha_hora, estacion, usuario_id, rol)
+                registros.append(registro)
+                resultados[indice] = _resultado_lectura(registro)
+                if registro['autorizado'] and tipo == 'salida':
+                    # La salida desactiva la credencial: lecturas posteriores del lote ya no valen
+                    desactivadas.add(codigo)
+                if fecha_hora.date() == hoy:
+                    eventos.extend(_eventos_lectura(registro))
+            
+            dias_pasados, version_indice = guardar_lecturas(cursor, registros)
+        
+        for codigo in desactivadas:
+            indice_credenciales.quitar(codigo, version=version_indice)
+        for fecha in dias_pasados:
+            cache_reportes.invalidar(fecha)
+        publicar_eventos(eventos)
+        
+        resumen = Counter(r['estado'] for r in resultados)
+        return jsonify({'procesados': len(resultados), 'resumen': resumen, 'resultados': resultados})
+    
+    except ErrorConexion:
+        return jsonify({'error': 'Error de conexión a la base de datos'}), 503
+    except Exception as e:
+        print(f"Error al registrar lote de accesos: {e}")
+        return jsonify({'error': 'Error al registrar el lote; no se guardó ningún evento'}), 500
@@ -1,22 +1,16 @@
 from flask import render_template, request, redirect, url_for, session, flash
-from models.database import Database
+from models.database import Database, ErrorConexion
 from auth.auth import login_required, permiso_requerido
 from auth.permissions import VER_ALERTAS, CREAR_ALERTAS, EDITAR_ALERTAS, ELIMINAR_ALERTAS
 from datetime import datetime
+from controllers.dashboard_controller import publicar_eventos, evento_alerta, invalidar_contadores
 
 @login_required
 @permiso_requerido(VER_ALERTAS)
 def listar_alertas():
     """Listar todas las alertas del sistema"""
     db = Database()
-    conn = db.conectar()
-    if not conn:
-        flash('Error de conexión a la base de datos', 'danger')
-        return render_template('alertas/listar.html', alertas=[])
-    
     try:
-        cursor = conn.cursor(dictionary=True)
-        
         # Obtener parámetros de filtrado
         nivel = request.args.get('nivel', '')
         fecha_desde = request.args.get('fecha_desde', '')
@@ -47,23 +41,21 @@ def listar_alertas():
         
         query += " ORDER BY a.fecha DESC"
         
-        cursor.execute(query, params)
-        alertas = cursor.fetchall()
-        
-        # Obtener estadísticas de alertas
-        cursor.execute("""
-            SELECT 
-                COUNT(*) as total,
-                SUM(CASE WHEN nivel = 'alto' THEN 1 ELSE 0 END) as altas,
-                SUM(CASE WHEN nivel = 'medio' THEN 1 ELSE 0 END) as medias,
-                SUM(CASE WHEN nivel = 'bajo' THEN 1 ELSE 0 END) as bajas
-            FROM alertas 
-            WHERE DATE(fecha) = CURDATE()
-        """)
-        estadisticas = cursor.fetchone()
-        
-        cursor.close()
-        conn.close()
+        with db.cursor() as cursor:
+            cursor.execute(query, params)
+            alertas = cursor.fetchall()
+            
+            # Obtener estadísticas de alertas
+            cursor.execute("""
+                SELECT 
+                    COUNT(*) as total,
+                    SUM(CASE WHEN nivel = 'alto' THEN 1 ELSE 0 END) as altas,
+                    SUM(CASE WHEN nivel = 'medio' THEN 1 ELSE 0 END) as medias,
+                    SUM(CASE WHEN nivel = 'bajo' THEN 1 ELSE 0 END) as bajas
+                FROM alertas 
+                WHERE DATE(fecha) = CURDATE()
+            """)
+            estadisticas = cursor.fetchone()
         
         return render_template('alertas/listar.html', 
                              alertas=alertas,
@@ -72,6 +64,9 @@ def listar_alertas():
                              fecha_desde=fecha_desde,
                              fecha_hasta=fecha_hasta)
         
+    except ErrorConexion:
+        flash('Error de conexión a la base de datos', 'danger')
+        return render_template('alertas/listar.html', alertas=[])
     except Exception as e:
         print(f"Error al listar alertas: {e}")
         flash('Error al cargar las alertas del sistema', 'danger')
@@ -81,51 +76,39 @@ def listar_alertas():
 @permiso_requerido(CREAR_ALERTAS)
 def crear_alerta():
     """Crear una nueva alerta manualmente"""
+    db = Database()
     if request.method == 'POST':
         descripcion = request.form['descripcion']
         nivel = request.form['nivel']
         visitante_id = request.form.get('visitante_id') or None
         
-        db = Database()
-        conn = db.conectar()
-        if not conn:
-            flash('Error de conexión a la base de datos', 'danger')
-            return redirect(url_for('listar_alertas'))
-        
         try:
-            cursor = conn.cursor()
+            with db.transaccion(dictionary=False) as cursor:
+                cursor.execute("""
+                    INSERT INTO alertas (descripcion, nivel, usuario_id, visitante_id)
+                    VALUES (%s, %s, %s, %s)
+                """, (descripcion, nivel, session['usuario_id'], visitante_id))
             
-            cursor.execute("""
-                INSERT INTO alertas (descripcion, nivel, usuario_id, visitante_id)
-                VALUES (%s, %s, %s, %s)
-            """, (descripcion, nivel, session['usuario_id'], visitante_id))
-            
-            conn.commit()
+            publicar_eventos([evento_alerta(descripcion, nivel)])
             flash('Alerta creada exitosamente', 'success')
             
+        except ErrorConexion:
+            flash('Error de conexión a la base de datos', 'danger')
         except Exception as e:
-            conn.rollback()
             flash(f'Error al crear alerta: {str(e)}', 'danger')
-        finally:
-            cursor.close()
-            conn.close()
         
         return redirect(url_for('listar_alertas'))
     
     # Obtener visitantes para el formulario
-    db = Database()
-    conn = db.conectar()
-    if not conn:
+    try:
+        with db.cursor() as cursor:
+            # Ordenar visitantes por ID numérico ascendente para que las listas muestren 1,2,3...
+            cursor.execute("SELECT id, nombre FROM visitantes WHERE estado = 'activo' ORDER BY id ASC")
+            visitantes = cursor.fetchall()
+    except ErrorConexion:
         flash('Error de conexión a la base de datos', 'danger')
         return redirect(url_for('listar_alertas'))
     
-    cursor = conn.cursor(dictionary=True)
-    # Ordenar visitantes por ID numérico ascendente para que las listas muestren 1,2,3...
-    cursor.execute("SELECT id, nombre FROM visitantes WHERE estado = 'activo' ORDER BY id ASC")
-    visitantes = cursor.fetchall()
-    cursor.close()
-    conn.close()
-    
     return render_template('alertas/crear.html', visitantes=visitantes)
 
 @login_required
@@ -133,55 +116,39 @@ def crear_alerta():
 def eliminar_alerta(id):
     """Eliminar una alerta"""
     db = Database()
-    conn = db.conectar()
-    if not conn:
-        flash('Error de conexión a la base de datos', 'danger')
-        return redirect(url_for('listar_alertas'))
-    
     try:
-        cursor = conn.cursor()
-        
-        # Verificar que la alerta existe
-        cursor.execute("SELECT id FROM alertas WHERE id = %s", (id,))
-        if not cursor.fetchone():
-            flash('Alerta no encontrada', 'danger')
-            return redirect(url_for('listar_alertas'))
-        
-        cursor.execute("DELETE FROM alertas WHERE id = %s", (id,))
-        conn.commit()
+        with db.transaccion(dictionary=False) as cursor:
+            # Verificar que la alerta existe
+            cursor.execute("SELECT id FROM alertas WHERE id = %s", (id,))
+            if not cursor.fetchone():
+                flash('Alerta no encontrada', 'danger')
+                return redirect(url_for('listar_alertas'))
+            
+            cursor.execute("DELETE FROM alertas WHERE id = %s", (id,))
         
+        invalidar_contadores()  # la alerta puede estar en el listado del dashboard
         flash('Alerta eliminada exitosamente', 'success')
         
+    except ErrorConexion:
+        flash('Error de conexión a la base de datos', 'danger')
     except Exception as e:
-        conn.rollback()
         flash(f'Error al eliminar alerta: {str(e)}', 'danger')
-    finally:
-        cursor.close()
-        conn.close()
     
     return redirect(url_for('listar_alertas'))
 
 def crear_alerta_automatica(descripcion, nivel='medio', usuario_id=None, visitante_id=None):
     """Función para crear alertas automáticamente desde otros módulos"""
-    db = Database()
-    conn = db.conectar()
-    if not conn:
-        print("Error: No se pudo conectar a la base de datos para crear alerta")
-        return False
-    
     try:
-        cursor = conn.cursor()
-        cursor.execute("""
-            INSERT INTO alertas (descripcion, nivel, usuario_id, visitante_id)
-            VALUES (%s, %s, %s, %s)
-        """, (descripcion, nivel, usuario_id, visitante_id))
-        
-        conn.commit()
+        with Database().transaccion(dictionary=False) as cursor:
+            cursor.execute("""
+                INSERT INTO alertas (descripcion, nivel, usuario_id, visitante_id)
+                VALUES (%s, %s, %s, %s)
+            """, (descripcion, nivel, usuario_id, visitante_id))
+        publicar_eventos([evento_alerta(descripcion, nivel)])
         return True
+    except ErrorConexion:
+        print("Error: No se pudo conectar a la base de datos para crear alerta")
+        return False
     except Exception as e:
         print(f"Error creando alerta automática: {e}")
-        conn.rollback()
         return False
-    finally:
-        cursor.close()
-        conn.close()
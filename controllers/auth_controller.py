@@ -1,8 +1,9 @@
 from flask import render_template, request, redirect, url_for, session, flash
-from models.database import Database
+from models.database import Database, ErrorConexion
 from auth.auth import registrar_intento_login, esta_bloqueado, resetear_intentos_login
 from utils.acceso_utils import normalizar_tipo_acceso
 import hashlib
+import config
 
 def login():
     if request.method == 'POST':
@@ -13,32 +14,37 @@ def login():
         # Obtener IP del cliente para control de intentos
         client_ip = request.remote_addr
         
-        # Verificar si la IP está bloqueada
-        if esta_bloqueado(client_ip):
-            flash('Demasiados intentos fallidos. Espere 15 minutos.', 'danger')
+        # Verificar si la IP o la cuenta están bloqueadas (antes de tocar la base de datos)
+        if esta_bloqueado(client_ip, correo):
+            flash(f'Demasiados intentos fallidos. Espere {config.LOCKOUT_TIME} minutos.', 'danger')
             return render_template('login.html')
         
         db = Database()
-        conn = db.conectar()
-        if not conn:
-            flash('Error de conexión con el servidor', 'danger')
-            return render_template('login.html')
-        
         try:
-            cursor = conn.cursor(dictionary=True)
-            cursor.execute("""
-                SELECT u.*, r.nombre as rol_nombre 
-                FROM usuarios u 
-                JOIN roles r ON u.rol_id = r.id 
-                WHERE u.correo = %s AND u.estado = 'activo'
-            """, (correo,))
-            
-            usuario = cursor.fetchone()
+            with db.transaccion() as cursor:
+                cursor.execute("""
+                    SELECT u.*, r.nombre as rol_nombre 
+                    FROM usuarios u 
+                    JOIN roles r ON u.rol_id = r.id 
+                    WHERE u.correo = %s AND u.estado = 'activo'
+                """, (correo,))
+                
+                usuario = cursor.fetchone()
+                autenticado = bool(usuario and db.verificar_contrasena(contrasena, usuario['contrasena']))
+                
+                if autenticado:
+                    # Registrar login exitoso como entrada
+                    cursor.execute("""
+                        INSERT INTO accesos (usuario_id, tipo, autorizado, fecha_hora)
+                        VALUES (%s, 'entrada', 1, NOW())
+                    """, (usuario['id'],))
             
-            if usuario and db.verificar_contrasena(contrasena, usuario['contrasena']):
+            if autenticado:
                 # Login exitoso
-                resetear_intentos_login(client_ip)
+                resetear_intentos_login(client_ip, correo)
                 
+                # Sesión nueva: no heredar máscara de permisos ni datos de una cuenta anterior
+                session.clear()
                 session['usuario_id'] = usuario['id']
                 session['usuario_nombre'] = usuario['nombre']
                 session['usuario_rol_id'] = usuario['rol_id']
@@ -48,47 +54,32 @@ def login():
                 if recordar:
                     session.permanent = True
                 
-                # Registrar login exitoso como entrada
-                cursor.execute("""
-                    INSERT INTO accesos (usuario_id, tipo, autorizado, fecha_hora)
-                    VALUES (%s, 'entrada', 1, NOW())
-                """, (usuario['id'],))
-                
-                conn.commit()
                 flash(f'Bienvenido, {usuario["nombre"]}', 'success')
                 return redirect(url_for('dashboard'))
             else:
                 # Login fallido
-                registrar_intento_login(client_ip)
+                registrar_intento_login(client_ip, correo)
                 flash('Credenciales incorrectas', 'danger')
                 
+        except ErrorConexion:
+            flash('Error de conexión con el servidor', 'danger')
         except Exception as e:
             print(f"Error en login: {e}")
             flash('Error en el servidor', 'danger')
-        finally:
-            cursor.close()
-            conn.close()
     
     return render_template('login.html')
 
 def logout():
     # Registrar logout
     if 'usuario_id' in session:
-        db = Database()
-        conn = db.conectar()
-        if conn:
-            try:
-                cursor = conn.cursor()
+        try:
+            with Database().transaccion(dictionary=False) as cursor:
                 cursor.execute("""
                     INSERT INTO accesos (usuario_id, tipo, autorizado, fecha_hora)
                     VALUES (%s, 'salida', 1, NOW())
                 """, (session['usuario_id'],))
-                conn.commit()
-                cursor.close()
-            except:
-                pass
-            finally:
-                conn.close()
+        except Exception:
+            pass
     
     session.clear()
     flash('Sesión cerrada exitosamente', 'info')
@@ -1,78 +1,203 @@
-from flask import render_template
+from flask import render_template, request, jsonify, Response
 from models.database import Database, obtener_usuario_actual
 from auth.auth import login_required
-from auth.permissions import VER_ALERTAS, VER_USUARIOS, VER_REGISTRO_ACCESOS
+from auth.permissions import VER_ALERTAS, VER_USUARIOS, VER_REGISTRO_ACCESOS, VER_VISITANTES
+import config
+from utils.eventos_utils import bus_eventos, transmitir
+from utils.cache_utils import cache
+import hashlib
+import json
+
+# Contadores que solo se exponen con el permiso correspondiente
+CONTADORES_RESTRINGIDOS = {
+    'alertas_hoy': VER_ALERTAS,
+    'total_usuarios': VER_USUARIOS,
+}
+
+CONSULTA_PRESENTES = """
+    SELECT p.visitante_id, p.fecha_entrada, v.nombre, v.empresa
+    FROM presencia p
+    JOIN visitantes v ON p.visitante_id = v.id
+    WHERE p.fecha_entrada >= CURDATE()
+    ORDER BY p.fecha_entrada DESC
+"""
+
+CONSULTA_ACCESOS_RECIENTES = """
+    SELECT a.*, v.nombre as visitante_nombre, u.nombre as usuario_nombre
+    FROM accesos a
+    LEFT JOIN visitantes v ON a.visitante_id = v.id
+    LEFT JOIN usuarios u ON a.usuario_id = u.id
+    WHERE a.tipo IN ('entrada', 'salida')
+    ORDER BY a.fecha_hora DESC
+    LIMIT 10
+"""
+
+CONSULTA_ALERTAS_RECIENTES = """
+    SELECT * FROM alertas 
+    WHERE nivel IN ('alto', 'medio')
+    ORDER BY fecha DESC
+    LIMIT 5
+"""
+
+
+def _leer_contadores():
+    """Leer todos los contadores del dashboard en una sola consulta"""
+    db = Database()
+    with db.cursor() as cursor:
+        cursor.execute("""
+            SELECT
+                (SELECT COUNT(*) FROM visitantes WHERE estado = 'activo') as total_visitantes,
+                (SELECT COUNT(*) FROM accesos
+                    WHERE fecha_hora >= CURDATE() AND fecha_hora < CURDATE() + INTERVAL 1 DAY
+                    AND tipo IN ('entrada', 'salida')) as accesos_hoy,
+                (SELECT COUNT(*) FROM alertas
+                    WHERE fecha >= CURDATE() AND fecha < CURDATE() + INTERVAL 1 DAY) as alertas_hoy,
+                (SELECT COUNT(*) FROM usuarios WHERE estado = 'activo') as total_usuarios,
+                (SELECT COUNT(*) FROM presencia WHERE fecha_entrada >= CURDATE()) as visitantes_dentro
+        """)
+        fila = cursor.fetchone()
+    return {clave: int(valor or 0) for clave, valor in fila.items()}
+
+
+def obtener_contadores():
+    """
+    Contadores del dashboard compartidos entre usuarios y peticiones
+
+    Solo una petición a la vez refresca los datos (single-flight); mientras
+    tanto, las demás reciben la última lectura aunque haya vencido. Si aún no
+    hay ninguna lectura, esperan a la que está en curso.
+    """
+    return cache.obtener('dashboard', 'contadores', _leer_contadores,
+                         config.DASHBOARD_STATS_SEGUNDOS, servir_vencido=True)
+
+
+def _listado_dashboard(nombre, consulta):
+    """Listado del dashboard (igual para todos los usuarios con permiso), compartido como los contadores"""
+    def leer():
+        with Database().cursor() as cursor:
+            cursor.execute(consulta)
+            return cursor.fetchall()
+    return cache.obtener('dashboard', nombre, leer, config.DASHBOARD_STATS_SEGUNDOS, servir_vencido=True)
+
+
+def invalidar_contadores():
+    """Forzar que la próxima lectura de contadores y listados vaya a la base de datos"""
+    cache.invalidar('dashboard')
+
+
+def publicar_eventos(eventos):
+    """
+    Publicar eventos (tipo, datos) ya confirmados en la base de datos
+
+    Los contadores compartidos se invalidan para que el próximo estado
+    completo enviado a los clientes incluya estos cambios.
+    """
+    if not eventos:
+        return
+    invalidar_contadores()
+    for tipo, datos in eventos:
+        bus_eventos.publicar(tipo, datos)
+
+
+def publicar_volcado(eventos):
+    """
+    Tras el commit de un lote de la escritura diferida
+
+    Invalida los contadores aunque el lote no traiga eventos (lecturas
+    recuperadas del diario tras un reinicio) y publica los que haya.
+    """
+    invalidar_contadores()
+    publicar_eventos(eventos)
+
+
+def evento_alerta(descripcion, nivel):
+    """Construir el evento de una alerta nueva"""
+    return 'alerta', {'descripcion': descripcion, 'nivel': nivel, 'incrementos': {'alertas_hoy': 1}}
+
+
+def _contadores_visibles(usuario_actual, contadores):
+    """Filtrar los contadores según los permisos del usuario"""
+    permisos = usuario_actual['permisos'] if usuario_actual else ()
+    return {
+        clave: valor for clave, valor in contadores.items()
+        if clave not in CONTADORES_RESTRINGIDOS or CONTADORES_RESTRINGIDOS[clave] in permisos
+    }
 
 @login_required
 def dashboard():
     """Dashboard principal con estadísticas según permisos"""
-    db = Database()
-    conn = db.conectar()
-    if not conn:
-        return render_template('dashboard.html', estadisticas={})
-    
     usuario_actual = obtener_usuario_actual()
     estadisticas = {}
     
     try:
-        cursor = conn.cursor(dictionary=True)
-        
-        # Estadísticas básicas para todos los roles
-        cursor.execute("SELECT COUNT(*) as total FROM visitantes WHERE estado = 'activo'")
-        estadisticas['total_visitantes'] = cursor.fetchone()['total']
-        
-        cursor.execute("SELECT COUNT(*) as total FROM accesos WHERE DATE(fecha_hora) = CURDATE() AND tipo IN ('entrada', 'salida')")
-        estadisticas['accesos_hoy'] = cursor.fetchone()['total']
+        # Contadores (compartidos entre usuarios, filtrados por permisos)
+        estadisticas.update(_contadores_visibles(usuario_actual, obtener_contadores()))
         
-        # Estadísticas según permisos del usuario actual
-        if usuario_actual and 'alertas.ver_alertas' in usuario_actual['permisos']:
-            cursor.execute("SELECT COUNT(*) as total FROM alertas WHERE DATE(fecha) = CURDATE()")
-            estadisticas['alertas_hoy'] = cursor.fetchone()['total']
-        
-        if usuario_actual and 'usuarios.ver_usuarios' in usuario_actual['permisos']:
-            cursor.execute("SELECT COUNT(*) as total FROM usuarios WHERE estado = 'activo'")
-            estadisticas['total_usuarios'] = cursor.fetchone()['total']
-        
-        # Visitantes actualmente en las instalaciones
-        cursor.execute("""
-            SELECT COUNT(DISTINCT a1.visitante_id) as total
-            FROM accesos a1
-            LEFT JOIN accesos a2 ON a1.visitante_id = a2.visitante_id 
-                AND a2.tipo = 'salida' 
-                AND a2.fecha_hora > a1.fecha_hora
-            WHERE a1.tipo = 'entrada' 
-                AND a2.id IS NULL
-                AND DATE(a1.fecha_hora) = CURDATE()
-        """)
-        estadisticas['visitantes_dentro'] = cursor.fetchone()['total']
+        # Listados compartidos: se leen una vez cada DASHBOARD_STATS_SEGUNDOS
+        # (o tras un evento) y se muestran según los permisos de cada usuario
+        permisos = usuario_actual['permisos'] if usuario_actual else ()
+        if VER_VISITANTES in permisos:
+            estadisticas['presentes'] = _listado_dashboard('presentes', CONSULTA_PRESENTES)
         
         # Accesos recientes (últimos 10)
-        if usuario_actual and 'acceso.ver_registro_accesos' in usuario_actual['permisos']:
-            cursor.execute("""
-                SELECT a.*, v.nombre as visitante_nombre, u.nombre as usuario_nombre
-                FROM accesos a
-                LEFT JOIN visitantes v ON a.visitante_id = v.id
-                LEFT JOIN usuarios u ON a.usuario_id = u.id
-                WHERE a.tipo IN ('entrada', 'salida')
-                ORDER BY a.fecha_hora DESC
-                LIMIT 10
-            """)
-            estadisticas['accesos_recientes'] = cursor.fetchall()
+        if VER_REGISTRO_ACCESOS in permisos:
+            estadisticas['accesos_recientes'] = _listado_dashboard('accesos_recientes', CONSULTA_ACCESOS_RECIENTES)
         
         # Alertas recientes no revisadas
-        if usuario_actual and 'alertas.ver_alertas' in usuario_actual['permisos']:
-            cursor.execute("""
-                SELECT * FROM alertas 
-                WHERE nivel IN ('alto', 'medio')
-                ORDER BY fecha DESC
-                LIMIT 5
-            """)
-            estadisticas['alertas_recientes'] = cursor.fetchall()
-            
+        if VER_ALERTAS in permisos:
+            estadisticas['alertas_recientes'] = _listado_dashboard('alertas_recientes', CONSULTA_ALERTAS_RECIENTES)
+        
+    except Exception as e:
+        print(f"Error al obtener estadísticas: {e}")
+    
+    return render_template('dashboard.html', estadisticas=estadisticas)
+
+@login_required
+def estadisticas_dashboard():
+    """API JSON con los contadores del dashboard (consultada periódicamente por script.js)"""
+    try:
+        datos = _contadores_visibles(obtener_usuario_actual(), obtener_contadores())
     except Exception as e:
         print(f"Error al obtener estadísticas: {e}")
-    finally:
-        cursor.close()
-        conn.close()
+        return jsonify({'error': 'No se pudieron obtener las estadísticas'}), 503
+    
+    cuerpo = json.dumps(datos, sort_keys=True)
+    respuesta = Response(cuerpo, mimetype='application/json')
+    respuesta.set_etag(hashlib.md5(cuerpo.encode()).hexdigest())
+    respuesta.cache_control.private = True
+    respuesta.cache_control.no_cache = True
+    return respuesta.make_conditional(request)
+
+@login_required
+def eventos_dashboard():
+    """Flujo Server-Sent Events con contadores, accesos y alertas en vivo"""
+    usuario_actual = obtener_usuario_actual()
+    permisos = usuario_actual['permisos'] if usuario_actual else ()
+    
+    suscripcion = bus_eventos.suscribir()
+    if suscripcion is None:
+        return jsonify({'error': 'Demasiadas conexiones en vivo'}), 503
+    
+    def estado():
+        try:
+            return 'contadores', _contadores_visibles(usuario_actual, obtener_contadores())
+        except Exception as e:
+            print(f"Error al obtener estadísticas: {e}")
+            return 'contadores', {}
+    
+    def adaptar(tipo, datos):
+        if tipo == 'alerta' and VER_ALERTAS not in permisos:
+            return None
+        if tipo == 'acceso' and VER_REGISTRO_ACCESOS not in permisos:
+            # Sin permiso sobre el historial solo se envían los incrementos de contadores
+            return {'incrementos': datos['incrementos']}
+        return datos
     
-    return render_template('dashboard.html', estadisticas=estadisticas)
\ No newline at end of file
+    # Sin stream_with_context: el flujo no mantiene viva la petición (ni su
+    # lista de conexiones prestadas); usuario y permisos ya se copiaron arriba.
+    # Ninguna conexión del pool queda retenida entre eventos: solo se usa una,
+    # brevemente, cuando la caché de contadores está vencida
+    respuesta = Response(transmitir(suscripcion, adaptar, estado), mimetype='text/event-stream')
+    respuesta.headers['Cache-Control'] = 'no-cache'
+    respuesta.headers['X-Accel-Buffering'] = 'no'
+    return respuesta
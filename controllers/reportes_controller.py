@@ -1,12 +1,41 @@
-from flask import render_template, request, redirect, url_for, session, flash, send_file
-from models.database import Database
+from flask import render_template, request, redirect, url_for, session, flash, send_file, Response, stream_with_context, jsonify, abort
+from models.database import Database, ErrorConexion
 from auth.auth import login_required, permiso_requerido
 from auth.permissions import VER_REPORTES, GENERAR_REPORTES, EXPORTAR_REPORTES
-import csv
 import io
+import os
+import re
+import hashlib
+import time
+import config
+from contextlib import ExitStack
+from werkzeug.utils import secure_filename
 from datetime import datetime, timedelta
-from utils.time_utils import app_now
+from utils.time_utils import app_now, app_now_date, rango_fechas, tramos_fechas
+from utils.paginacion_utils import decodificar_cursor, clausula_keyset, paginar_keyset
+from utils.exportacion_utils import filas_en_lotes, generar_csv
+from utils.rollup_utils import resumen_accesos, accesos_por_dia, fuera_de_horario, rollup_inicializado
 from utils.pdf_utils import generar_pdf_reporte
+from utils.trabajos_utils import trabajos_pdf, trabajos_pdf_periodos
+from utils.cache_reportes_utils import cache_reportes
+from utils.cache_utils import cache_for
+
+# Cambiar al modificar el formato del PDF para no servir archivos cacheados con el formato anterior
+VERSION_PDF = 2
+# Claves de PDF: hash con marca de agua (períodos abiertos) o nombre del período cerrado
+_PATRON_CLAVE = re.compile(r'^([0-9a-f]{32}|[a-z]+_\d{8}_\d{8}_v\d+)$')
+TIPOS_REPORTE = ('diario', 'mensual')
+
+
+def _nombre_archivo(tipo, fecha_inicio, fecha_fin, extension):
+    nombre = f"reporte_accesos_{tipo}_{fecha_inicio}"
+    if tipo == 'mensual':
+        nombre += f"_{fecha_fin}"
+    return nombre + extension
+
+def _gestor_pdf(clave):
+    """Gestor de trabajos que guarda el PDF de la clave"""
+    return trabajos_pdf if re.fullmatch(r'[0-9a-f]{32}', clave) else trabajos_pdf_periodos
 
 @login_required
 @permiso_requerido(GENERAR_REPORTES)
@@ -18,6 +47,10 @@ def generar_reporte():
         fecha_fin = request.form.get('fecha_fin', fecha_inicio)
         formato = request.form.get('formato', 'html')
         
+        if tipo_reporte not in TIPOS_REPORTE:
+            flash('Tipo de reporte inválido', 'danger')
+            return redirect(url_for('generar_reporte'))
+        
         # Validar fechas
         try:
             fecha_inicio_dt = datetime.strptime(fecha_inicio, '%Y-%m-%d')
@@ -26,12 +59,7 @@ def generar_reporte():
                 if fecha_fin_dt < fecha_inicio_dt:
                     flash('La fecha fin no puede ser anterior a la fecha inicio', 'danger')
                     return redirect(url_for('generar_reporte'))
-                
-                # Validar que el rango no sea mayor a 31 días
-                dias_diferencia = (fecha_fin_dt - fecha_inicio_dt).days
-                if dias_diferencia > 31:
-                    flash('El rango de fechas no puede ser mayor a 31 días', 'danger')
-                    return redirect(url_for('generar_reporte'))
+                # Sin límite de días: los reportes recorren el rango por tramos
         except ValueError:
             flash('Formato de fecha inválido', 'danger')
             return redirect(url_for('generar_reporte'))
@@ -72,32 +100,34 @@ def ver_reporte():
     fecha_inicio = params['fecha_inicio']
     fecha_fin = params['fecha_fin']
     
-    db = Database()
-    conn = db.conectar()
-    if not conn:
-        flash('Error de conexión a la base de datos', 'danger')
-        return redirect(url_for('generar_reporte'))
+    inicio, fin = rango_fechas(fecha_inicio, fecha_inicio if tipo == 'diario' else fecha_fin)
+    antes = decodificar_cursor(request.args.get('antes'))
+    despues = None if antes else decodificar_cursor(request.args.get('despues'))
+    por_pagina = config.REPORTE_DETALLE_POR_PAGINA
     
+    db = Database()
     try:
-        cursor = conn.cursor(dictionary=True)
-        
-        if tipo == 'diario':
-            # Reporte diario
-            cursor.execute("""
-                SELECT 
-                    a.*, 
-                    v.nombre as visitante, 
-                    u.nombre as guardia,
-                    v.empresa as empresa_visitante
-                FROM accesos a 
-                LEFT JOIN visitantes v ON a.visitante_id = v.id 
-                LEFT JOIN usuarios u ON a.usuario_id = u.id 
-                WHERE DATE(a.fecha_hora) = %s
-                ORDER BY a.fecha_hora DESC
-            """, (fecha_inicio,))
-        else:
-            # Reporte mensual
-            cursor.execute("""
+        # Transacción: la lectura del resumen puede poner al día el rollup diario
+        with db.transaccion() as cursor:
+            # Resumen y desglose por día (rollup para días cerrados, accesos crudos solo para hoy),
+            # cacheados por período: permanente si ya cerró, unos segundos si incluye hoy
+            def calcular_resumen():
+                ultimo_dia = fin.date() - timedelta(days=1)
+                resumen = resumen_accesos(cursor, inicio.date(), ultimo_dia)
+                # Mismas reglas de horario que el control de acceso (rollup para días cerrados)
+                resumen['accesos_fuera_horario'] = fuera_de_horario(cursor, inicio.date(), ultimo_dia)
+                return (resumen,
+                        accesos_por_dia(cursor, inicio.date(), ultimo_dia) if tipo == 'mensual' else [])
+            if rollup_inicializado(cursor):
+                estadisticas, accesos_dias = cache_reportes.obtener(tipo, inicio, fin, calcular_resumen)
+            else:
+                # Totales desde los accesos crudos hasta que init_db.py cargue el historial: sin caché
+                estadisticas, accesos_dias = calcular_resumen()
+            
+            # Detalle paginado por cursor: cada página cuesta lo mismo sin importar el largo del rango
+            condicion, params_cursor, orden = clausula_keyset(
+                'a.fecha_hora', 'a.id', antes or despues, descendente=True, retroceder=despues is not None)
+            query = """
                 SELECT 
                     a.*, 
                     v.nombre as visitante, 
@@ -106,51 +136,34 @@ def ver_reporte():
                 FROM accesos a 
                 LEFT JOIN visitantes v ON a.visitante_id = v.id 
                 LEFT JOIN usuarios u ON a.usuario_id = u.id 
-                WHERE DATE(a.fecha_hora) BETWEEN %s AND %s
-                ORDER BY a.fecha_hora DESC
-            """, (fecha_inicio, fecha_fin))
+                WHERE a.fecha_hora >= %s AND a.fecha_hora < %s
+            """
+            params_consulta = [inicio, fin]
+            if condicion:
+                query += f" AND {condicion}"
+                params_consulta.extend(params_cursor)
+            query += f" ORDER BY {orden} LIMIT %s"
+            params_consulta.append(por_pagina + 1)
+            cursor.execute(query, params_consulta)
+            accesos = cursor.fetchall()
         
-        accesos = cursor.fetchall()
-        
-        # Estadísticas detalladas
-        if tipo == 'diario':
-            cursor.execute("""
-                SELECT 
-                    COUNT(*) as total_accesos,
-                    SUM(CASE WHEN autorizado = 1 THEN 1 ELSE 0 END) as accesos_autorizados,
-                    SUM(CASE WHEN autorizado = 0 THEN 1 ELSE 0 END) as accesos_denegados,
-                    COUNT(DISTINCT visitante_id) as visitantes_unicos,
-                    SUM(CASE WHEN tipo = 'entrada' THEN 1 ELSE 0 END) as total_entradas,
-                    SUM(CASE WHEN tipo = 'salida' THEN 1 ELSE 0 END) as total_salidas
-                FROM accesos 
-                WHERE DATE(fecha_hora) = %s
-            """, (fecha_inicio,))
-        else:
-            cursor.execute("""
-                SELECT 
-                    COUNT(*) as total_accesos,
-                    SUM(CASE WHEN autorizado = 1 THEN 1 ELSE 0 END) as accesos_autorizados,
-                    SUM(CASE WHEN autorizado = 0 THEN 1 ELSE 0 END) as accesos_denegados,
-                    COUNT(DISTINCT visitante_id) as visitantes_unicos,
-                    SUM(CASE WHEN tipo = 'entrada' THEN 1 ELSE 0 END) as total_entradas,
-                    SUM(CASE WHEN tipo = 'salida' THEN 1 ELSE 0 END) as total_salidas
-                FROM accesos 
-                WHERE DATE(fecha_hora) BETWEEN %s AND %s
-            """, (fecha_inicio, fecha_fin))
-        
-        estadisticas = cursor.fetchone()
-        
-        cursor.close()
-        conn.close()
+        accesos, cursor_anterior, cursor_siguiente = paginar_keyset(
+            accesos, por_pagina, hay_cursor=bool(antes or despues), retroceder=despues is not None)
         
         return render_template('reportes/ver.html', 
                              accesos=accesos, 
                              estadisticas=estadisticas,
+                             accesos_dias=accesos_dias,
+                             cursor_anterior=cursor_anterior,
+                             cursor_siguiente=cursor_siguiente,
                              tipo=tipo,
                              fecha_inicio=fecha_inicio,
                              fecha_fin=fecha_fin,
                              now=app_now())
         
+    except ErrorConexion:
+        flash('Error de conexión a la base de datos', 'danger')
+        return redirect(url_for('generar_reporte'))
     except Exception as e:
         print(f"Error al generar reporte: {e}")
         flash('Error al generar el reporte', 'danger')
@@ -159,7 +172,7 @@ def ver_reporte():
 @login_required
 @permiso_requerido(EXPORTAR_REPORTES)
 def exportar_reporte_csv():
-    """Exportar reporte a CSV"""
+    """Exportar reporte a CSV (en streaming: memoria constante y primer byte inmediato)"""
     if 'reporte_params' not in session:
         flash('No hay parámetros de reporte configurados', 'warning')
         return redirect(url_for('generar_reporte'))
@@ -168,33 +181,50 @@ def exportar_reporte_csv():
     tipo = params['tipo']
     fecha_inicio = params['fecha_inicio']
     fecha_fin = params['fecha_fin']
+    inicio, fin = rango_fechas(fecha_inicio, fecha_inicio if tipo == 'diario' else fecha_fin)
+    nombre_archivo = _nombre_archivo(tipo, fecha_inicio, fecha_fin, '.csv')
     
+    # Período cerrado ya exportado: se sirve el archivo guardado sin consultar la base de datos
+    cerrado = cache_reportes.es_cerrado(fin)
+    ruta_cache = cache_reportes.ruta(tipo, inicio, fin, '.csv')
+    if cerrado and os.path.exists(ruta_cache):
+        return send_file(ruta_cache, mimetype='text/csv', as_attachment=True, download_name=nombre_archivo)
+    
+    # La conexión se abre aquí para poder informar errores antes de empezar a
+    # enviar; el generador la libera al terminar (o si el cliente corta).
+    # Las consultas de cada tramo se lanzan a medida que se envía el archivo.
     db = Database()
-    conn = db.conectar()
-    if not conn:
+    recursos = ExitStack()
+    try:
+        cursor = recursos.enter_context(db.cursor(dictionary=False))
+        cursor.execute("SET SESSION net_write_timeout = %s", (config.EXPORTACION_NET_WRITE_TIMEOUT,))
+    except ErrorConexion:
+        recursos.close()
         flash('Error de conexión a la base de datos', 'danger')
         return redirect(url_for('generar_reporte'))
+    except Exception as e:
+        recursos.close()
+        print(f"Error al exportar CSV: {e}")
+        flash('Error al exportar el reporte', 'danger')
+        return redirect(url_for('generar_reporte'))
     
-    try:
-        cursor = conn.cursor(dictionary=True)
-        
-        if tipo == 'diario':
-            cursor.execute("""
-                SELECT 
-                    a.fecha_hora,
-                    v.nombre as visitante,
-                    v.identificacion,
-                    v.empresa,
-                    a.tipo,
-                    CASE WHEN a.autorizado THEN 'Sí' ELSE 'No' END as autorizado,
-                    u.nombre as guardia 
-                FROM accesos a 
-                LEFT JOIN visitantes v ON a.visitante_id = v.id 
-                LEFT JOIN usuarios u ON a.usuario_id = u.id 
-                WHERE DATE(a.fecha_hora) = %s
-                ORDER BY a.fecha_hora DESC
-            """, (fecha_inicio,))
-        else:
+    def formatear(fila):
+        fecha_hora, visitante, identificacion, empresa, tipo_acceso, autorizado, guardia = fila
+        return [
+            fecha_hora.strftime('%Y-%m-%d %I:%M %p'),
+            visitante or 'N/A',
+            identificacion or 'N/A',
+            empresa or 'N/A',
+            tipo_acceso.capitalize(),
+            'Sí' if autorizado else 'No',
+            guardia or 'Sistema'
+        ]
+    
+    def lotes():
+        # El rango se recorre por tramos (del más reciente al más antiguo): cada
+        # consulta es corta y acotada aunque el reporte abarque años
+        for desde, hasta in tramos_fechas(inicio, fin, config.REPORTE_TRAMO_DIAS):
+            # Cursor sin buffer: las filas se leen del servidor a medida que se envían
             cursor.execute("""
                 SELECT 
                     a.fecha_hora,
@@ -202,65 +232,87 @@ def exportar_reporte_csv():
                     v.identificacion,
                     v.empresa,
                     a.tipo,
-                    CASE WHEN a.autorizado THEN 'Sí' ELSE 'No' END as autorizado,
+                    a.autorizado,
                     u.nombre as guardia 
                 FROM accesos a 
                 LEFT JOIN visitantes v ON a.visitante_id = v.id 
                 LEFT JOIN usuarios u ON a.usuario_id = u.id 
-                WHERE DATE(a.fecha_hora) BETWEEN %s AND %s
+                WHERE a.fecha_hora >= %s AND a.fecha_hora < %s
                 ORDER BY a.fecha_hora DESC
-            """, (fecha_inicio, fecha_fin))
-        
-        accesos = cursor.fetchall()
-        cursor.close()
-        conn.close()
-        
-        # Crear CSV en memoria
-        output = io.StringIO()
-        writer = csv.writer(output)
-        
-        # Escribir encabezados
-        writer.writerow([
-            'Fecha/Hora', 'Visitante', 'Identificación', 'Empresa', 
-            'Tipo', 'Autorizado', 'Guardia'
-        ])
-        
-        # Escribir datos
-        for acceso in accesos:
-            writer.writerow([
-                acceso['fecha_hora'].strftime('%Y-%m-%d %I:%M %p'),
-                acceso['visitante'] or 'N/A',
-                acceso['identificacion'] or 'N/A',
-                acceso['empresa'] or 'N/A',
-                acceso['tipo'].capitalize(),
-                acceso['autorizado'],
-                acceso['guardia'] or 'Sistema'
-            ])
-        
-        output.seek(0)
-        
-        # Crear nombre de archivo
-        nombre_archivo = f"reporte_accesos_{tipo}_{fecha_inicio}"
-        if tipo == 'mensual':
-            nombre_archivo += f"_{fecha_fin}"
-        nombre_archivo += ".csv"
-        
-        return send_file(
-            io.BytesIO(output.getvalue().encode('utf-8-sig')),
-            download_name=nombre_archivo,
-            as_attachment=True,
-            mimetype='text/csv'
-        )
+            """, (desde, hasta))
+            yield from filas_en_lotes(cursor, config.EXPORTACION_LOTE_FILAS)
+    
+    def contenido():
+        try:
+            partes = generar_csv(
+                ['Fecha/Hora', 'Visitante', 'Identificación', 'Empresa', 'Tipo', 'Autorizado', 'Guardia'],
+                lotes(),
+                formatear)
+            if cerrado:
+                # Se guarda a la vez que se envía; solo queda en caché si se completó
+                with cache_reportes.escribir(ruta_cache) as archivo:
+                    for parte in partes:
+                        archivo.write(parte)
+                        yield parte
+            else:
+                yield from partes
+        except Exception as e:
+            # Las cabeceras ya se enviaron: solo queda registrar el error y cortar
+            print(f"Error al exportar CSV: {e}")
+        finally:
+            recursos.close()
+    
+    return Response(
+        stream_with_context(contenido()),
+        mimetype='text/csv',
+        headers={'Content-Disposition': f'attachment; filename="{nombre_archivo}"'}
+    )
+
+def _generar_pdf(tipo, fecha_inicio, fecha_fin, inicio, fin):
+    """Consultar los accesos del rango y renderizar el PDF (se ejecuta en segundo plano)
+
+    Las filas se leen tramo a tramo y se entregan al PDF como generador:
+    en memoria solo está el tramo en curso, no todo el rango.
+    """
+    with Database().cursor() as cursor:
+        cursor.execute("SELECT COUNT(*) as total FROM accesos WHERE fecha_hora >= %s AND fecha_hora < %s",
+                       (inicio, fin))
+        total = int(cursor.fetchone()['total'] or 0)
+    
+    titulo = f"Reporte de Accesos - {tipo.capitalize()}"
+    if total > config.REPORTE_PDF_MAX_FILAS:
+        # Aun leyendo por tramos, reportlab guarda cada página hasta el final:
+        # el detalle de períodos enormes se deja al CSV y el PDF lleva el resumen
+        with Database().transaccion() as cursor:
+            resumen = resumen_accesos(cursor, inicio.date(), fin.date() - timedelta(days=1))
+        return generar_pdf_reporte(None, tipo, fecha_inicio, fecha_fin, titulo, total=total, resumen=resumen)
+    
+    with Database().cursor() as cursor:
+        def filas():
+            # Rango recorrido por tramos: consultas cortas aunque el período sea largo
+            for desde, hasta in tramos_fechas(inicio, fin, config.REPORTE_TRAMO_DIAS):
+                cursor.execute("""
+                    SELECT 
+                        a.fecha_hora,
+                        v.nombre as visitante,
+                        a.tipo,
+                        a.autorizado,
+                        u.nombre as guardia 
+                    FROM accesos a 
+                    LEFT JOIN visitantes v ON a.visitante_id = v.id 
+                    LEFT JOIN usuarios u ON a.usuario_id = u.id 
+                    WHERE a.fecha_hora >= %s AND a.fecha_hora < %s
+                    ORDER BY a.fecha_hora DESC
+                """, (desde, hasta))
+                yield from cursor.fetchall()
         
-    except Exception as e:
-        print(f"Error al exportar CSV: {e}")
-        flash('Error al exportar el reporte', 'danger')
-        return redirect(url_for('generar_reporte'))
+        return generar_pdf_reporte(filas(), tipo, fecha_inicio, fecha_fin, titulo, total=total)
+
 
 @login_required
 @permiso_requerido(EXPORTAR_REPORTES)
 def exportar_reporte_pdf():
-    """Exportar reporte a PDF"""
+    """Exportar reporte a PDF: se sirve desde la caché en disco o se genera en segundo plano"""
     if 'reporte_params' not in session:
         flash('No hay parámetros de reporte configurados', 'warning')
         return redirect(url_for('generar_reporte'))
@@ -268,140 +320,131 @@ def exportar_reporte_pdf():
     params = session['reporte_params']
     tipo = params['tipo']
     fecha_inicio = params['fecha_inicio']
-    fecha_fin = params['fecha_fin']
+    fecha_fin = params['fecha_fin'] if tipo == 'mensual' else fecha_inicio
+    inicio, fin = rango_fechas(fecha_inicio, fecha_fin)
+    nombre_archivo = _nombre_archivo(tipo, fecha_inicio, fecha_fin, '.pdf')
     
-    db = Database()
-    conn = db.conectar()
-    if not conn:
-        flash('Error de conexión a la base de datos', 'danger')
-        return redirect(url_for('generar_reporte'))
+    # Período cerrado: la clave es el propio período y no hace falta consultar la marca de agua
+    if cache_reportes.es_cerrado(fin):
+        clave = os.path.basename(cache_reportes.ruta(tipo, inicio, fin, f'_v{VERSION_PDF}'))
+        return _servir_pdf(trabajos_pdf_periodos, clave, nombre_archivo, tipo, fecha_inicio, fecha_fin, inicio, fin)
     
+    db = Database()
     try:
-        cursor = conn.cursor(dictionary=True)
-        
-        if tipo == 'diario':
+        # Marca de agua de los datos del rango (consulta solo sobre el índice de
+        # fecha): si cambia cualquier acceso del período cambia la clave
+        with db.cursor() as cursor:
             cursor.execute("""
-                SELECT 
-                    a.fecha_hora,
-                    v.nombre as visitante,
-                    a.tipo,
-                    a.autorizado,
-                    u.nombre as guardia 
-                FROM accesos a 
-                LEFT JOIN visitantes v ON a.visitante_id = v.id 
-                LEFT JOIN usuarios u ON a.usuario_id = u.id 
-                WHERE DATE(a.fecha_hora) = %s
-                ORDER BY a.fecha_hora DESC
-            """, (fecha_inicio,))
-        else:
-            cursor.execute("""
-                SELECT 
-                    a.fecha_hora,
-                    v.nombre as visitante,
-                    a.tipo,
-                    a.autorizado,
-                    u.nombre as guardia 
-                FROM accesos a 
-                LEFT JOIN visitantes v ON a.visitante_id = v.id 
-                LEFT JOIN usuarios u ON a.usuario_id = u.id 
-                WHERE DATE(a.fecha_hora) BETWEEN %s AND %s
-                ORDER BY a.fecha_hora DESC
-            """, (fecha_inicio, fecha_fin))
-        
-        accesos = cursor.fetchall()
-        cursor.close()
-        conn.close()
-        
-        # Generar PDF
-        titulo = f"Reporte de Accesos - {tipo.capitalize()}"
-        pdf_content = generar_pdf_reporte(
-            accesos, 
-            tipo, 
-            fecha_inicio, 
-            fecha_fin, 
-            titulo
-        )
-        
-        # Crear nombre de archivo
-        nombre_archivo = f"reporte_accesos_{tipo}_{fecha_inicio}"
-        if tipo == 'mensual':
-            nombre_archivo += f"_{fecha_fin}"
-        nombre_archivo += ".pdf"
-        
-        return send_file(
-            io.BytesIO(pdf_content),
-            download_name=nombre_archivo,
-            as_attachment=True,
-            mimetype='application/pdf'
-        )
-        
+                SELECT COUNT(*) as total, COALESCE(MAX(id), 0) as ultimo_id
+                FROM accesos
+                WHERE fecha_hora >= %s AND fecha_hora < %s
+            """, (inicio, fin))
+            marca = cursor.fetchone()
+    except ErrorConexion:
+        flash('Error de conexión a la base de datos', 'danger')
+        return redirect(url_for('generar_reporte'))
     except Exception as e:
         print(f"Error al exportar PDF: {e}")
         flash('Error al exportar el reporte PDF', 'danger')
         return redirect(url_for('generar_reporte'))
+    
+    # Conteo y último id cambian con cada acceso nuevo, pero no con ediciones o
+    # borrados (p. ej. el nombre de un visitante): además, como la vista HTML,
+    # el PDF de un período abierto vale como máximo REPORTES_CACHE_HOY_SEGUNDOS
+    ventana = int(time.time() // max(1, config.REPORTES_CACHE_HOY_SEGUNDOS))
+    clave = hashlib.sha256(
+        f"{VERSION_PDF}|{tipo}|{fecha_inicio}|{fecha_fin}|{marca['total']}|{marca['ultimo_id']}|{ventana}".encode()
+    ).hexdigest()[:32]
+    return _servir_pdf(trabajos_pdf, clave, nombre_archivo, tipo, fecha_inicio, fecha_fin, inicio, fin)
+
+def _servir_pdf(gestor, clave, nombre_archivo, *args):
+    """Redirigir a la descarga si el PDF ya existe o lanzar su generación"""
+    if gestor.estado(clave) == 'listo':
+        return redirect(url_for('descargar_reporte_pdf', clave=clave, nombre=nombre_archivo))
+    
+    gestor.enviar(clave, _generar_pdf, *args)
+    return redirect(url_for('estado_reporte_pdf', clave=clave, nombre=nombre_archivo))
 
 @login_required
-@permiso_requerido(VER_REPORTES)
-def reporte_estadisticas():
-    """Reporte de estadísticas generales"""
-    db = Database()
-    conn = db.conectar()
-    if not conn:
-        flash('Error de conexión a la base de datos', 'danger')
-        return render_template('reportes/estadisticas.html', estadisticas={})
+@permiso_requerido(EXPORTAR_REPORTES)
+def estado_reporte_pdf(clave):
+    """Página (o JSON con ?formato=json) con el estado de un PDF en preparación"""
+    if not _PATRON_CLAVE.match(clave):
+        abort(404)
+    estado = _gestor_pdf(clave).estado(clave)
+    nombre = request.args.get('nombre', 'reporte_accesos.pdf')
     
-    try:
-        cursor = conn.cursor(dictionary=True)
-        
+    if request.args.get('formato') == 'json':
+        return jsonify({
+            'estado': estado,
+            'descarga': url_for('descargar_reporte_pdf', clave=clave, nombre=nombre) if estado == 'listo' else None
+        })
+    return render_template('reportes/pdf_estado.html', clave=clave, estado=estado, nombre=nombre)
+
+@login_required
+@permiso_requerido(EXPORTAR_REPORTES)
+def descargar_reporte_pdf(clave):
+    """Descargar un PDF ya generado"""
+    if not _PATRON_CLAVE.match(clave) or _gestor_pdf(clave).estado(clave) != 'listo':
+        flash('El reporte PDF no está disponible; vuelva a generarlo', 'warning')
+        return redirect(url_for('generar_reporte'))
+    return send_file(
+        _gestor_pdf(clave).ruta(clave),
+        download_name=secure_filename(request.args.get('nombre', '')) or 'reporte_accesos.pdf',
+        as_attachment=True,
+        mimetype='application/pdf'
+    )
+
+@cache_for(config.ESTADISTICAS_CACHE_SEGUNDOS, servir_vencido=True)
+def _calcular_estadisticas():
+    """Datos del reporte de estadísticas (iguales para todos: se comparten entre peticiones)"""
+    db = Database()
+    # Transacción: la serie diaria puede poner al día el rollup
+    with db.transaccion() as cursor:
         # Estadísticas generales
         cursor.execute("""
             SELECT 
                 (SELECT COUNT(*) FROM visitantes WHERE estado = 'activo') as visitantes_activos,
                 (SELECT COUNT(*) FROM usuarios WHERE estado = 'activo') as usuarios_activos,
-                (SELECT COUNT(*) FROM accesos WHERE DATE(fecha_hora) = CURDATE()) as accesos_hoy,
-                (SELECT COUNT(*) FROM alertas WHERE DATE(fecha) = CURDATE()) as alertas_hoy,
+                (SELECT COUNT(*) FROM accesos
+                    WHERE fecha_hora >= CURDATE() AND fecha_hora < CURDATE() + INTERVAL 1 DAY) as accesos_hoy,
+                (SELECT COUNT(*) FROM alertas
+                    WHERE fecha >= CURDATE() AND fecha < CURDATE() + INTERVAL 1 DAY) as alertas_hoy,
                 (SELECT COUNT(*) FROM credenciales WHERE estado = 'activa') as credenciales_activas
         """)
         estadisticas = cursor.fetchone()
-        
-        # Accesos por día (últimos 7 días)
-        cursor.execute("""
-            SELECT 
-                DATE(fecha_hora) as fecha,
-                COUNT(*) as total,
-                SUM(CASE WHEN tipo = 'entrada' THEN 1 ELSE 0 END) as entradas,
-                SUM(CASE WHEN tipo = 'salida' THEN 1 ELSE 0 END) as salidas,
-                SUM(CASE WHEN autorizado = 0 THEN 1 ELSE 0 END) as denegados
-            FROM accesos 
-            WHERE fecha_hora >= DATE_SUB(CURDATE(), INTERVAL 7 DAY)
-            GROUP BY DATE(fecha_hora)
-            ORDER BY fecha DESC
-        """)
-        accesos_7_dias = cursor.fetchall()
-        
-        # Visitantes más frecuentes
+    
+        # Accesos por día (últimos 7 días, desde el rollup diario)
+        hoy = app_now_date()
+        accesos_7_dias = accesos_por_dia(cursor, hoy - timedelta(days=7), hoy)
+    
+        # Visitantes más frecuentes (contador mantenido por control de acceso)
         cursor.execute("""
-            SELECT 
-                v.nombre,
-                v.empresa,
-                COUNT(*) as total_visitas
-            FROM accesos a
-            JOIN visitantes v ON a.visitante_id = v.id
-            WHERE a.tipo = 'entrada'
-            GROUP BY v.id, v.nombre, v.empresa
+            SELECT nombre, empresa, total_visitas
+            FROM visitantes
+            WHERE total_visitas > 0
             ORDER BY total_visitas DESC
             LIMIT 10
         """)
         visitantes_frecuentes = cursor.fetchall()
-        
-        cursor.close()
-        conn.close()
+    
+    return estadisticas, accesos_7_dias, visitantes_frecuentes
+
+@login_required
+@permiso_requerido(VER_REPORTES)
+def reporte_estadisticas():
+    """Reporte de estadísticas generales"""
+    try:
+        estadisticas, accesos_7_dias, visitantes_frecuentes = _calcular_estadisticas()
         
         return render_template('reportes/estadisticas.html',
                              estadisticas=estadisticas,
                              accesos_7_dias=accesos_7_dias,
                              visitantes_frecuentes=visitantes_frecuentes)
         
+    except ErrorConexion:
+        flash('Error de conexión a la base de datos', 'danger')
+        return render_template('reportes/estadisticas.html', estadisticas={})
     except Exception as e:
         print(f"Error al generar reporte de estadísticas: {e}")
         flash('Error al generar el reporte de estadísticas', 'danger')
@@ -0,0 +1,20 @@
+from flask import jsonify
+from auth.auth import login_required, permiso_requerido
+from auth.permissions import CONFIGURAR_SISTEMA
+from utils.db_utils import get_pool_stats
+from utils.eventos_utils import bus_eventos
+from utils.indice_credenciales_utils import indice_credenciales
+from utils.escritura_diferida_utils import escritura_diferida
+from utils.cache_utils import cache
+
+@login_required
+@permiso_requerido(CONFIGURAR_SISTEMA)
+def metricas():
+    """API con métricas internas del proceso (pool de conexiones, etc.)"""
+    return jsonify({
+        'pool': get_pool_stats(),
+        'eventos': bus_eventos.estadisticas(),
+        'credenciales': indice_credenciales.estadisticas(),
+        'escritura_diferida': escritura_diferida.estadisticas(),
+        'cache': cache.estadisticas()
+    })
@@ -1,5 +1,5 @@
 from flask import render_template, request, redirect, url_for, session, flash
-from models.database import Database
+from models.database import Database, ErrorConexion, invalidar_cache_permisos
 from auth.auth import login_required, permiso_requerido
 from auth.permissions import *
 
@@ -8,32 +8,26 @@ from auth.permissions import *
 def listar_usuarios():
     """Listar todos los usuarios del sistema"""
     db = Database()
-    conn = db.conectar()
-    if not conn:
-        flash('Error de conexión a la base de datos', 'danger')
-        return render_template('usuarios/listar.html', usuarios=[], roles=[])
-    
     try:
-        cursor = conn.cursor(dictionary=True)
-        
-        cursor.execute("""
-            SELECT u.*, r.nombre as rol_nombre, r.descripcion as rol_descripcion
-            FROM usuarios u 
-            JOIN roles r ON u.rol_id = r.id 
-            ORDER BY u.id ASC
-        """)
-        
-        usuarios = cursor.fetchall()
-        
-        # Obtener lista de roles para el formulario
-        cursor.execute("SELECT * FROM roles ORDER BY nombre")
-        roles = cursor.fetchall()
-        
-        cursor.close()
-        conn.close()
+        with db.cursor() as cursor:
+            cursor.execute("""
+                SELECT u.*, r.nombre as rol_nombre, r.descripcion as rol_descripcion
+                FROM usuarios u 
+                JOIN roles r ON u.rol_id = r.id 
+                ORDER BY u.id ASC
+            """)
+            
+            usuarios = cursor.fetchall()
+            
+            # Obtener lista de roles para el formulario
+            cursor.execute("SELECT * FROM roles ORDER BY nombre")
+            roles = cursor.fetchall()
         
         return render_template('usuarios/listar.html', usuarios=usuarios, roles=roles)
         
+    except ErrorConexion:
+        flash('Error de conexión a la base de datos', 'danger')
+        return render_template('usuarios/listar.html', usuarios=[], roles=[])
     except Exception as e:
         print(f"Error al listar usuarios: {e}")
         flash('Error al cargar la lista de usuarios', 'danger')
@@ -43,6 +37,7 @@ def listar_usuarios():
 @permiso_requerido(CREAR_USUARIOS)
 def agregar_usuario():
     """Agregar nuevo usuario al sistema"""
+    db = Database()
     if request.method == 'POST':
         nombre = request.form['nombre']
         correo = request.form['correo']
@@ -55,48 +50,35 @@ def agregar_usuario():
             flash('La contraseña debe tener al menos 8 caracteres', 'danger')
             return redirect(url_for('agregar_usuario'))
         
-        db = Database()
-        conn = db.conectar()
-        if not conn:
-            flash('Error de conexión a la base de datos', 'danger')
-            return redirect(url_for('agregar_usuario'))
-        
         try:
-            cursor = conn.cursor()
             contrasena_hash = db.hash_contrasena(contrasena)
+            with db.transaccion(dictionary=False) as cursor:
+                cursor.execute("""
+                    INSERT INTO usuarios (nombre, correo, contrasena, rol_id, estado)
+                    VALUES (%s, %s, %s, %s, %s)
+                """, (nombre, correo, contrasena_hash, rol_id, estado))
             
-            cursor.execute("""
-                INSERT INTO usuarios (nombre, correo, contrasena, rol_id, estado)
-                VALUES (%s, %s, %s, %s, %s)
-            """, (nombre, correo, contrasena_hash, rol_id, estado))
-            
-            conn.commit()
             flash('Usuario creado exitosamente', 'success')
             return redirect(url_for('listar_usuarios'))
             
+        except ErrorConexion:
+            flash('Error de conexión a la base de datos', 'danger')
+            return redirect(url_for('agregar_usuario'))
         except Exception as e:
-            conn.rollback()
             if 'correo' in str(e).lower():
                 flash('El correo electrónico ya está registrado', 'danger')
             else:
                 flash(f'Error al crear usuario: {str(e)}', 'danger')
-        finally:
-            cursor.close()
-            conn.close()
     
     # Obtener roles para el formulario
-    db = Database()
-    conn = db.conectar()
-    if not conn:
+    try:
+        with db.cursor() as cursor:
+            cursor.execute("SELECT * FROM roles ORDER BY nombre")
+            roles = cursor.fetchall()
+    except ErrorConexion:
         flash('Error de conexión a la base de datos', 'danger')
         return redirect(url_for('listar_usuarios'))
     
-    cursor = conn.cursor(dictionary=True)
-    cursor.execute("SELECT * FROM roles ORDER BY nombre")
-    roles = cursor.fetchall()
-    cursor.close()
-    conn.close()
-    
     return render_template('usuarios/agregar.html', roles=roles)
 
 @login_required
@@ -104,14 +86,7 @@ def agregar_usuario():
 def editar_usuario(id):
     """Editar usuario existente"""
     db = Database()
-    conn = db.conectar()
-    if not conn:
-        flash('Error de conexión a la base de datos', 'danger')
-        return redirect(url_for('listar_usuarios'))
-    
     try:
-        cursor = conn.cursor(dictionary=True)
-        
         if request.method == 'POST':
             nombre = request.form['nombre']
             correo = request.form['correo']
@@ -119,43 +94,46 @@ def editar_usuario(id):
             estado = request.form.get('estado', 'activo')
             cambiar_contrasena = request.form.get('cambiar_contrasena')
             
+            if cambiar_contrasena:
+                contrasena = request.form['contrasena']
+                if len(contrasena) < 8:
+                    flash('La contraseña debe tener al menos 8 caracteres', 'danger')
+                    return redirect(url_for('editar_usuario', id=id))
+            
             try:
-                if cambiar_contrasena:
-                    contrasena = request.form['contrasena']
-                    if len(contrasena) < 8:
-                        flash('La contraseña debe tener al menos 8 caracteres', 'danger')
-                        return redirect(url_for('editar_usuario', id=id))
+                with db.transaccion() as cursor:
+                    if cambiar_contrasena:
+                        contrasena_hash = db.hash_contrasena(contrasena)
+                        cursor.execute("""
+                            UPDATE usuarios 
+                            SET nombre=%s, correo=%s, contrasena=%s, rol_id=%s, estado=%s
+                            WHERE id=%s
+                        """, (nombre, correo, contrasena_hash, rol_id, estado, id))
+                    else:
+                        cursor.execute("""
+                            UPDATE usuarios 
+                            SET nombre=%s, correo=%s, rol_id=%s, estado=%s
+                            WHERE id=%s
+                        """, (nombre, correo, rol_id, estado, id))
                     
-                    contrasena_hash = db.hash_contrasena(contrasena)
-                    cursor.execute("""
-                        UPDATE usuarios 
-                        SET nombre=%s, correo=%s, contrasena=%s, rol_id=%s, estado=%s
-                        WHERE id=%s
-                    """, (nombre, correo, contrasena_hash, rol_id, estado, id))
-                else:
-                    cursor.execute("""
-                        UPDATE usuarios 
-                        SET nombre=%s, correo=%s, rol_id=%s, estado=%s
-                        WHERE id=%s
-                    """, (nombre, correo, rol_id, estado, id))
+                    # El rol o el estado pueden haber cambiado
+                    invalidar_cache_permisos(cursor)
                 
-                conn.commit()
                 flash('Usuario actualizado exitosamente', 'success')
                 return redirect(url_for('listar_usuarios'))
                 
+            except ErrorConexion:
+                raise
             except Exception as e:
-                conn.rollback()
                 flash(f'Error al actualizar usuario: {str(e)}', 'danger')
         
         # Obtener datos del usuario y roles
-        cursor.execute("SELECT * FROM usuarios WHERE id = %s", (id,))
-        usuario = cursor.fetchone()
-        
-        cursor.execute("SELECT * FROM roles ORDER BY nombre")
-        roles = cursor.fetchall()
-        
-        cursor.close()
-        conn.close()
+        with db.cursor() as cursor:
+            cursor.execute("SELECT * FROM usuarios WHERE id = %s", (id,))
+            usuario = cursor.fetchone()
+            
+            cursor.execute("SELECT * FROM roles ORDER BY nombre")
+            roles = cursor.fetchall()
         
         if not usuario:
             flash('Usuario no encontrado', 'danger')
@@ -163,6 +141,9 @@ def editar_usuario(id):
         
         return render_template('usuarios/editar.html', usuario=usuario, roles=roles)
         
+    except ErrorConexion:
+        flash('Error de conexión a la base de datos', 'danger')
+        return redirect(url_for('listar_usuarios'))
     except Exception as e:
         flash(f'Error: {str(e)}', 'danger')
         return redirect(url_for('listar_usuarios'))
@@ -172,34 +153,26 @@ def editar_usuario(id):
 def cambiar_estado_usuario(id):
     """Activar/desactivar usuario"""
     db = Database()
-    conn = db.conectar()
-    if not conn:
-        flash('Error de conexión a la base de datos', 'danger')
-        return redirect(url_for('listar_usuarios'))
-    
     try:
-        cursor = conn.cursor(dictionary=True)
-        
-        cursor.execute("SELECT * FROM usuarios WHERE id = %s", (id,))
-        usuario = cursor.fetchone()
-        
-        if not usuario:
-            flash('Usuario no encontrado', 'danger')
-            return redirect(url_for('listar_usuarios'))
-        
-        nuevo_estado = 'inactivo' if usuario['estado'] == 'activo' else 'activo'
-        
-        cursor.execute("UPDATE usuarios SET estado = %s WHERE id = %s", (nuevo_estado, id))
-        conn.commit()
+        with db.transaccion() as cursor:
+            cursor.execute("SELECT * FROM usuarios WHERE id = %s", (id,))
+            usuario = cursor.fetchone()
+            
+            if not usuario:
+                flash('Usuario no encontrado', 'danger')
+                return redirect(url_for('listar_usuarios'))
+            
+            nuevo_estado = 'inactivo' if usuario['estado'] == 'activo' else 'activo'
+            
+            cursor.execute("UPDATE usuarios SET estado = %s WHERE id = %s", (nuevo_estado, id))
+            invalidar_cache_permisos(cursor)
         
         accion = "desactivado" if nuevo_estado == 'inactivo' else "activado"
         flash(f'Usuario {accion} exitosamente', 'success')
         
+    except ErrorConexion:
+        flash('Error de conexión a la base de datos', 'danger')
     except Exception as e:
-        conn.rollback()
         flash(f'Error al cambiar estado del usuario: {str(e)}', 'danger')
-    finally:
-        cursor.close()
-        conn.close()
     
     return redirect(url_for('listar_usuarios'))
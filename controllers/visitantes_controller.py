@@ -1,63 +1,148 @@
-from flask import render_template, request, redirect, url_for, session, flash
-from models.database import Database
+from flask import render_template, request, redirect, url_for, session, flash, send_file
+from models.database import Database, ErrorConexion
 from auth.auth import login_required, permiso_requerido
 from auth.permissions import *
 import uuid
+import tempfile
 from datetime import timedelta
 from utils.time_utils import app_now
+from utils.paginacion_utils import tamano_pagina, decodificar_cursor, clausula_keyset, paginar_keyset
+from utils.busqueda_utils import es_identificacion, escapar_like, expresion_fulltext
+from utils.credenciales_utils import generar_lote_credenciales
+from utils.indice_credenciales_utils import indice_credenciales, notificar_cambio
+import config
+
+# Columnas por las que se puede ordenar el listado: clave -> (columna SQL, campo de la fila, conversor del cursor)
+ORDENES_VISITANTES = {
+    'id': ('v.id', 'id', int),
+    'nombre': ('v.nombre', 'nombre', str),
+    'visitas': ('v.total_visitas', 'total_visitas', int),
+}
+
+CONSULTA_VISITANTES = """
+    SELECT v.*, 
+           c.codigo,
+           c.estado as credencial_estado{relevancia}
+    FROM visitantes v
+    LEFT JOIN credenciales c ON v.id = c.visitante_id AND c.estado = 'activa'
+    WHERE 1=1
+"""
+
+
+def _buscar_visitantes(cursor, estado, buscar):
+    """
+    Buscar visitantes por texto devolviendo los más relevantes primero
+
+    Las identificaciones se resuelven por prefijo sobre su índice único
+    (coincidencia exacta primero); el resto usa el índice FULLTEXT de
+    nombre, identificación y empresa. Nunca se recorre la tabla completa
+    con LIKE '%...%'.
+    """
+    filtro_estado = " AND v.estado = %s" if estado else ""
+    params_estado = [estado] if estado else []
+    limite = config.VISITANTES_BUSQUEDA_LIMITE
+
+    if es_identificacion(buscar):
+        cursor.execute(
+            CONSULTA_VISITANTES.format(relevancia=", (v.identificacion = %s) as relevancia")
+            + " AND v.identificacion LIKE %s" + filtro_estado
+            + " ORDER BY relevancia DESC, v.identificacion LIMIT %s",
+            [buscar, escapar_like(buscar) + '%'] + params_estado + [limite])
+        visitantes = cursor.fetchall()
+        if visitantes:
+            return visitantes
+
+    expresion = expresion_fulltext(buscar)
+    if expresion:
+        match = "MATCH(v.nombre, v.identificacion, v.empresa) AGAINST (%s IN BOOLEAN MODE)"
+        cursor.execute(
+            CONSULTA_VISITANTES.format(relevancia=f", {match} as relevancia")
+            + f" AND {match}" + filtro_estado
+            + " ORDER BY relevancia DESC, v.id LIMIT %s",
+            [expresion, expresion] + params_estado + [limite])
+    else:
+        # Término demasiado corto para el índice FULLTEXT: prefijo del nombre
+        cursor.execute(
+            CONSULTA_VISITANTES.format(relevancia="")
+            + " AND v.nombre LIKE %s" + filtro_estado
+            + " ORDER BY v.nombre, v.id LIMIT %s",
+            [escapar_like(buscar) + '%'] + params_estado + [limite])
+    return cursor.fetchall()
 
 @login_required
 @permiso_requerido(VER_VISITANTES)
 def listar_visitantes():
     """Listar todos los visitantes"""
     db = Database()
-    conn = db.conectar()
-    if not conn:
-        flash('Error de conexión a la base de datos', 'danger')
-        return render_template('visitantes/listar.html', visitantes=[])
-    
     try:
-        cursor = conn.cursor(dictionary=True)
-        
         # Obtener parámetros de filtrado
         estado = request.args.get('estado', 'activo')
         buscar = request.args.get('buscar', '')
+        orden = request.args.get('orden', 'id')
+        if orden not in ORDENES_VISITANTES:
+            orden = 'id'
+        direccion = 'desc' if request.args.get('dir') == 'desc' else 'asc'
+        por_pagina = tamano_pagina(request.args.get('por_pagina'), config.VISITANTES_POR_PAGINA)
+        columna, campo, convertir = ORDENES_VISITANTES[orden]
+        siguiente = decodificar_cursor(request.args.get('siguiente'), convertir)
+        anterior = None if siguiente else decodificar_cursor(request.args.get('anterior'), convertir)
         
-        # Construir consulta base
-        query = """
-            SELECT v.*, 
-                   c.codigo,
-                   c.estado as credencial_estado,
-                   (SELECT COUNT(*) FROM accesos WHERE visitante_id = v.id AND tipo = 'entrada') as total_visitas
-            FROM visitantes v
-            LEFT JOIN credenciales c ON v.id = c.visitante_id AND c.estado = 'activa'
-            WHERE 1=1
-        """
-        params = []
-        
-        # Aplicar filtros
-        if estado:
-            query += " AND v.estado = %s"
-            params.append(estado)
-        
-        if buscar:
-            query += " AND (v.nombre LIKE %s OR v.identificacion LIKE %s OR v.empresa LIKE %s)"
-            params.extend([f'%{buscar}%', f'%{buscar}%', f'%{buscar}%'])
-        
-        # Ordenar por ID asc para mostrar 1,2,3... como solicita el usuario
-        query += " ORDER BY v.id ASC"
-        
-        cursor.execute(query, params)
-        visitantes = cursor.fetchall()
+        if buscar.strip():
+            # Búsqueda: resultados por relevancia con tope, sin paginar
+            with db.cursor() as cursor:
+                visitantes = _buscar_visitantes(cursor, estado, buscar.strip())
+            cursor_anterior = cursor_siguiente = None
+        else:
+            # Construir consulta base (total_visitas es un contador mantenido por control_acceso)
+            query = CONSULTA_VISITANTES.format(relevancia="")
+            params = []
+            
+            # Aplicar filtros
+            if estado:
+                query += " AND v.estado = %s"
+                params.append(estado)
+            
+            # Paginación por cursor sobre la columna de orden elegida (por defecto ID asc: 1,2,3...)
+            condicion, params_cursor, orden_sql = clausula_keyset(
+                columna, 'v.id', siguiente or anterior,
+                descendente=direccion == 'desc', retroceder=anterior is not None)
+            if condicion:
+                query += f" AND {condicion}"
+                params.extend(params_cursor)
+            query += f" ORDER BY {orden_sql} LIMIT %s"
+            params.append(por_pagina + 1)
+            
+            with db.cursor() as cursor:
+                cursor.execute(query, params)
+                visitantes = cursor.fetchall()
+            
+            visitantes, cursor_anterior, cursor_siguiente = paginar_keyset(
+                visitantes, por_pagina, hay_cursor=bool(siguiente or anterior),
+                retroceder=anterior is not None, columna=campo)
         
-        cursor.close()
-        conn.close()
+        # El estado vacío significa "Todos", por eso se conserva siempre
+        filtros = {'estado': estado}
+        filtros.update({k: v for k, v in {
+            'buscar': buscar,
+            'orden': orden,
+            'dir': direccion,
+            'por_pagina': request.args.get('por_pagina', ''),
+        }.items() if v})
         
         return render_template('visitantes/listar.html', 
                              visitantes=visitantes,
                              estado_seleccionado=estado,
-                             buscar=buscar)
+                             buscar=buscar,
+                             limite_busqueda=config.VISITANTES_BUSQUEDA_LIMITE,
+                             orden=orden,
+                             direccion=direccion,
+                             filtros=filtros,
+                             cursor_anterior=cursor_anterior,
+                             cursor_siguiente=cursor_siguiente)
         
+    except ErrorConexion:
+        flash('Error de conexión a la base de datos', 'danger')
+        return render_template('visitantes/listar.html', visitantes=[])
     except Exception as e:
         print(f"Error al listar visitantes: {e}")
         flash('Error al cargar la lista de visitantes', 'danger')
@@ -75,45 +160,43 @@ def agregar_visitante():
         generar_credencial = request.form.get('generar_credencial', 'no')
         
         db = Database()
-        conn = db.conectar()
-        if not conn:
-            flash('Error de conexión a la base de datos', 'danger')
-            return redirect(url_for('agregar_visitante'))
-        
         try:
-            cursor = conn.cursor()
-            
-            # Insertar visitante dejando que la base de datos asigne el ID (AUTO_INCREMENT)
-            cursor.execute("""
-                INSERT INTO visitantes (nombre, identificacion, empresa, motivo, estado)
-                VALUES (%s, %s, %s, %s, 'activo')
-            """, (nombre, identificacion, empresa, motivo))
-
-            # Obtener el id asignado por la base de datos
-            visitante_id = cursor.lastrowid
-            
-            # Generar credencial si se solicitó
-            if generar_credencial == 'si':
-                codigo = str(uuid.uuid4())[:8].upper()
-                fecha_expiracion = app_now() + timedelta(hours=8)
-                
+            codigo = None
+            with db.transaccion(dictionary=False) as cursor:
+                # Insertar visitante dejando que la base de datos asigne el ID (AUTO_INCREMENT)
                 cursor.execute("""
-                    INSERT INTO credenciales (visitante_id, codigo, estado, fecha_expiracion)
-                    VALUES (%s, %s, 'activa', %s)
-                """, (visitante_id, codigo, fecha_expiracion))
+                    INSERT INTO visitantes (nombre, identificacion, empresa, motivo, estado)
+                    VALUES (%s, %s, %s, %s, 'activo')
+                """, (nombre, identificacion, empresa, motivo))
+
+                # Obtener el id asignado por la base de datos
+                visitante_id = cursor.lastrowid
                 
+                # Generar credencial si se solicitó
+                if generar_credencial == 'si':
+                    codigo = str(uuid.uuid4())[:8].upper()
+                    fecha_expiracion = app_now() + timedelta(hours=8)
+                    
+                    cursor.execute("""
+                        INSERT INTO credenciales (visitante_id, codigo, estado, fecha_expiracion)
+                        VALUES (%s, %s, 'activa', %s)
+                    """, (visitante_id, codigo, fecha_expiracion))
+                    credencial_id = cursor.lastrowid
+                    version_indice = notificar_cambio(cursor)
+            
+            if codigo:
+                indice_credenciales.agregar(codigo, credencial_id, visitante_id, nombre,
+                                            fecha_expiracion.replace(tzinfo=None), version=version_indice)
                 flash(f'Visitante registrado exitosamente. Credencial generada: {codigo}', 'success')
             else:
                 flash('Visitante registrado exitosamente', 'success')
             
-            conn.commit()
-            cursor.close()
-            conn.close()
-            
             return redirect(url_for('listar_visitantes'))
             
+        except ErrorConexion:
+            flash('Error de conexión a la base de datos', 'danger')
+            return redirect(url_for('agregar_visitante'))
         except Exception as e:
-            conn.rollback()
             if 'identificacion' in str(e).lower():
                 flash('La identificación ya está registrada', 'danger')
             else:
@@ -127,45 +210,41 @@ def agregar_visitante():
 def editar_visitante(id):
     """Editar visitante existente"""
     db = Database()
-    conn = db.conectar()
-    if not conn:
-        flash('Error de conexión a la base de datos', 'danger')
-        return redirect(url_for('listar_visitantes'))
-    
     try:
-        cursor = conn.cursor(dictionary=True)
-        
         if request.method == 'POST':
             nombre = request.form['nombre']
             identificacion = request.form['identificacion']
             empresa = request.form['empresa']
             motivo = request.form['motivo']
             
-            cursor.execute("""
-                UPDATE visitantes 
-                SET nombre=%s, identificacion=%s, empresa=%s, motivo=%s
-                WHERE id=%s
-            """, (nombre, identificacion, empresa, motivo, id))
+            with db.transaccion() as cursor:
+                cursor.execute("""
+                    UPDATE visitantes 
+                    SET nombre=%s, identificacion=%s, empresa=%s, motivo=%s
+                    WHERE id=%s
+                """, (nombre, identificacion, empresa, motivo, id))
+                # El índice de credenciales guarda el nombre del visitante
+                notificar_cambio(cursor, visitante_id=id)
+            indice_credenciales.forzar_verificacion()
             
-            conn.commit()
             flash('Visitante actualizado exitosamente', 'success')
             return redirect(url_for('listar_visitantes'))
         
         # Obtener datos del visitante
-        cursor.execute("SELECT * FROM visitantes WHERE id = %s", (id,))
-        visitante = cursor.fetchone()
+        with db.cursor() as cursor:
+            cursor.execute("SELECT * FROM visitantes WHERE id = %s", (id,))
+            visitante = cursor.fetchone()
         
         if not visitante:
             flash('Visitante no encontrado', 'danger')
             return redirect(url_for('listar_visitantes'))
         
-        cursor.close()
-        conn.close()
-        
         return render_template('visitantes/editar.html', visitante=visitante)
         
+    except ErrorConexion:
+        flash('Error de conexión a la base de datos', 'danger')
+        return redirect(url_for('listar_visitantes'))
     except Exception as e:
-        conn.rollback()
         flash(f'Error al actualizar visitante: {str(e)}', 'danger')
         return redirect(url_for('listar_visitantes'))
 
@@ -174,39 +253,81 @@ def editar_visitante(id):
 def cambiar_estado_visitante(id):
     """Activar/desactivar visitante"""
     db = Database()
-    conn = db.conectar()
-    if not conn:
+    try:
+        with db.transaccion() as cursor:
+            cursor.execute("SELECT * FROM visitantes WHERE id = %s", (id,))
+            visitante = cursor.fetchone()
+            
+            if not visitante:
+                flash('Visitante no encontrado', 'danger')
+                return redirect(url_for('listar_visitantes'))
+            
+            nuevo_estado = 'inactivo' if visitante['estado'] == 'activo' else 'activo'
+            
+            cursor.execute("UPDATE visitantes SET estado = %s WHERE id = %s", (nuevo_estado, id))
+            
+            # Desactivar credenciales activas si se desactiva el visitante
+            if nuevo_estado == 'inactivo':
+                cursor.execute("UPDATE credenciales SET estado = 'inactiva' WHERE visitante_id = %s AND estado = 'activa'", (id,))
+                version_indice = notificar_cambio(cursor)
+        
+        if nuevo_estado == 'inactivo':
+            indice_credenciales.quitar(visitante_id=id, version=version_indice)
+        accion = "desactivado" if nuevo_estado == 'inactivo' else "activado"
+        flash(f'Visitante {accion} exitosamente', 'success')
+        
+    except ErrorConexion:
         flash('Error de conexión a la base de datos', 'danger')
+    except Exception as e:
+        flash(f'Error al cambiar estado del visitante: {str(e)}', 'danger')
+    
+    return redirect(url_for('listar_visitantes'))
+
+@login_required
+@permiso_requerido(GENERAR_CREDENCIALES)
+def imprimir_credenciales():
+    """Descargar en un solo PDF las credenciales activas de los visitantes seleccionados"""
+    ids = list(dict.fromkeys(request.form.getlist('visitante_ids', type=int)))
+    if not ids:
+        flash('Seleccione al menos un visitante con credencial activa', 'warning')
+        return redirect(url_for('listar_visitantes'))
+    if len(ids) > config.CREDENCIALES_LOTE_MAXIMO:
+        flash(f'Se pueden imprimir como máximo {config.CREDENCIALES_LOTE_MAXIMO} credenciales por lote', 'warning')
         return redirect(url_for('listar_visitantes'))
     
     try:
-        cursor = conn.cursor(dictionary=True)
-        
-        cursor.execute("SELECT * FROM visitantes WHERE id = %s", (id,))
-        visitante = cursor.fetchone()
+        with Database().cursor() as cursor:
+            marcadores = ', '.join(['%s'] * len(ids))
+            cursor.execute(f"""
+                SELECT v.id, v.nombre, v.identificacion, v.empresa, v.motivo, v.fecha_registro, c.codigo
+                FROM visitantes v
+                JOIN credenciales c ON c.visitante_id = v.id AND c.estado = 'activa'
+                WHERE v.id IN ({marcadores})
+                ORDER BY v.nombre, v.id
+            """, ids)
+            visitantes = cursor.fetchall()
         
-        if not visitante:
-            flash('Visitante no encontrado', 'danger')
+        if not visitantes:
+            flash('Los visitantes seleccionados no tienen credenciales activas', 'warning')
             return redirect(url_for('listar_visitantes'))
         
-        nuevo_estado = 'inactivo' if visitante['estado'] == 'activo' else 'activo'
-        
-        cursor.execute("UPDATE visitantes SET estado = %s WHERE id = %s", (nuevo_estado, id))
-        
-        # Desactivar credenciales activas si se desactiva el visitante
-        if nuevo_estado == 'inactivo':
-            cursor.execute("UPDATE credenciales SET estado = 'inactiva' WHERE visitante_id = %s AND estado = 'activa'", (id,))
-        
-        conn.commit()
-        
-        accion = "desactivado" if nuevo_estado == 'inactivo' else "activado"
-        flash(f'Visitante {accion} exitosamente', 'success')
+        # El PDF se arma en un archivo temporal y se envía por bloques:
+        # un lote de cientos de credenciales no se mantiene entero en memoria
+        archivo = tempfile.TemporaryFile()
+        try:
+            generar_lote_credenciales(visitantes, archivo)
+            archivo.seek(0)
+        except Exception:
+            archivo.close()
+            raise
         
+        nombre_archivo = f"credenciales_{app_now().strftime('%Y%m%d_%H%M%S')}.pdf"
+        return send_file(archivo, mimetype='application/pdf', as_attachment=True, download_name=nombre_archivo)
+    
+    except ErrorConexion:
+        flash('Error de conexión a la base de datos', 'danger')
     except Exception as e:
-        conn.rollback()
-        flash(f'Error al cambiar estado del visitante: {str(e)}', 'danger')
-    finally:
-        cursor.close()
-        conn.close()
+        print(f"Error al imprimir credenciales: {e}")
+        flash(f'Error al generar las credenciales: {str(e)}', 'danger')
     
     return redirect(url_for('listar_visitantes'))
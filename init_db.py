@@ -8,6 +8,7 @@ import hashlib
 import os
 import re
 import config
+from utils.time_utils import app_utc_offset
 
 
 def ejecutar_sql(conexion, sql_file):
@@ -59,6 +60,47 @@ def ejecutar_sql(conexion, sql_file):
         except Exception:
             pass
 
+def columna_existe(conexion, tabla, columna):
+    """Comprobar si una columna existe en la base de datos actual"""
+    cursor = conexion.cursor()
+    try:
+        cursor.execute("""
+            SELECT COUNT(*) FROM information_schema.COLUMNS
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s
+        """, (tabla, columna))
+        return cursor.fetchone()[0] > 0
+    finally:
+        cursor.close()
+
+def cargar_rollup(conexion, recalcular=False):
+    """Cargar el historial del resumen diario de accesos (una sola vez, fuera de las peticiones web)
+
+    Con `recalcular`, los días ya cargados se recalculan antes (columnas
+    nuevas del resumen) sin tocar la marca de agua.
+    """
+    from utils.rollup_utils import reconstruir_accesos_diarios, recalcular_accesos_diarios
+    cursor = None
+    try:
+        cursor = conexion.cursor(dictionary=True)
+        if recalcular:
+            recalculado = recalcular_accesos_diarios(cursor)
+            conexion.commit()
+            if recalculado:
+                print(f"✅ Resumen diario de accesos recalculado hasta {recalculado}")
+        hasta = reconstruir_accesos_diarios(cursor)
+        conexion.commit()
+        if hasta:
+            print(f"✅ Resumen diario de accesos cargado hasta {hasta}")
+    except Error as e:
+        print(f"❌ Error cargando el resumen diario de accesos: {e}")
+        try:
+            conexion.rollback()
+        except Exception:
+            pass
+    finally:
+        if cursor is not None:
+            cursor.close()
+
 def verificar_base_datos(conn_config: dict):
     """Intentar conectar a la base de datos destino; si no existe, intentar crearla.
     conn_config: dict con host,user,password,database,port
@@ -120,14 +162,19 @@ def main():
             user=conn_config.get('user'),
             password=conn_config.get('password'),
             database=conn_config.get('database'),
-            port=conn_config.get('port')
+            port=conn_config.get('port'),
+            # Misma zona que el pool: DATE(), CURDATE() y NOW() del rollup en días de la app
+            time_zone=app_utc_offset()
         )
 
         print("✅ Conectado a la base de datos")
 
         # Ejecutar script SQL (filtrado internamente)
         if os.path.exists('control_acceso_3.sql'):
+            # Rollup cargado antes de existir accesos_fuera_horario: rellenarla tras la migración
+            sin_fuera_horario = not columna_existe(conexion, 'accesos_diarios', 'accesos_fuera_horario')
             ejecutar_sql(conexion, 'control_acceso_3.sql')
+            cargar_rollup(conexion, recalcular=sin_fuera_horario)
         else:
             print("❌ Archivo SQL no encontrado")
             print("💡 Asegúrate de que el archivo 'control_acceso_3.sql' esté en el directorio raíz")
@@ -2,11 +2,31 @@ import mysql.connector
 from mysql.connector import Error
 from utils.db_utils import get_connection
 import hashlib
+import threading
+import time
+from contextlib import contextmanager
 from datetime import datetime
 import config
 from typing import Any, Dict, cast, Optional
 
 
+class ErrorConexion(Error):
+    """No se pudo obtener una conexión del pool"""
+
+
+def _cerrar(cursor, conn):
+    """Cerrar cursor y devolver la conexión al pool ignorando errores"""
+    try:
+        if cursor is not None:
+            cursor.close()
+    except Exception:
+        pass
+    try:
+        conn.close()
+    except Exception:
+        pass
+
+
 class Database:
     def __init__(self, db_config: Optional[dict] = None):
         # Utiliza la configuración de config.DB_CONFIG por defecto, permite override
@@ -25,6 +45,49 @@ class Database:
             print(f"Error al conectar a MySQL ({self.config.get('host')}:{self.config.get('port')}/{self.config.get('database')}): {e}")
             return None
     
+    @contextmanager
+    def cursor(self, dictionary=True):
+        """Prestar conexión + cursor para lecturas; ambos se liberan al salir del bloque.
+        
+        Uso:
+            with db.cursor() as cursor:
+                cursor.execute(...)
+        
+        Lanza ErrorConexion si el pool no entrega una conexión.
+        """
+        conn = self.conectar()
+        if not conn:
+            raise ErrorConexion("No se pudo obtener una conexión a la base de datos")
+        cursor = None
+        try:
+            cursor = conn.cursor(dictionary=dictionary)
+            yield cursor
+        finally:
+            _cerrar(cursor, conn)
+    
+    @contextmanager
+    def transaccion(self, dictionary=True):
+        """Como cursor(), pero hace commit al salir del bloque y rollback si hay excepción.
+        
+        Un `return` dentro del bloque también confirma la transacción.
+        """
+        conn = self.conectar()
+        if not conn:
+            raise ErrorConexion("No se pudo obtener una conexión a la base de datos")
+        cursor = None
+        try:
+            cursor = conn.cursor(dictionary=dictionary)
+            yield cursor
+            conn.commit()
+        except BaseException:
+            try:
+                conn.rollback()
+            except Exception:
+                pass
+            raise
+        finally:
+            _cerrar(cursor, conn)
+    
     @staticmethod
     def hash_contrasena(contrasena):
         """Hashear contraseña usando SHA-256"""
@@ -35,84 +98,237 @@ class Database:
         """Verificar contraseña hasheada"""
         return Database.hash_contrasena(contrasena) == hash_almacenado
 
+def contar_consulta(categoria):
+    """Contabilizar una consulta en el contador de la petición actual (si existe)"""
+    from flask import g, has_request_context
+    if not has_request_context():
+        return
+    contador = g.setdefault('contador_consultas', {})
+    contador[categoria] = contador.get(categoria, 0) + 1
+
+# Caché de permisos compartida por todas las peticiones del proceso.
+# Se invalida cuando cambia el contador `cache_versiones.permisos`, que cada
+# worker consulta como máximo una vez cada PERMISOS_CACHE_SEGUNDOS.
+_cache_permisos = {
+    'version': None,       # versión conocida; None = caché deshabilitada
+    'verificado': 0.0,     # time.monotonic() de la última consulta de versión
+    'roles': {},           # rol_id -> MascaraPermisos compilada
+    'usuarios': {},        # usuario_id -> fila de usuario (sin permisos)
+}
+_cache_permisos_lock = threading.Lock()
+
+def _limpiar_cache_permisos():
+    with _cache_permisos_lock:
+        _cache_permisos['roles'].clear()
+        _cache_permisos['usuarios'].clear()
+
+def sincronizar_cache_permisos():
+    """Comprobar la versión compartida y vaciar la caché si otro worker la cambió"""
+    intervalo = getattr(config, 'PERMISOS_CACHE_SEGUNDOS', 5)
+    ahora = time.monotonic()
+    if ahora - _cache_permisos['verificado'] < intervalo:
+        return _cache_permisos['version'] is not None
+    
+    version = None
+    try:
+        with Database().cursor(dictionary=False) as cursor:
+            contar_consulta('cache_version')
+            cursor.execute("SELECT version FROM cache_versiones WHERE clave = 'permisos'")
+            fila = cursor.fetchone()
+            version = fila[0] if fila else None
+    except ErrorConexion:
+        return False
+    except Error as e:
+        print(f"Error al consultar versión de permisos: {e}")
+    
+    if version is None or version != _cache_permisos['version']:
+        _limpiar_cache_permisos()
+    with _cache_permisos_lock:
+        _cache_permisos['version'] = version
+        _cache_permisos['verificado'] = ahora
+    return version is not None
+
+def invalidar_cache_permisos(cursor):
+    """Incrementar la versión de permisos dentro de la transacción del llamador.
+    
+    Debe invocarse con el cursor de la transacción que modifica roles,
+    rol_permisos o el rol/estado de un usuario, antes del commit.
+    """
+    try:
+        cursor.execute("""
+            INSERT INTO cache_versiones (clave, version) VALUES ('permisos', 1)
+            ON DUPLICATE KEY UPDATE version = version + 1
+        """)
+    except Error as e:
+        print(f"Error al invalidar caché de permisos: {e}")
+    # Forzar que la próxima petición de este proceso relea la versión
+    _limpiar_cache_permisos()
+    with _cache_permisos_lock:
+        _cache_permisos['verificado'] = 0.0
+
 def obtener_permisos_usuario(usuario_id):
     """Obtener todos los permisos de un usuario basado en su rol"""
-    db = Database()
-    conn = db.conectar()
-    if not conn:
-        return []
+    usuario = cargar_usuario(usuario_id)
+    return list(usuario['permisos']) if usuario else []
+
+def obtener_permisos_rol(rol_id):
+    """Obtener la máscara de permisos de un rol, usando la caché si está vigente"""
+    from auth.permissions import MascaraPermisos, compilar_mascara
+    cache_activa = sincronizar_cache_permisos()
+    if cache_activa and rol_id in _cache_permisos['roles']:
+        return _cache_permisos['roles'][rol_id]
     
-    cursor = None
     try:
-        cursor = conn.cursor(dictionary=True)
-        cursor.execute("""
-            SELECT p.nombre, p.modulo 
-            FROM usuarios u
-            JOIN roles r ON u.rol_id = r.id
-            JOIN rol_permisos rp ON r.id = rp.rol_id
-            JOIN permisos p ON rp.permiso_id = p.id
-            WHERE u.id = %s AND u.estado = 'activo'
-        """, (usuario_id,))
-        permisos = cursor.fetchall()
-        # Forzar tipo dict para el analizador estático y permitir indexación por claves
-        permisos = [cast(Dict[str, Any], p) for p in permisos] if permisos else []
-        return [f"{p['modulo']}.{p['nombre']}" for p in permisos]
+        with Database().cursor() as cursor:
+            contar_consulta('auth')
+            cursor.execute("""
+                SELECT p.nombre, p.modulo 
+                FROM rol_permisos rp
+                JOIN permisos p ON rp.permiso_id = p.id
+                WHERE rp.rol_id = %s
+            """, (rol_id,))
+            filas = [cast(Dict[str, Any], p) for p in cursor.fetchall()]
     except Error as e:
         print(f"Error al obtener permisos: {e}")
-        return []
-    finally:
-        try:
-            if cursor is not None:
-                cursor.close()
-        except Exception:
-            pass
-        try:
-            conn.close()
-        except Exception:
-            pass
+        return MascaraPermisos(0)
+    
+    permisos = compilar_mascara(f"{p['modulo']}.{p['nombre']}" for p in filas)
+    if cache_activa:
+        with _cache_permisos_lock:
+            _cache_permisos['roles'][rol_id] = permisos
+    return permisos
 
 def tiene_permiso(usuario_id, permiso_requerido):
     """Verificar si un usuario tiene un permiso específico"""
-    permisos = obtener_permisos_usuario(usuario_id)
-    return permiso_requerido in permisos
+    usuario = obtener_usuario_actual()
+    if usuario and usuario.get('id') == usuario_id:
+        # Reutilizar el usuario ya cargado en la petición actual
+        return permiso_requerido in usuario['permisos']
+    usuario = cargar_usuario(usuario_id)
+    return usuario is not None and permiso_requerido in usuario['permisos']
 
-def obtener_usuario_actual():
-    """Obtener información del usuario actual desde la sesión"""
-    from flask import session
-    if 'usuario_id' not in session:
-        return None
+def cargar_usuario(usuario_id):
+    """Cargar usuario, rol y permisos.
     
-    db = Database()
-    conn = db.conectar()
-    if not conn:
-        return None
+    Con la caché vigente no realiza consultas; en frío usa una sola consulta
+    y deja en caché tanto la fila del usuario como la máscara de su rol.
+    Devuelve None si el usuario no existe o está inactivo.
+
+    Raises:
+        ErrorConexion: Si la base de datos no responde (fallo transitorio,
+            no significa que la sesión sea inválida)
+    """
+    from auth.permissions import compilar_mascara
+    cache_activa = sincronizar_cache_permisos()
+    if cache_activa:
+        usuario = _cache_permisos['usuarios'].get(usuario_id)
+        if usuario is not None:
+            return dict(usuario, permisos=obtener_permisos_rol(usuario['rol_id']))
     
-    cursor = None
     try:
-        cursor = conn.cursor(dictionary=True)
-        cursor.execute("""
-            SELECT u.*, r.nombre as rol_nombre, r.descripcion as rol_descripcion
-            FROM usuarios u 
-            JOIN roles r ON u.rol_id = r.id 
-            WHERE u.id = %s AND u.estado = 'activo'
-        """, (session['usuario_id'],))
-        
-        usuario = cursor.fetchone()
-        if usuario:
-            # Forzar tipo dict para el analizador estático y permitir asignaciones
-            usuario = cast(Dict[str, Any], usuario)
-            usuario['permisos'] = obtener_permisos_usuario(usuario.get('id'))
-        return usuario
+        with Database().cursor() as cursor:
+            contar_consulta('auth')
+            # Una fila por permiso; LEFT JOIN para no perder usuarios con roles sin permisos
+            cursor.execute("""
+                SELECT u.*, r.nombre as rol_nombre, r.descripcion as rol_descripcion,
+                       p.nombre as permiso_nombre, p.modulo as permiso_modulo
+                FROM usuarios u 
+                JOIN roles r ON u.rol_id = r.id 
+                LEFT JOIN rol_permisos rp ON r.id = rp.rol_id
+                LEFT JOIN permisos p ON rp.permiso_id = p.id
+                WHERE u.id = %s AND u.estado = 'activo'
+            """, (usuario_id,))
+            filas = cursor.fetchall()
+    except ErrorConexion:
+        raise
+    except (mysql.connector.InterfaceError, mysql.connector.OperationalError) as e:
+        raise ErrorConexion(f"Error de conexión al obtener usuario: {e}") from e
     except Exception as e:
         print(f"Error al obtener usuario actual: {e}")
         return None
-    finally:
-        try:
-            if cursor is not None:
-                cursor.close()
-        except Exception:
-            pass
-        try:
-            conn.close()
-        except Exception:
-            pass
+    
+    if not filas:
+        return None
+    
+    filas = [cast(Dict[str, Any], f) for f in filas]
+    usuario = {k: v for k, v in filas[0].items() if k not in ('permiso_nombre', 'permiso_modulo')}
+    permisos = compilar_mascara(
+        f"{f['permiso_modulo']}.{f['permiso_nombre']}" for f in filas if f['permiso_nombre']
+    )
+    if cache_activa:
+        with _cache_permisos_lock:
+            _cache_permisos['usuarios'][usuario_id] = usuario
+            _cache_permisos['roles'][usuario['rol_id']] = permisos
+    return dict(usuario, permisos=permisos)
+
+def sello_permisos(usuario_id):
+    """Sello que acompaña a la máscara en la cookie: versión de permisos + huella del registro + usuario
+
+    Incluir el usuario impide que una máscara guardada para una cuenta se
+    acepte con el `usuario_id` de otra.
+    """
+    from auth.permissions import HUELLA_REGISTRO
+    if not sincronizar_cache_permisos():
+        return None
+    return f"{_cache_permisos['version']}:{HUELLA_REGISTRO}:{usuario_id}"
+
+def obtener_usuario_actual():
+    """Obtener información del usuario actual desde la sesión.
+    
+    El resultado se memoriza en flask.g, de modo que decoradores, context
+    processor y controladores comparten una única carga por petición. Si la
+    cookie de sesión trae una máscara con el sello vigente, no se consulta
+    la base de datos.
+    """
+    from flask import session, g
+    from auth.permissions import MascaraPermisos
+    if 'usuario_id' not in session:
+        return None
+    
+    if g.get('usuario_actual_id') == session['usuario_id']:
+        return g.usuario_actual
+    
+    sello = sello_permisos(session['usuario_id'])
+    if sello is not None and session.get('permisos_sello') == sello and 'permisos_mascara' in session:
+        usuario = {
+            'id': session['usuario_id'],
+            'nombre': session.get('usuario_nombre'),
+            'rol_id': session.get('usuario_rol_id'),
+            'rol_nombre': session.get('usuario_rol'),
+            'permisos': MascaraPermisos(session['permisos_mascara']),
+        }
+    else:
+        usuario = cargar_usuario(session['usuario_id'])
+        if usuario is not None and sello is not None:
+            session['usuario_nombre'] = usuario['nombre']
+            session['usuario_rol_id'] = usuario['rol_id']
+            session['usuario_rol'] = usuario['rol_nombre']
+            session['permisos_mascara'] = int(usuario['permisos'])
+            session['permisos_sello'] = sello
+    
+    g.usuario_actual = usuario
+    g.usuario_actual_id = session['usuario_id']
+    return usuario
+
+def validar_registro_permisos():
+    """Comparar el registro compilado de permisos con la tabla `permisos`.
+    
+    Se ejecuta al arrancar; informa permisos declarados en código que no
+    existen en la base de datos y viceversa.
+    """
+    from auth.permissions import REGISTRO_PERMISOS
+    try:
+        with Database().cursor() as cursor:
+            cursor.execute("SELECT nombre, modulo FROM permisos")
+            en_bd = {f"{p['modulo']}.{p['nombre']}" for p in cursor.fetchall()}
+    except Error as e:
+        print(f"Error al validar registro de permisos: {e}")
+        return False
+    
+    faltantes = [p for p in REGISTRO_PERMISOS if p not in en_bd]
+    desconocidos = sorted(en_bd - set(REGISTRO_PERMISOS))
+    if faltantes:
+        print(f"⚠️  Permisos declarados sin fila en la tabla permisos: {', '.join(faltantes)}")
+    if desconocidos:
+        print(f"⚠️  Permisos en la base de datos sin constante registrada: {', '.join(desconocidos)}")
+    return not faltantes and not desconocidos
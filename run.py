@@ -1,10 +1,14 @@
 """
 Script principal para ejecutar la aplicación
+
+La aplicación se importa dentro del bloque principal: los procesos hijos
+('spawn') vuelven a importar este módulo y no deben arrancar la app.
 """
-from app import app
 import os
 
 if __name__ == '__main__':
+    from app import app
+    
     # Verificar si la base de datos existe
     try:
         from models.database import Database
@@ -29,4 +33,4 @@ if __name__ == '__main__':
     print("🔑 Contraseña demo: admin123")
     print("\n⏹️  Presiona Ctrl+C para detener el servidor\n")
     
-    app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
+    app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
@@ -183,7 +183,11 @@ function filterTable(input) {
 function initDashboard() {
     // Actualizar estadísticas en tiempo real (cada 30 segundos)
     if (window.location.pathname === '/dashboard') {
-        setInterval(updateDashboardStats, 30000);
+        if (window.EventSource) {
+            connectDashboardEvents();
+        } else {
+            setInterval(updateDashboardStats, 30000);
+        }
     }
     
     // Tooltips
@@ -202,10 +206,48 @@ function updateDashboardStats() {
             updateStatCard('accesos_hoy', data.accesos_hoy);
             updateStatCard('alertas_hoy', data.alertas_hoy);
             updateStatCard('total_usuarios', data.total_usuarios);
+            updateStatCard('visitantes_dentro', data.visitantes_dentro);
         })
         .catch(error => console.error('Error updating stats:', error));
 }
 
+// Eventos en vivo (Server-Sent Events); el navegador reconecta solo
+function connectDashboardEvents() {
+    const source = new EventSource('/dashboard/eventos');
+    
+    source.addEventListener('contadores', event => {
+        const data = JSON.parse(event.data);
+        Object.keys(data).forEach(statId => updateStatCard(statId, data[statId]));
+    });
+    
+    source.addEventListener('acceso', event => {
+        applyIncrements(JSON.parse(event.data).incrementos);
+    });
+    
+    source.addEventListener('alerta', event => {
+        const data = JSON.parse(event.data);
+        applyIncrements(data.incrementos);
+        if (data.nivel === 'alto' || data.nivel === 'medio') {
+            showConnectionStatus(escapeHtml(data.descripcion), data.nivel === 'alto' ? 'danger' : 'warning');
+        }
+    });
+}
+
+function applyIncrements(increments) {
+    Object.keys(increments || {}).forEach(statId => {
+        const element = document.querySelector(`[data-stat="${statId}"]`);
+        if (element) {
+            updateStatCard(statId, (parseInt(element.textContent) || 0) + increments[statId]);
+        }
+    });
+}
+
+function escapeHtml(text) {
+    const div = document.createElement('div');
+    div.textContent = text;
+    return div.innerHTML;
+}
+
 function updateStatCard(statId, value) {
     const element = document.querySelector(`[data-stat="${statId}"]`);
     if (element) {
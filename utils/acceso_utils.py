@@ -1,4 +1,9 @@
 """Utilidades para el manejo de accesos"""
+from collections import Counter
+from utils.time_utils import app_now_date
+from utils.rollup_utils import invalidar_accesos_diarios
+from utils.indice_credenciales_utils import notificar_cambio
+from utils.horarios_utils import motor_horarios
 
 def normalizar_tipo_acceso(tipo: str) -> str:
     """
@@ -17,4 +22,133 @@ def normalizar_tipo_acceso(tipo: str) -> str:
         'salida': 'salida', 'egreso': 'salida', 'exit': 'salida',
         'out': 'salida', 'logout': 'salida', 'egress': 'salida'
     }
-    return mapeo.get(tipo, 'entrada')  # valor por defecto seguro
\ No newline at end of file
+    return mapeo.get(tipo, 'entrada')  # valor por defecto seguro
+
+
+def clasificar_lectura(codigo, tipo, credencial, fecha_hora, estacion, usuario_id, rol=None):
+    """
+    Decidir el resultado de una lectura ya validada contra las credenciales
+
+    Args:
+        credencial: Datos de la credencial (id, nombre, credencial_id) o None si no es válida
+        fecha_hora: Momento de la lectura (naive, hora de la app)
+        rol: Rol del usuario que registra (para las reglas de horario por rol)
+
+    Returns:
+        dict: Registro para `guardar_lecturas` con `estado` autorizado,
+        denegado o invalido y la alerta a registrar, si corresponde
+    """
+    origen = f" ({estacion})" if estacion else ""
+    registro = {
+        'codigo': codigo, 'tipo': tipo, 'fecha_hora': fecha_hora, 'estacion': estacion,
+        'usuario_id': usuario_id, 'visitante_id': None, 'credencial_id': None,
+        'nombre': None, 'autorizado': None, 'alerta': None,
+    }
+    if credencial is None:
+        registro['estado'] = 'invalido'
+        registro['alerta'] = (f'Intento de acceso con código inválido: {codigo}{origen}', 'alto')
+        return registro
+
+    registro.update(visitante_id=credencial['id'], credencial_id=credencial['credencial_id'],
+                    nombre=credencial['nombre'])
+    registro['autorizado'] = motor_horarios.permitido(fecha_hora, rol=rol, tipo=credencial.get('tipo'))
+    if registro['autorizado']:
+        registro['estado'] = 'autorizado'
+    else:
+        registro['estado'] = 'denegado'
+        registro['horario'] = motor_horarios.describir(fecha_hora, rol=rol, tipo=credencial.get('tipo'))
+        registro['alerta'] = (f'Intento de acceso fuera de horario: {credencial["nombre"]}{origen}', 'medio')
+    return registro
+
+
+def guardar_lecturas(cursor, registros):
+    """
+    Escribir un conjunto de lecturas clasificadas con sentencias de varias filas
+
+    Inserta accesos y alertas con executemany y aplica los efectos de los
+    accesos autorizados: contador de visitas, desactivación de la credencial
+    en la salida y presencia según el último acceso de cada visitante (sin
+    pisar un estado más reciente si las lecturas llegan atrasadas). Debe
+    llamarse con el cursor de una transacción; los registros deben venir en
+    orden cronológico.
+
+    Returns:
+        tuple: (días anteriores a hoy con accesos nuevos, para invalidar
+        cachés tras el commit; versión de credenciales si se desactivó
+        alguna, o None)
+    """
+    hoy = app_now_date()
+    filas_accesos, filas_alertas = [], []
+    visitas = Counter()
+    credenciales_salida = []
+    estado_final = {}  # visitante_id -> (tipo, fecha_hora) de su último acceso autorizado
+    dias_pasados = set()
+    version_credenciales = None
+
+    for registro in registros:
+        if registro['alerta']:
+            descripcion, nivel = registro['alerta']
+            filas_alertas.append((descripcion, nivel, registro['usuario_id'], registro['visitante_id'],
+                                  registro['fecha_hora']))
+        if registro['autorizado'] is None:
+            continue
+        filas_accesos.append((registro['usuario_id'], registro['visitante_id'], registro['tipo'],
+                              registro['fecha_hora'], registro['autorizado'], registro['estacion']))
+        if registro['fecha_hora'].date() < hoy:
+            dias_pasados.add(registro['fecha_hora'].date())
+        if registro['autorizado']:
+            if registro['tipo'] == 'entrada':
+                visitas[registro['visitante_id']] += 1
+            else:
+                credenciales_salida.append(registro['credencial_id'])
+            estado_final[registro['visitante_id']] = (registro['tipo'], registro['fecha_hora'])
+
+    primer_id = None
+    if filas_accesos:
+        cursor.executemany("""
+            INSERT INTO accesos (usuario_id, visitante_id, tipo, fecha_hora, autorizado, estacion)
+            VALUES (%s, %s, %s, %s, %s, %s)
+        """, filas_accesos)
+        primer_id = cursor.lastrowid  # primer id del INSERT de varias filas
+    if filas_alertas:
+        cursor.executemany("""
+            INSERT INTO alertas (descripcion, nivel, usuario_id, visitante_id, fecha)
+            VALUES (%s, %s, %s, %s, %s)
+        """, filas_alertas)
+    if visitas:
+        cursor.executemany("UPDATE visitantes SET total_visitas = total_visitas + %s WHERE id = %s",
+                           [(cantidad, visitante_id) for visitante_id, cantidad in visitas.items()])
+    if credenciales_salida:
+        marcadores = ', '.join(['%s'] * len(credenciales_salida))
+        cursor.execute(f"UPDATE credenciales SET estado = 'inactiva' WHERE id IN ({marcadores})", credenciales_salida)
+        version_credenciales = notificar_cambio(cursor)
+
+    dentro = [v for v, (t, _) in estado_final.items() if t == 'entrada']
+    fuera = [(v, f) for v, (t, f) in estado_final.items() if t == 'salida']
+    if dentro:
+        marcadores = ', '.join(['%s'] * len(dentro))
+        cursor.execute(f"""
+            INSERT INTO presencia (visitante_id, acceso_id, usuario_id, fecha_entrada)
+            SELECT a.visitante_id, a.id, a.usuario_id, a.fecha_hora
+            FROM accesos a
+            JOIN (
+                SELECT visitante_id, MAX(id) as ultimo_id
+                FROM accesos
+                WHERE id >= %s AND visitante_id IN ({marcadores})
+                AND tipo = 'entrada' AND autorizado = 1
+                GROUP BY visitante_id
+            ) u ON a.id = u.ultimo_id
+            ON DUPLICATE KEY UPDATE
+                acceso_id = IF(VALUES(fecha_entrada) >= presencia.fecha_entrada, VALUES(acceso_id), presencia.acceso_id),
+                usuario_id = IF(VALUES(fecha_entrada) >= presencia.fecha_entrada, VALUES(usuario_id), presencia.usuario_id),
+                fecha_entrada = GREATEST(presencia.fecha_entrada, VALUES(fecha_entrada))
+        """, [primer_id] + dentro)
+    if fuera:
+        condiciones = ' OR '.join(['(visitante_id = %s AND fecha_entrada <= %s)'] * len(fuera))
+        cursor.execute(f"DELETE FROM presencia WHERE {condiciones}", [valor for par in fuera for valor in par])
+
+    # Días cerrados con accesos nuevos: su resumen diario se recalcula
+    for fecha in dias_pasados:
+        invalidar_accesos_diarios(cursor, fecha)
+
+    return dias_pasados, version_credenciales
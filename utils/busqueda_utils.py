@@ -0,0 +1,41 @@
+"""Utilidades para la búsqueda de visitantes"""
+import re
+
+# Longitud mínima de palabra indexada por FULLTEXT en InnoDB (innodb_ft_min_token_size)
+LONGITUD_MINIMA_PALABRA = 3
+
+_OPERADORES_BOOLEANOS = re.compile(r'[+\-<>()~*"@]')
+_PATRON_IDENTIFICACION = re.compile(r'^[A-Za-z]{0,3}-?\d[\w\-.]*$')
+
+
+def es_identificacion(termino: str) -> bool:
+    """
+    Indica si el término parece un número de identificación (p.ej. 'V-1234')
+
+    Esos términos se resuelven con una búsqueda por prefijo sobre el índice
+    único de `identificacion`, sin pasar por el índice FULLTEXT.
+    """
+    return bool(_PATRON_IDENTIFICACION.match(termino.strip()))
+
+
+def escapar_like(termino: str) -> str:
+    """Escapa los comodines de LIKE para usar el término como prefijo literal"""
+    return termino.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def expresion_fulltext(termino: str):
+    """
+    Convierte el texto libre en una expresión MATCH ... IN BOOLEAN MODE
+
+    Cada palabra se exige (+) y se busca por prefijo (*). Se descartan los
+    operadores que escriba el usuario y las palabras demasiado cortas para
+    el índice.
+
+    Returns:
+        str: Expresión booleana, o None si no queda ninguna palabra indexable
+    """
+    palabras = _OPERADORES_BOOLEANOS.sub(' ', termino).split()
+    palabras = [p for p in palabras if len(p) >= LONGITUD_MINIMA_PALABRA]
+    if not palabras:
+        return None
+    return ' '.join(f'+{p}*' for p in palabras)
@@ -0,0 +1,121 @@
+"""Segundo nivel de caché compartido por todos los workers del servidor"""
+import mmap
+import os
+import pickle
+import sqlite3
+import struct
+import threading
+import time
+import zlib
+
+try:
+    import fcntl
+except ImportError:  # Windows: incrementos sin bloqueo entre procesos
+    fcntl = None
+
+_CONTADOR = struct.Struct('<Q')
+
+
+class GeneracionesCompartidas:
+    """
+    Generación de cada espacio de claves en un archivo mapeado en memoria
+
+    Leer la generación es leer 8 bytes de memoria compartida, así que la
+    caché local de cada worker puede comprobarla en cada acierto e invalidar
+    en cuanto otro worker incrementa el contador. Los espacios se reparten
+    en `ranuras` por CRC32; dos espacios en la misma ranura solo se
+    invalidan de más.
+    """
+
+    def __init__(self, ruta, ranuras=1024):
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        self.ranuras = ranuras
+        self._archivo = open(ruta, 'a+b')
+        tamano = ranuras * _CONTADOR.size
+        self.nuevo = os.fstat(self._archivo.fileno()).st_size < tamano
+        if self.nuevo:
+            self._archivo.truncate(tamano)
+        self._mapa = mmap.mmap(self._archivo.fileno(), tamano)
+
+    def _posicion(self, espacio):
+        return (zlib.crc32(espacio.encode('utf-8')) % self.ranuras) * _CONTADOR.size
+
+    def obtener(self, espacio):
+        return _CONTADOR.unpack_from(self._mapa, self._posicion(espacio))[0]
+
+    def incrementar(self, espacio):
+        posicion = self._posicion(espacio)
+        if fcntl is not None:
+            fcntl.flock(self._archivo.fileno(), fcntl.LOCK_EX)
+        try:
+            _CONTADOR.pack_into(self._mapa, posicion, _CONTADOR.unpack_from(self._mapa, posicion)[0] + 1)
+        finally:
+            if fcntl is not None:
+                fcntl.flock(self._archivo.fileno(), fcntl.LOCK_UN)
+
+
+class CacheCompartida:
+    """
+    Valores serializados (pickle) en un archivo SQLite local
+
+    La clave incluye la generación del espacio: invalidar no borra filas,
+    las viejas dejan de leerse y se eliminan al vencer.
+    """
+
+    def __init__(self, directorio, segundos_limpieza=60):
+        self.ruta = os.path.join(directorio, 'cache.sqlite3')
+        self.generaciones = GeneracionesCompartidas(os.path.join(directorio, 'generaciones.bin'))
+        self._local = threading.local()
+        self._segundos_limpieza = segundos_limpieza
+        self._proxima_limpieza = 0.0
+        self._metricas = {'aciertos': 0, 'fallos': 0, 'escrituras': 0, 'errores': 0}
+        if self.generaciones.nuevo:
+            # Generaciones en cero: las filas anteriores podrían volver a coincidir
+            self._conexion().execute("DELETE FROM entradas")
+
+    def _conexion(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            # Una conexión abierta antes de un fork (gunicorn --preload) no se reutiliza
+            conn = sqlite3.connect(self.ruta, timeout=1, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")  # es una caché: perderla no importa
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS entradas (
+                    clave TEXT PRIMARY KEY, valor BLOB NOT NULL, expira REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_entradas_expira ON entradas (expira)")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @staticmethod
+    def _clave(espacio, generacion, clave):
+        return f"{espacio}\x00{generacion}\x00{clave!r}"
+
+    def leer(self, espacio, generacion, clave):
+        """(valor, segundos restantes) o None si no está o venció"""
+        ahora = time.time()
+        fila = self._conexion().execute(
+            "SELECT valor, expira FROM entradas WHERE clave = ? AND expira > ?",
+            (self._clave(espacio, generacion, clave), ahora)).fetchone()
+        if fila is None:
+            self._metricas['fallos'] += 1
+            return None
+        self._metricas['aciertos'] += 1
+        return pickle.loads(fila[0]), fila[1] - ahora
+
+    def escribir(self, espacio, generacion, clave, valor, segundos):
+        ahora = time.time()
+        conn = self._conexion()
+        conn.execute("INSERT OR REPLACE INTO entradas (clave, valor, expira) VALUES (?, ?, ?)",
+                     (self._clave(espacio, generacion, clave),
+                      pickle.dumps(valor, pickle.HIGHEST_PROTOCOL), ahora + segundos))
+        self._metricas['escrituras'] += 1
+        if ahora >= self._proxima_limpieza:
+            self._proxima_limpieza = ahora + self._segundos_limpieza
+            conn.execute("DELETE FROM entradas WHERE expira <= ?", (ahora,))
+
+    def estadisticas(self):
+        return dict(self._metricas)
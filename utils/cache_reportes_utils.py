@@ -0,0 +1,151 @@
+"""Caché de resultados de reportes por período
+
+Un período ya cerrado (que termina antes de hoy) no vuelve a cambiar salvo
+ediciones puntuales de accesos históricos, así que su resultado se guarda
+en disco sin vencimiento y lo comparten todos los workers. Los períodos que
+incluyen hoy se guardan solo en memoria durante unos segundos.
+"""
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+import os
+import pickle
+import re
+import threading
+import time
+import uuid
+from utils.time_utils import app_now_date
+import config
+
+_PATRON_ARCHIVO = re.compile(r'^[a-z]+_(\d{8})_(\d{8})')
+
+
+class CacheReportes:
+    """
+    Resultados de reportes por (tipo, rango) con el rango semiabierto [inicio, fin)
+
+    Los archivos se nombran `<tipo>_<inicio>_<fin><extension>` para poder
+    invalidar por fecha sin índice aparte. Una invalidación deja una marca
+    (`.invalidado`): cualquier resultado que se empezó a calcular antes de
+    ella se descarta en lugar de guardarse, aunque termine después.
+    """
+
+    def __init__(self, directorio, segundos_hoy):
+        self.directorio = directorio
+        self.segundos_hoy = segundos_hoy
+        self._memoria = {}
+        self._lock = threading.Lock()
+
+    def es_cerrado(self, fin):
+        """True si el rango termina a más tardar al comenzar el día de hoy"""
+        return fin <= datetime.combine(app_now_date(), datetime.min.time())
+
+    def ruta(self, tipo, inicio, fin, extension):
+        if not tipo.isalpha():
+            raise ValueError(f"Tipo de reporte inválido: {tipo}")
+        return os.path.join(self.directorio, f"{tipo.lower()}_{inicio:%Y%m%d}_{fin:%Y%m%d}{extension}")
+
+    def obtener(self, tipo, inicio, fin, generar):
+        """
+        Devolver el valor cacheado del período o calcularlo con `generar()`
+
+        El valor debe poder serializarse con pickle (filas de la base de datos,
+        fechas, números).
+        """
+        if not self.es_cerrado(fin):
+            return self._obtener_hoy((tipo, inicio, fin), generar)
+
+        ruta = self.ruta(tipo, inicio, fin, '.pickle')
+        try:
+            with open(ruta, 'rb') as archivo:
+                return pickle.load(archivo)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"Error al leer caché de reporte {ruta}: {e}")
+
+        valor = generar()
+        with self.escribir(ruta) as archivo:
+            pickle.dump(valor, archivo, protocol=pickle.HIGHEST_PROTOCOL)
+        return valor
+
+    def _obtener_hoy(self, clave, generar):
+        ahora = time.monotonic()
+        with self._lock:
+            entrada = self._memoria.get(clave)
+            if entrada and entrada[1] > ahora:
+                return entrada[0]
+        valor = generar()
+        with self._lock:
+            # Purga de paso: las entradas vencidas no se vuelven a pedir
+            self._memoria = {c: e for c, e in self._memoria.items() if e[1] > ahora}
+            self._memoria[clave] = (valor, ahora + self.segundos_hoy)
+        return valor
+
+    @contextmanager
+    def escribir(self, ruta):
+        """
+        Escribir un resultado de forma atómica
+
+        Se escribe en un temporal que reemplaza a `ruta` al salir sin errores;
+        si hay una excepción (o el cliente corta una descarga en curso) o hubo
+        una invalidación mientras se calculaba, el temporal se descarta.
+        """
+        os.makedirs(self.directorio, exist_ok=True)
+        comienzo = time.time()
+        temporal = f"{ruta}.{uuid.uuid4().hex}.tmp"
+        archivo = open(temporal, 'wb')
+        try:
+            yield archivo
+            archivo.close()
+            if self._invalidado_desde(comienzo):
+                os.remove(temporal)
+            else:
+                os.replace(temporal, ruta)
+        except BaseException:
+            archivo.close()
+            try:
+                os.remove(temporal)
+            except OSError:
+                pass
+            raise
+
+    def _invalidado_desde(self, comienzo):
+        try:
+            return os.path.getmtime(os.path.join(self.directorio, '.invalidado')) >= comienzo
+        except OSError:
+            return False
+
+    def invalidar(self, fecha):
+        """
+        Descartar los resultados de todos los períodos que incluyen `fecha`
+
+        Llamar después de confirmar la transacción que modificó accesos de
+        ese día (junto con `invalidar_accesos_diarios` dentro de ella).
+        """
+        if isinstance(fecha, datetime):
+            fecha = fecha.date()
+        with self._lock:
+            self._memoria = {}
+        try:
+            os.makedirs(self.directorio, exist_ok=True)
+            with open(os.path.join(self.directorio, '.invalidado'), 'w'):
+                pass
+            nombres = os.listdir(self.directorio)
+        except OSError as e:
+            print(f"Error al invalidar caché de reportes: {e}")
+            return
+
+        for nombre in nombres:
+            coincidencia = _PATRON_ARCHIVO.match(nombre)
+            if not coincidencia:
+                continue
+            inicio = datetime.strptime(coincidencia.group(1), '%Y%m%d').date()
+            fin = datetime.strptime(coincidencia.group(2), '%Y%m%d').date()
+            if inicio <= fecha < fin:
+                try:
+                    os.remove(os.path.join(self.directorio, nombre))
+                except OSError:
+                    pass
+
+
+cache_reportes = CacheReportes(config.REPORTES_PERIODOS_DIR, config.REPORTES_CACHE_HOY_SEGUNDOS)
@@ -1,50 +1,197 @@
 """Utilidades de caché para mejorar el rendimiento"""
+from collections import OrderedDict
 from functools import wraps
-from datetime import timedelta
-from utils.time_utils import app_now
-import hashlib
-import json
-
-# Cache en memoria simple
-_cache = {}
-
-def cache_key(prefix, *args, **kwargs):
-    """Genera una clave única para el caché basada en los argumentos"""
-    key_parts = [prefix]
-    key_parts.extend(str(arg) for arg in args)
-    key_parts.extend(f"{k}:{v}" for k, v in sorted(kwargs.items()))
-    return hashlib.md5(":".join(key_parts).encode()).hexdigest()
-
-def cache_for(seconds=300):
+import threading
+import time
+import config
+from utils.cache_compartida_utils import CacheCompartida
+
+
+class _Vuelo:
+    """Cálculo en curso de una clave: las demás peticiones esperan su resultado"""
+    __slots__ = ('listo', 'valor', 'error')
+
+    def __init__(self):
+        self.listo = threading.Event()
+        self.valor = None
+        self.error = None
+
+
+class _Segmento:
+    __slots__ = ('lock', 'entradas', 'vuelos')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entradas = OrderedDict()  # clave -> (valor, expira, generación), de la menos a la más usada
+        self.vuelos = {}
+
+
+class CacheLRU:
+    """
+    Caché en memoria acotada (LRU) con vencimiento por entrada
+
+    Las claves se reparten en segmentos con su propio lock para que los
+    hilos del servidor no compitan por uno solo. Si varias peticiones
+    piden a la vez una clave ausente, se calcula una sola vez (single-flight).
+    Las claves se agrupan por espacio; `invalidar(espacio)` descarta todas
+    las de ese espacio en O(1) cambiando su generación.
+
+    Con `compartida` (CacheCompartida) hay un segundo nivel común a todos
+    los workers: un fallo local se busca ahí antes de calcular, y las
+    generaciones viven en memoria compartida, así que invalidar en un
+    worker invalida en todos.
+    """
+
+    def __init__(self, maximo=1024, segmentos=16, compartida=None):
+        self._segmentos = [_Segmento() for _ in range(segmentos)]
+        self._maximo_segmento = max(1, maximo // segmentos)
+        self._generaciones = {}
+        self._compartida = compartida
+        self._metricas = {'aciertos': 0, 'fallos': 0, 'vencidos_servidos': 0,
+                          'esperas': 0, 'desalojos': 0, 'invalidaciones': 0}
+
+    def _segmento(self, clave):
+        return self._segmentos[hash(clave) % len(self._segmentos)]
+
+    def _generacion(self, espacio):
+        if self._compartida is not None:
+            return self._compartida.generaciones.obtener(espacio)
+        return self._generaciones.get(espacio, 0)
+
+    def _calcular(self, espacio, generacion, clave, calcular, segundos):
+        """Valor y segundos de vigencia, pasando por el segundo nivel si existe"""
+        if self._compartida is None:
+            return calcular(), segundos
+        try:
+            encontrado = self._compartida.leer(espacio, generacion, clave)
+            if encontrado is not None:
+                return encontrado
+        except Exception as e:
+            self._compartida._metricas['errores'] += 1
+            print(f"Error al leer la caché compartida: {e}")
+        valor = calcular()
+        try:
+            self._compartida.escribir(espacio, generacion, clave, valor, segundos)
+        except Exception as e:
+            self._compartida._metricas['errores'] += 1
+            print(f"Error al escribir la caché compartida: {e}")
+        return valor, segundos
+
+    def obtener(self, espacio, clave, calcular, segundos, servir_vencido=False, compartir=True):
+        """
+        Devolver el valor en caché o calcularlo con `calcular()`
+
+        Args:
+            servir_vencido: Si otra petición ya está recalculando la clave,
+                devolver el valor anterior (vencido o invalidado) en lugar de esperar
+            compartir: Usar también el segundo nivel (el valor debe poder serializarse con pickle)
+        """
+        original = clave
+        clave = (espacio, clave)
+        segmento = self._segmento(clave)
+        generacion = self._generacion(espacio)
+        with segmento.lock:
+            entrada = segmento.entradas.get(clave)
+            if entrada is not None and entrada[2] == generacion and time.monotonic() < entrada[1]:
+                segmento.entradas.move_to_end(clave)
+                self._metricas['aciertos'] += 1
+                return entrada[0]
+            vuelo = segmento.vuelos.get(clave)
+            if vuelo is not None and servir_vencido and entrada is not None:
+                self._metricas['vencidos_servidos'] += 1
+                return entrada[0]
+            propio = vuelo is None
+            if propio:
+                vuelo = segmento.vuelos[clave] = _Vuelo()
+                self._metricas['fallos'] += 1
+            else:
+                self._metricas['esperas'] += 1
+
+        if not propio:
+            vuelo.listo.wait()
+            if vuelo.error is not None:
+                raise vuelo.error
+            return vuelo.valor
+
+        try:
+            if compartir:
+                vuelo.valor, segundos = self._calcular(espacio, generacion, original, calcular, segundos)
+            else:
+                vuelo.valor = calcular()
+        except Exception as e:
+            vuelo.error = e
+            raise
+        finally:
+            with segmento.lock:
+                del segmento.vuelos[clave]
+                # Un resultado calculado antes de una invalidación no se guarda
+                if vuelo.error is None and self._generacion(espacio) == generacion:
+                    segmento.entradas[clave] = (vuelo.valor, time.monotonic() + segundos, generacion)
+                    segmento.entradas.move_to_end(clave)
+                    while len(segmento.entradas) > self._maximo_segmento:
+                        segmento.entradas.popitem(last=False)
+                        self._metricas['desalojos'] += 1
+            vuelo.listo.set()
+        return vuelo.valor
+
+    def invalidar(self, espacio):
+        """Descartar todas las claves de un espacio (se recalculan en la próxima lectura)"""
+        if self._compartida is not None:
+            self._compartida.generaciones.incrementar(espacio)
+        else:
+            self._generaciones[espacio] = self._generaciones.get(espacio, 0) + 1
+        self._metricas['invalidaciones'] += 1
+
+    def limpiar(self):
+        for segmento in self._segmentos:
+            with segmento.lock:
+                segmento.entradas.clear()
+
+    def estadisticas(self):
+        consultas = self._metricas['aciertos'] + self._metricas['fallos']
+        return dict(self._metricas,
+                    entradas=sum(len(s.entradas) for s in self._segmentos),
+                    maximo=self._maximo_segmento * len(self._segmentos),
+                    tasa_aciertos=round(self._metricas['aciertos'] / consultas, 3) if consultas else None,
+                    compartida=self._compartida.estadisticas() if self._compartida is not None else None)
+
+
+def _crear_compartida():
+    if not config.CACHE_COMPARTIDA:
+        return None
+    try:
+        return CacheCompartida(config.CACHE_COMPARTIDA_DIR)
+    except Exception as e:
+        print(f"Error al abrir la caché compartida, se usa solo la local: {e}")
+        return None
+
+
+cache = CacheLRU(config.CACHE_MAX_ENTRADAS, config.CACHE_SEGMENTOS, _crear_compartida())
+
+
+def cache_for(seconds=300, espacio=None, servir_vencido=False, compartir=True):
     """
     Decorator para cachear resultados de funciones
     
     Args:
         seconds: Tiempo en segundos que el resultado permanecerá en caché
+        espacio: Espacio de claves para invalidar en grupo (por defecto, el nombre de la función)
+        servir_vencido, compartir: Ver CacheLRU.obtener
+    
+    La función decorada expone `invalidar()` para descartar sus resultados.
     """
     def decorator(func):
+        nombre = espacio or f"{func.__module__}.{func.__qualname__}"
+        
         @wraps(func)
         def wrapper(*args, **kwargs):
-            key = cache_key(func.__name__, *args, **kwargs)
-            
-            # Verificar si existe en caché y no ha expirado
-            if key in _cache:
-                result, expire_time = _cache[key]
-                if app_now() < expire_time:
-                    return result
-                
-            # Si no está en caché o expiró, ejecutar función
-            result = func(*args, **kwargs)
-            
-            # Almacenar en caché con tiempo de expiración
-            expire_time = app_now() + timedelta(seconds=seconds)
-            _cache[key] = (result, expire_time)
-            
-            return result
+            clave = (args, tuple(sorted(kwargs.items()))) if kwargs else args
+            return cache.obtener(nombre, clave, lambda: func(*args, **kwargs), seconds, servir_vencido, compartir)
+        
+        wrapper.invalidar = lambda: cache.invalidar(nombre)
         return wrapper
     return decorator
 
 def clear_cache():
     """Limpia todo el caché"""
-    global _cache
-    _cache = {}
\ No newline at end of file
+    cache.limpiar()
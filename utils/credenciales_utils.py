@@ -0,0 +1,132 @@
+"""Impresión de credenciales por lote con caché de páginas en disco"""
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import multiprocessing
+import os
+import signal
+import threading
+import time
+from pypdf import PdfWriter
+from utils.pdf_utils import generar_pdf_credencial
+import config
+
+# Cambiar al modificar el diseño de la credencial para no reutilizar páginas viejas
+VERSION_CREDENCIAL = 1
+
+CAMPOS_CREDENCIAL = ('nombre', 'identificacion', 'empresa', 'motivo', 'fecha_registro', 'codigo')
+
+_executor = None
+_lock = threading.Lock()
+_ultima_purga = 0.0
+
+
+def clave_credencial(visitante):
+    """Clave de caché: cambia si cambia cualquier dato impreso en la credencial"""
+    datos = '|'.join(str(visitante.get(campo)) for campo in CAMPOS_CREDENCIAL)
+    return hashlib.sha256(f"{VERSION_CREDENCIAL}|{datos}".encode()).hexdigest()[:32]
+
+
+def ruta_pagina(clave):
+    return os.path.join(config.CREDENCIALES_CACHE_DIR, f"{clave}.pdf")
+
+
+def _renderizar(visitante):
+    """Renderizar una credencial (se ejecuta en un proceso del pool)"""
+    return generar_pdf_credencial(visitante, visitante['codigo'])
+
+
+def _inicializar_proceso():
+    """Preparar un proceso del pool: solo lo necesario para renderizar, sin la app
+
+    Ctrl+C lo gestiona el proceso web, que cierra el pool; los hijos lo ignoran.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def _obtener_executor():
+    """Pool de procesos creado al primer lote grande
+
+    Se usa 'spawn' y no 'fork': el proceso web tiene hilos (pool de
+    conexiones, servidor) y un fork podría heredar sus locks tomados. Los
+    hijos solo importan este módulo y sus dependencias de renderizado; el
+    módulo principal (run.py / app.py) no arranca la app en ellos.
+    """
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=config.CREDENCIALES_PROCESOS,
+                                            mp_context=multiprocessing.get_context('spawn'),
+                                            initializer=_inicializar_proceso)
+        return _executor
+
+
+def purgar_paginas():
+    """Borrar páginas con más de CREDENCIALES_CACHE_DIAS días (como máximo una vez por hora)"""
+    global _ultima_purga
+    ahora = time.time()
+    if ahora - _ultima_purga < 3600:
+        return
+    _ultima_purga = ahora
+    limite = ahora - config.CREDENCIALES_CACHE_DIAS * 86400
+    try:
+        nombres = os.listdir(config.CREDENCIALES_CACHE_DIR)
+    except OSError:
+        return
+    for nombre in nombres:
+        ruta = os.path.join(config.CREDENCIALES_CACHE_DIR, nombre)
+        try:
+            if os.path.getmtime(ruta) < limite:
+                os.remove(ruta)
+        except OSError:
+            pass
+
+
+def _guardar(clave, contenido):
+    """Escribir la página con reemplazo atómico"""
+    temporal = f"{ruta_pagina(clave)}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temporal, 'wb') as archivo:
+        archivo.write(contenido)
+    os.replace(temporal, ruta_pagina(clave))
+
+
+def paginas_credenciales(visitantes):
+    """
+    Devolver la ruta de la página PDF de cada credencial, renderizando solo las que faltan
+
+    Los lotes de `CREDENCIALES_LOTE_PARALELO` o más credenciales pendientes
+    se reparten entre procesos; los pequeños se renderizan en el hilo actual,
+    donde arrancar el pool costaría más que el propio trabajo.
+    """
+    os.makedirs(config.CREDENCIALES_CACHE_DIR, exist_ok=True)
+    purgar_paginas()
+    claves = [clave_credencial(visitante) for visitante in visitantes]
+    pendientes = {}
+    for clave, visitante in zip(claves, visitantes):
+        if clave in pendientes:
+            continue
+        try:
+            # Página reutilizada: se renueva su plazo en la caché
+            os.utime(ruta_pagina(clave))
+        except OSError:
+            pendientes[clave] = visitante
+
+    if len(pendientes) >= config.CREDENCIALES_LOTE_PARALELO:
+        executor = _obtener_executor()
+        trozo = max(1, len(pendientes) // (config.CREDENCIALES_PROCESOS * 4))
+        resultados = executor.map(_renderizar, pendientes.values(), chunksize=trozo)
+    else:
+        resultados = map(_renderizar, pendientes.values())
+
+    for clave, contenido in zip(pendientes, resultados):
+        _guardar(clave, contenido)
+
+    return [ruta_pagina(clave) for clave in claves]
+
+
+def generar_lote_credenciales(visitantes, destino):
+    """Escribir en `destino` (archivo binario) un PDF con una página por credencial"""
+    writer = PdfWriter()
+    for ruta in paginas_credenciales(visitantes):
+        writer.append(ruta)
+    writer.write(destino)
+    writer.close()
@@ -1,26 +1,280 @@
 """Utilidades para optimizar las conexiones a la base de datos"""
 import mysql.connector
-from mysql.connector import pooling
+from mysql.connector.errors import PoolError
+from collections import deque
+import threading
+import time
+import traceback
 import config
+from utils.time_utils import app_utc_offset
 
-def create_connection_pool(pool_name="mypool", pool_size=5):
+# Límites superiores (segundos) de los buckets del histograma de espera
+BUCKETS_ESPERA = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+
+class PooledConnection:
+    """Envoltura de una conexión prestada: `close()` la devuelve al pool"""
+
+    def __init__(self, pool, conn, creada):
+        self._pool = pool
+        self._conn = conn
+        self._creada = creada
+        self.prestada = time.monotonic()
+        # Pila del préstamo, solo con la detección de fugas activa (es costosa)
+        self.pila = traceback.format_stack()[:-2] if getattr(config, 'DB_LEAK_DETECTION', False) else None
+        self._prestamos = _registrar_prestamo(self)
+
+    @property
+    def devuelta(self):
+        return self._conn is None
+
+    def __getattr__(self, name):
+        if self._conn is None:
+            raise PoolError("La conexión ya fue devuelta al pool")
+        return getattr(self._conn, name)
+
+    def close(self):
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            self._pool._devolver(conn, self._creada)
+            # Ya devuelta: no hace falta seguirla hasta el teardown (en peticiones
+            # largas la lista de préstamos crecería sin límite)
+            if self._prestamos is not None:
+                try:
+                    self._prestamos.remove(self)
+                except ValueError:
+                    pass
+                self._prestamos = None
+
+
+class ConnectionPool:
+    """
+    Pool de conexiones con desborde, cola de espera acotada y chequeos de salud.
+
+    - `pool_size` conexiones se mantienen abiertas; hasta `max_overflow` extra
+      se abren bajo carga y se cierran al devolverse.
+    - Si no hay conexiones libres, el solicitante espera hasta `timeout`
+      segundos; si ya hay `max_waiters` esperando, se rechaza de inmediato.
+    - Las conexiones más viejas que `recycle` segundos se reemplazan y las que
+      llevan inactivas más de `ping_interval` se verifican antes de prestarse,
+      evitando entregar conexiones cerradas por el `wait_timeout` de MySQL.
+    """
+
+    def __init__(self, dbconfig, pool_size=5, max_overflow=5, timeout=10.0,
+                 max_waiters=50, recycle=3600, pre_ping=True, ping_interval=30):
+        self.dbconfig = dbconfig
+        self.pool_size = pool_size
+        self.max_overflow = max_overflow
+        self.timeout = timeout
+        self.max_waiters = max_waiters
+        self.recycle = recycle
+        self.pre_ping = pre_ping
+        self.ping_interval = ping_interval
+
+        self._cond = threading.Condition()
+        self._inactivas = deque()  # (conexión, creada, último uso)
+        self._abiertas = 0
+        self._en_uso = 0
+        self._en_espera = 0
+        self._contadores = {
+            'checkouts': 0, 'timeouts': 0, 'rechazadas': 0,
+            'recicladas': 0, 'descartadas': 0, 'fugas': 0, 'espera_total_s': 0.0,
+        }
+        self._histograma = [0] * (len(BUCKETS_ESPERA) + 1)
+
+    @property
+    def max_conexiones(self):
+        return self.pool_size + self.max_overflow
+
+    def _crear(self):
+        # La sesión usa el desfase local de la app para que TIMESTAMP y CURDATE()
+        # coincidan con los rangos de fechas calculados en Python; el reciclado
+        # periódico de conexiones recoge los cambios de horario de verano.
+        return mysql.connector.connect(time_zone=app_utc_offset(), **self.dbconfig)
+
+    def _cerrar(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def contar(self, contador):
+        with self._cond:
+            self._contadores[contador] += 1
+
+    def _registrar_espera(self, segundos):
+        self._contadores['espera_total_s'] += segundos
+        for i, limite in enumerate(BUCKETS_ESPERA):
+            if segundos <= limite:
+                self._histograma[i] += 1
+                return
+        self._histograma[-1] += 1
+
+    def get_connection(self):
+        """Prestar una conexión, esperando como máximo `timeout` segundos"""
+        inicio = time.monotonic()
+        with self._cond:
+            if not self._inactivas and self._abiertas >= self.max_conexiones:
+                if self._en_espera >= self.max_waiters:
+                    self._contadores['rechazadas'] += 1
+                    raise PoolError("Pool de conexiones saturado: cola de espera llena")
+                self._en_espera += 1
+                try:
+                    limite = inicio + self.timeout
+                    while not self._inactivas and self._abiertas >= self.max_conexiones:
+                        restante = limite - time.monotonic()
+                        if restante <= 0:
+                            self._contadores['timeouts'] += 1
+                            raise PoolError("Tiempo de espera agotado al obtener una conexión")
+                        self._cond.wait(restante)
+                finally:
+                    self._en_espera -= 1
+
+            # LIFO: reutilizar primero las conexiones más recientes
+            entrada = self._inactivas.pop() if self._inactivas else None
+            if entrada is None:
+                self._abiertas += 1
+            self._en_uso += 1
+            self._contadores['checkouts'] += 1
+            self._registrar_espera(time.monotonic() - inicio)
+
+        try:
+            conn, creada = self._validar(entrada)
+        except Exception:
+            with self._cond:
+                self._abiertas -= 1
+                self._en_uso -= 1
+                self._cond.notify()
+            raise
+        return PooledConnection(self, conn, creada)
+
+    def _validar(self, entrada):
+        """Devolver una conexión sana, reemplazando la prestada si es necesario"""
+        ahora = time.monotonic()
+        if entrada is not None:
+            conn, creada, usada = entrada
+            if self.recycle and ahora - creada > self.recycle:
+                self.contar('recicladas')
+                self._cerrar(conn)
+            elif self.pre_ping and ahora - usada > self.ping_interval and not self._ping(conn):
+                self.contar('descartadas')
+                self._cerrar(conn)
+            else:
+                return conn, creada
+        return self._crear(), time.monotonic()
+
+    @staticmethod
+    def _ping(conn):
+        try:
+            conn.ping(reconnect=False)
+            return True
+        except Exception:
+            return False
+
+    def _devolver(self, conn, creada):
+        """Reintegrar una conexión al pool (o cerrarla si sobra o está dañada)"""
+        sana = True
+        try:
+            if getattr(conn, 'in_transaction', False):
+                conn.rollback()
+        except Exception:
+            sana = False
+
+        ahora = time.monotonic()
+        with self._cond:
+            self._en_uso -= 1
+            conservar = (sana and len(self._inactivas) < self.pool_size
+                         and not (self.recycle and ahora - creada > self.recycle))
+            if conservar:
+                self._inactivas.append((conn, creada, ahora))
+            else:
+                self._abiertas -= 1
+                if not sana:
+                    self._contadores['descartadas'] += 1
+            self._cond.notify()
+        if not conservar:
+            self._cerrar(conn)
+
+    def estadisticas(self):
+        """Contadores del pool para dimensionarlo a partir de datos reales"""
+        with self._cond:
+            histograma = {f"<={limite}s": n for limite, n in zip(BUCKETS_ESPERA, self._histograma)}
+            histograma['+Inf'] = self._histograma[-1]
+            return dict(
+                self._contadores,
+                tamano=self.pool_size,
+                max_overflow=self.max_overflow,
+                abiertas=self._abiertas,
+                en_uso=self._en_uso,
+                inactivas=len(self._inactivas),
+                en_espera=self._en_espera,
+                max_en_espera=self.max_waiters,
+                histograma_espera=histograma,
+            )
+
+
+def _registrar_prestamo(conexion):
+    """Anotar la conexión en la petición actual para detectar si no se devuelve
+
+    Devuelve la lista donde quedó anotada (None fuera de una petición).
+    """
+    from flask import g, has_request_context
+    if has_request_context():
+        prestadas = g.setdefault('conexiones_prestadas', [])
+        prestadas.append(conexion)
+        return prestadas
+    return None
+
+
+def liberar_conexiones_retenidas():
+    """
+    Devolver al pool las conexiones que la petición no cerró.
+
+    Se invoca al final de cada petición (teardown). Cada fuga se cuenta en las
+    estadísticas del pool y, con DB_LEAK_DETECTION activo, se informa la pila
+    donde se pidió la conexión.
+    """
+    from flask import g, request
+    retenidas = [c for c in g.pop('conexiones_prestadas', []) if not c.devuelta]
+    for conexion in retenidas:
+        conexion._pool.contar('fugas')
+        retenida_s = time.monotonic() - conexion.prestada
+        print(f"⚠️  Conexión no devuelta al pool en {request.endpoint} (retenida {retenida_s:.2f}s)")
+        if conexion.pila:
+            print("".join(conexion.pila))
+        conexion.close()
+    return len(retenidas)
+
+
+def create_connection_pool(pool_name="mypool", pool_size=None):
     """
-    Crea un pool de conexiones a la base de datos para mejorar el rendimiento
+    Crea un pool de conexiones a la base de datos para mejorar el rendimiento.
+
+    El tamaño, desborde, tiempo de espera y reciclado se leen de config.py
+    (DB_POOL_*), que a su vez admite variables de entorno.
     """
     dbconfig = {
-        "pool_name": pool_name,
-        "pool_size": pool_size,
         "host": config.DB_CONFIG['host'],
         "user": config.DB_CONFIG['user'],
         "password": config.DB_CONFIG['password'],
         "database": config.DB_CONFIG['database'],
         "port": config.DB_CONFIG['port']
     }
-    
-    return mysql.connector.pooling.MySQLConnectionPool(**dbconfig)
+
+    return ConnectionPool(
+        dbconfig,
+        pool_size=pool_size or getattr(config, 'DB_POOL_SIZE', 5),
+        max_overflow=getattr(config, 'DB_POOL_MAX_OVERFLOW', 5),
+        timeout=getattr(config, 'DB_POOL_TIMEOUT', 10),
+        max_waiters=getattr(config, 'DB_POOL_MAX_WAITERS', 50),
+        recycle=getattr(config, 'DB_POOL_RECYCLE', 3600),
+        pre_ping=getattr(config, 'DB_POOL_PRE_PING', True),
+        ping_interval=getattr(config, 'DB_POOL_PING_INTERVAL', 30),
+    )
 
 # Pool global
 connection_pool = None
+_pool_lock = threading.Lock()
 
 def get_connection():
     """
@@ -28,5 +282,11 @@ def get_connection():
     """
     global connection_pool
     if connection_pool is None:
-        connection_pool = create_connection_pool()
-    return connection_pool.get_connection()
\ No newline at end of file
+        with _pool_lock:
+            if connection_pool is None:
+                connection_pool = create_connection_pool()
+    return connection_pool.get_connection()
+
+def get_pool_stats():
+    """Estadísticas del pool global (vacías si aún no se creó)"""
+    return connection_pool.estadisticas() if connection_pool is not None else {}
@@ -0,0 +1,270 @@
+"""Escritura diferida de lecturas de acceso: diario local + volcado por lotes"""
+from collections import deque
+from datetime import datetime
+import atexit
+import json
+import os
+import socket
+import threading
+import time
+from models.database import Database
+from utils.acceso_utils import guardar_lecturas
+from utils.cache_reportes_utils import cache_reportes
+import config
+
+try:
+    import fcntl
+except ImportError:  # Windows: un solo diario, sin bloqueo entre procesos
+    fcntl = None
+
+
+class ColaLlena(Exception):
+    """La cola de escritura diferida alcanzó su máximo; escribir de forma síncrona"""
+
+
+class EscrituraDiferida:
+    """
+    Diario local de lecturas aceptadas y volcado en segundo plano
+
+    `registrar()` agrega las lecturas al diario (una línea JSON por llamada,
+    con fsync) y vuelve de inmediato; un hilo las vuelca a MySQL en lotes
+    con sentencias de varias filas y un solo commit por lote. La última
+    secuencia volcada se guarda en `diario_accesos_estado` dentro de la
+    misma transacción, así que al reiniciar se reaplica solo lo pendiente
+    del diario, sin duplicar filas.
+
+    Cada proceso toma un diario propio del directorio (`diario-N.jsonl`,
+    con bloqueo exclusivo); al reiniciar, los procesos nuevos heredan los
+    diarios de los anteriores y terminan de volcarlos. La secuencia continúa
+    desde la mayor entre el diario y la marca de la base de datos, así que
+    perder el directorio no hace que las lecturas nuevas parezcan ya volcadas.
+
+    Los eventos en vivo de cada lectura se publican (`al_volcar`) solo
+    después del commit del lote que la contiene.
+    """
+
+    def __init__(self, directorio, max_pendientes, intervalo_ms, lote):
+        self.directorio = directorio
+        self.max_pendientes = max_pendientes
+        self.intervalo = intervalo_ms / 1000
+        self.lote = lote
+        self._pendientes = deque()  # (secuencia, registros, time.time() de recepción, eventos)
+        self._cantidad = 0          # registros pendientes (una entrada puede traer varios)
+        self._secuencia = 0
+        self._marca = None          # última secuencia confirmada en la base de datos
+        self._recuperado_hasta = 0  # mayor secuencia leída del diario al arrancar
+        self._al_volcar = None
+        self._archivo = None
+        self.clave = None
+        self._lock = threading.Lock()
+        self._condicion = threading.Condition(self._lock)
+        self._detener = threading.Event()
+        self._hilo = None
+        self._metricas = {'volcados': 0, 'registros_volcados': 0, 'errores': 0,
+                          'ultimo_volcado': None, 'ultimo_error': None, 'duracion_ultimo_ms': None}
+
+    def activa(self):
+        return self._hilo is not None and self._hilo.is_alive()
+
+    def iniciar(self, al_volcar=None):
+        """
+        Tomar un diario libre, recuperar lo pendiente y arrancar el hilo de volcado
+
+        Args:
+            al_volcar: Función que recibe la lista de eventos (tipo, datos) de
+                cada lote tras su commit; se llama aunque la lista esté vacía
+        """
+        if self.activa():
+            return
+        self._al_volcar = al_volcar
+        os.makedirs(self.directorio, exist_ok=True)
+        self._archivo, nombre = self._tomar_diario()
+        self.clave = f"{socket.gethostname()}:{nombre}"[:100]
+        self._recuperar()
+        try:
+            self._cargar_marca()
+        except Exception as e:
+            # Se reintenta en el primer volcado; lo escrito desde ahora nunca se descarta
+            print(f"Error al leer la marca de escritura diferida: {e}")
+        self._hilo = threading.Thread(target=self._bucle, name='escritura-diferida', daemon=True)
+        self._hilo.start()
+        atexit.register(self.detener)
+
+    def _tomar_diario(self):
+        indice = 0
+        while True:
+            nombre = f"diario-{indice}"
+            archivo = open(os.path.join(self.directorio, f"{nombre}.jsonl"), 'a+b')
+            if fcntl is None:
+                return archivo, nombre
+            try:
+                fcntl.flock(archivo.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return archivo, nombre
+            except OSError:
+                archivo.close()
+                indice += 1
+
+    def _cargar_marca(self, cursor=None):
+        """Leer la última secuencia volcada y continuar la numeración por encima de ella"""
+        if cursor is None:
+            with Database().cursor() as cursor:
+                return self._cargar_marca(cursor)
+        cursor.execute("SELECT secuencia FROM diario_accesos_estado WHERE clave = %s", (self.clave,))
+        fila = cursor.fetchone()
+        marca = fila['secuencia'] if fila else 0
+        with self._lock:
+            self._marca = marca
+            if marca > self._secuencia:
+                print(f"Escritura diferida: el diario {self.clave} iba por {self._secuencia} y la base "
+                      f"de datos por {marca}; se continúa desde {marca}")
+                self._secuencia = marca
+
+    def _recuperar(self):
+        """Encolar las entradas del diario (las ya volcadas se descartan en el primer volcado)"""
+        self._archivo.seek(0)
+        valido = 0
+        for linea in self._archivo:
+            try:
+                entrada = json.loads(linea)
+            except ValueError:
+                break  # línea a medio escribir: la lectura nunca se confirmó al guardia
+            valido += len(linea)
+            self._secuencia = max(self._secuencia, entrada['s'])
+            if entrada['r']:
+                registros = [_decodificar(r) for r in entrada['r']]
+                # Sin eventos en vivo: ya no son actuales
+                self._pendientes.append((entrada['s'], registros, entrada.get('t', time.time()), []))
+                self._cantidad += len(registros)
+        self._recuperado_hasta = self._secuencia
+        # Descartar el resto para que las líneas nuevas no queden pegadas a una incompleta
+        self._archivo.truncate(valido)
+        if self._pendientes:
+            print(f"Escritura diferida: {self._cantidad} lecturas pendientes recuperadas de {self.clave}")
+
+    def registrar(self, registros, eventos=()):
+        """
+        Guardar lecturas en el diario (durables al volver) para volcarlas después
+
+        `eventos` se publican con `al_volcar` cuando el lote queda confirmado.
+
+        Raises:
+            ColaLlena: Si hay `max_pendientes` lecturas sin volcar
+            OSError: Si no se pudo escribir el diario
+        """
+        with self._condicion:
+            if self._cantidad + len(registros) > self.max_pendientes:
+                raise ColaLlena()
+            self._secuencia += 1
+            ahora = time.time()
+            linea = json.dumps({'s': self._secuencia, 't': ahora, 'r': [_codificar(r) for r in registros]})
+            self._archivo.write(linea.encode('utf-8') + b'\n')
+            self._archivo.flush()
+            os.fsync(self._archivo.fileno())
+            self._pendientes.append((self._secuencia, registros, ahora, list(eventos)))
+            self._cantidad += len(registros)
+            if self._cantidad >= self.lote:
+                self._condicion.notify()
+
+    def _bucle(self):
+        espera = self.intervalo
+        while not self._detener.is_set():
+            with self._condicion:
+                self._condicion.wait_for(lambda: self._cantidad >= self.lote or self._detener.is_set(),
+                                         timeout=espera)
+            # Tras un error se espera cada vez más (hasta 30 s) para no saturar una base caída
+            espera = self.intervalo if self._volcar() else min(max(espera * 2, 1.0), 30.0)
+
+    def _volcar(self):
+        """Volcar un lote pendiente; False si falló (queda en cola para reintentar)"""
+        with self._lock:
+            lote, cantidad = [], 0
+            for entrada in self._pendientes:
+                if lote and cantidad + len(entrada[1]) > self.lote:
+                    break
+                lote.append(entrada)
+                cantidad += len(entrada[1])
+        if not lote:
+            return True
+
+        comienzo = time.monotonic()
+        try:
+            with Database().transaccion() as cursor:
+                if self._marca is None:
+                    self._cargar_marca(cursor)
+                # Las entradas del diario recuperado ya confirmadas antes del reinicio no se
+                # vuelven a escribir; las registradas después de arrancar siempre se escriben
+                registros = [r for secuencia, regs, _, _ in lote
+                             if secuencia > self._marca or secuencia > self._recuperado_hasta for r in regs]
+                dias_pasados, _ = guardar_lecturas(cursor, registros) if registros else (set(), None)
+                cursor.execute("""
+                    INSERT INTO diario_accesos_estado (clave, secuencia) VALUES (%s, %s)
+                    ON DUPLICATE KEY UPDATE secuencia = GREATEST(secuencia, VALUES(secuencia))
+                """, (self.clave, lote[-1][0]))
+        except Exception as e:
+            self._metricas['errores'] += 1
+            self._metricas['ultimo_error'] = str(e)
+            print(f"Error en escritura diferida de accesos: {e}")
+            return False
+
+        self._marca = max(self._marca, lote[-1][0])
+        with self._lock:
+            for _ in lote:
+                self._pendientes.popleft()
+            self._cantidad -= cantidad
+            if not self._pendientes:
+                # Todo está en la base de datos: el diario empieza de cero, conservando
+                # la secuencia para que un reinicio no la confunda con lo ya volcado
+                self._archivo.truncate(0)
+                self._archivo.write(json.dumps({'s': self._secuencia, 'r': []}).encode('utf-8') + b'\n')
+                self._archivo.flush()
+                os.fsync(self._archivo.fileno())
+            self._metricas['volcados'] += 1
+            self._metricas['registros_volcados'] += cantidad
+            self._metricas['ultimo_volcado'] = datetime.now().isoformat(timespec='seconds')
+            self._metricas['duracion_ultimo_ms'] = round((time.monotonic() - comienzo) * 1000, 1)
+
+        for fecha in dias_pasados:
+            cache_reportes.invalidar(fecha)
+        if self._al_volcar is not None:
+            try:
+                self._al_volcar([evento for _, _, _, eventos in lote for evento in eventos])
+            except Exception as e:
+                print(f"Error al publicar eventos de escritura diferida: {e}")
+        return True
+
+    def detener(self, espera=5.0):
+        """Detener el hilo intentando volcar lo pendiente (lo que quede sigue en el diario)"""
+        if not self.activa():
+            return
+        self._detener.set()
+        with self._condicion:
+            self._condicion.notify()
+        self._hilo.join(espera)
+        limite = time.monotonic() + espera
+        while self._pendientes and time.monotonic() < limite and self._volcar():
+            pass
+
+    def estadisticas(self):
+        with self._lock:
+            antiguedad = time.time() - self._pendientes[0][2] if self._pendientes else 0.0
+            return dict(self._metricas,
+                        activa=self.activa(),
+                        diario=self.clave,
+                        pendientes=self._cantidad,
+                        max_pendientes=self.max_pendientes,
+                        retraso_segundos=round(antiguedad, 3))
+
+
+def _codificar(registro):
+    return dict(registro, fecha_hora=registro['fecha_hora'].isoformat())
+
+
+def _decodificar(registro):
+    registro = dict(registro, fecha_hora=datetime.fromisoformat(registro['fecha_hora']))
+    if registro.get('alerta'):
+        registro['alerta'] = tuple(registro['alerta'])
+    return registro
+
+
+escritura_diferida = EscrituraDiferida(config.DIARIO_ACCESOS_DIR, config.ESCRITURA_DIFERIDA_MAX_PENDIENTES,
+                                       config.ESCRITURA_DIFERIDA_INTERVALO_MS, config.ESCRITURA_DIFERIDA_LOTE)
@@ -0,0 +1,135 @@
+"""Bus de eventos en proceso para notificaciones en vivo (Server-Sent Events)"""
+from collections import deque
+import itertools
+import json
+import threading
+import time
+import config
+
+# Evento que se entrega a un suscriptor que se quedó atrás: debe pedir un estado completo
+EVENTO_RESINCRONIZAR = 'resincronizar'
+
+
+class Suscripcion:
+    """Cola acotada de eventos pendientes de un cliente conectado"""
+
+    def __init__(self, bus, maximo):
+        self._bus = bus
+        self._eventos = deque()
+        self._maximo = maximo
+        self._cond = threading.Condition()
+        self.descartados = 0
+
+    def _entregar(self, evento):
+        with self._cond:
+            if len(self._eventos) >= self._maximo:
+                # Cliente lento: se descarta su cola y se le pide resincronizar
+                # en lugar de bloquear al publicador o crecer sin límite
+                self.descartados += len(self._eventos)
+                self._eventos.clear()
+                evento = (next(self._bus._ids), EVENTO_RESINCRONIZAR, {})
+            self._eventos.append(evento)
+            self._cond.notify()
+
+    def esperar(self, timeout):
+        """Devolver los eventos pendientes, esperando como máximo `timeout` segundos"""
+        with self._cond:
+            if not self._eventos:
+                self._cond.wait(timeout)
+            eventos = list(self._eventos)
+            self._eventos.clear()
+            return eventos
+
+    def cerrar(self):
+        self._bus._retirar(self)
+
+
+class BusEventos:
+    """
+    Reparte cada evento publicado a todas las suscripciones del proceso
+
+    Publicar nunca bloquea ni consulta la base de datos: solo copia una
+    referencia al evento en la cola de cada suscriptor.
+    """
+
+    def __init__(self, max_suscriptores, max_pendientes):
+        self.max_suscriptores = max_suscriptores
+        self.max_pendientes = max_pendientes
+        self._suscripciones = set()
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._publicados = 0
+
+    def suscribir(self):
+        """Registrar un cliente; devuelve None si se alcanzó el máximo"""
+        with self._lock:
+            if len(self._suscripciones) >= self.max_suscriptores:
+                return None
+            suscripcion = Suscripcion(self, self.max_pendientes)
+            self._suscripciones.add(suscripcion)
+            return suscripcion
+
+    def _retirar(self, suscripcion):
+        with self._lock:
+            self._suscripciones.discard(suscripcion)
+
+    def publicar(self, tipo, datos):
+        """Publicar un evento para todos los suscriptores actuales"""
+        evento = (next(self._ids), tipo, datos)
+        with self._lock:
+            suscripciones = list(self._suscripciones)
+            self._publicados += 1
+        for suscripcion in suscripciones:
+            suscripcion._entregar(evento)
+
+    def estadisticas(self):
+        with self._lock:
+            return {
+                'suscriptores': len(self._suscripciones),
+                'publicados': self._publicados,
+                'descartados': sum(s.descartados for s in self._suscripciones),
+            }
+
+
+def formatear_evento(id, tipo, datos):
+    """Serializar un evento en formato text/event-stream"""
+    return f"id: {id}\nevent: {tipo}\ndata: {json.dumps(datos, default=str)}\n\n"
+
+
+def transmitir(suscripcion, adaptar=None, estado=None):
+    """
+    Generador SSE para una suscripción, con latido periódico
+
+    Args:
+        adaptar: Función (tipo, datos) -> datos o None; permite recortar o
+            descartar eventos según los permisos del cliente
+        estado: Función sin argumentos que devuelve el evento ('tipo', datos)
+            con el estado completo; se envía al conectar, al resincronizar y
+            como latido, lo que corrige cualquier deriva del cliente
+    """
+    latido = config.SSE_LATIDO_SEGUNDOS
+    try:
+        yield f"retry: {config.SSE_REINTENTO_MS}\n\n"
+        if estado:
+            yield formatear_evento(0, *estado())
+        ultimo_envio = time.monotonic()
+        while True:
+            for id, tipo, datos in suscripcion.esperar(latido):
+                if tipo == EVENTO_RESINCRONIZAR and estado:
+                    yield formatear_evento(id, *estado())
+                    continue
+                if adaptar:
+                    datos = adaptar(tipo, datos)
+                    if datos is None:
+                        continue
+                yield formatear_evento(id, tipo, datos)
+                ultimo_envio = time.monotonic()
+            if time.monotonic() - ultimo_envio >= latido:
+                # El latido mantiene viva la conexión y detecta clientes desconectados
+                yield formatear_evento(0, *estado()) if estado else ": latido\n\n"
+                ultimo_envio = time.monotonic()
+    finally:
+        suscripcion.cerrar()
+
+
+bus_eventos = BusEventos(config.SSE_MAX_SUSCRIPTORES, config.SSE_MAX_PENDIENTES)
@@ -0,0 +1,38 @@
+"""Utilidades para exportaciones en streaming (memoria constante)"""
+import csv
+import io
+
+
+def filas_en_lotes(cursor, tamano):
+    """Iterar un cursor sin buffer leyendo `tamano` filas por viaje"""
+    while True:
+        lote = cursor.fetchmany(tamano)
+        if not lote:
+            return
+        yield lote
+
+
+def generar_csv(encabezados, lotes, formatear_fila, bom=True):
+    """
+    Generar un CSV por trozos a partir de lotes de filas
+
+    Cada lote se escribe en un buffer reutilizado y se entrega codificado en
+    UTF-8, de modo que la memoria no depende del número total de filas.
+
+    Args:
+        encabezados: Lista con los títulos de las columnas
+        lotes: Iterable de listas de filas (p.ej. `filas_en_lotes`)
+        formatear_fila: Función fila -> lista de valores para el CSV
+        bom: Anteponer BOM para que Excel detecte UTF-8
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    writer.writerow(encabezados)
+    yield (('\ufeff' if bom else '') + buffer.getvalue()).encode('utf-8')
+
+    for lote in lotes:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(formatear_fila(fila) for fila in lote)
+        yield buffer.getvalue().encode('utf-8')
@@ -0,0 +1,179 @@
+"""Motor de horarios de acceso: reglas de config.HORARIOS_ACCESO compiladas a tablas de intervalos"""
+from bisect import bisect_right
+from datetime import date
+import threading
+import config
+from utils.time_utils import app_now
+
+DIAS = {'lun': 0, 'mar': 1, 'mie': 2, 'mié': 2, 'jue': 3, 'vie': 4, 'sab': 5, 'sáb': 5, 'dom': 6}
+FESTIVO = 7  # índice de la tabla de días festivos
+_DIA_SEGUNDOS = 24 * 3600
+
+
+def _segundos(texto):
+    horas, minutos = texto.split(':')
+    valor = int(horas) * 3600 + int(minutos) * 60
+    if not 0 <= valor <= _DIA_SEGUNDOS:
+        raise ValueError(f"Hora inválida en HORARIOS_ACCESO: {texto}")
+    return valor
+
+
+def _dias(especificacion):
+    """'lun', 'lun-vie', 'todos' o 'festivo' -> índices de tabla"""
+    especificacion = especificacion.strip().lower()
+    if especificacion == 'festivo':
+        return [FESTIVO]
+    if especificacion == 'todos':
+        return list(range(7))
+    if '-' in especificacion:
+        desde, hasta = (DIAS[d.strip()] for d in especificacion.split('-'))
+        return [(desde + i) % 7 for i in range((hasta - desde) % 7 + 1)]
+    return [DIAS[especificacion]]
+
+
+def _compilar_franjas(franjas_por_dia):
+    """
+    {índice de día: [(inicio, fin), ...]} -> {índice: [límites ordenados]}
+
+    Cada franja incluye el segundo final (18:00 permite 18:00:00 y no
+    18:00:01). Una franja que cruza la medianoche (22:00-06:00) sigue en el
+    día siguiente. Los límites alternan apertura/cierre: un momento está
+    permitido si la cantidad de límites <= él es impar.
+    """
+    intervalos = {dia: [] for dia in franjas_por_dia}
+    for dia, franjas in franjas_por_dia.items():
+        for inicio, fin in franjas:
+            inicio, fin = _segundos(inicio), _segundos(fin)
+            if fin > inicio:
+                intervalos[dia].append((inicio, fin + 1))
+            elif fin < inicio:
+                intervalos[dia].append((inicio, _DIA_SEGUNDOS))
+                if dia != FESTIVO:
+                    intervalos.setdefault((dia + 1) % 7, []).append((0, fin + 1))
+    tablas = {}
+    for dia, lista in intervalos.items():
+        limites = []
+        for inicio, fin in sorted(lista):
+            if limites and inicio <= limites[-1]:
+                limites[-1] = max(limites[-1], fin)  # unir franjas solapadas
+            else:
+                limites.extend((inicio, fin))
+        tablas[dia] = limites
+    return tablas
+
+
+class MotorHorarios:
+    """
+    Decide si un acceso está dentro del horario permitido
+
+    Formato de `config.HORARIOS_ACCESO` (solo `hora_inicio`/`hora_fin` son obligatorios):
+
+        'hora_inicio': '08:00', 'hora_fin': '18:00',  # horario general
+        'dias': 'lun-vie',                  # días con horario general (por defecto, todos)
+        'festivos': ['2026-12-25', ...],    # sin acceso, salvo 'franjas_festivo'
+        'franjas_festivo': [('09:00', '13:00')],
+        'reglas': {                         # por rol del usuario que registra o tipo de visitante
+            'rol:administrador': {'todos': [('06:00', '22:00')]},
+            'tipo:contratista': {'lun-vie': [('07:00', '16:00')], 'festivo': []},
+        }
+
+    En una regla, los días que no se mencionan usan el horario general.
+    Prioridad: regla del rol, luego del tipo de visitante, luego general.
+    Las reglas se compilan una vez a tablas de límites por día (y de nuevo
+    si se reemplaza `config.HORARIOS_ACCESO`); cada consulta es una
+    búsqueda binaria.
+    """
+
+    def __init__(self):
+        self._origen = None
+        self._tablas = None
+        self._festivos = frozenset()
+        self._lock = threading.Lock()
+
+    def recargar(self):
+        """Recompilar las reglas (p. ej. tras modificar HORARIOS_ACCESO en su lugar)"""
+        with self._lock:
+            reglas = config.HORARIOS_ACCESO
+            general = {dia: [] for dia in range(FESTIVO + 1)}
+            franja = (reglas['hora_inicio'], reglas['hora_fin'])
+            dias = reglas.get('dias', 'todos')
+            for especificacion in ([dias] if isinstance(dias, str) else dias):
+                for dia in _dias(especificacion):
+                    general[dia] = [franja]
+            general[FESTIVO] = list(reglas.get('franjas_festivo', []))
+
+            tablas = {None: _compilar_franjas(general)}
+            for clave, regla in reglas.get('reglas', {}).items():
+                propias = {}
+                for especificacion, lista in regla.items():
+                    for dia in _dias(especificacion):
+                        propias.setdefault(dia, []).extend(lista)
+                tablas[clave] = _compilar_franjas({dia: propias.get(dia, general[dia]) for dia in general})
+
+            self._festivos = frozenset(date.fromisoformat(str(f)) for f in reglas.get('festivos', []))
+            self._tablas = tablas
+            self._origen = reglas
+
+    def _tabla(self, rol, tipo):
+        if self._origen is not config.HORARIOS_ACCESO:
+            self.recargar()
+        tablas = self._tablas
+        return tablas.get(f"rol:{rol}") or tablas.get(f"tipo:{tipo}") or tablas[None]
+
+    def _limites(self, momento, rol, tipo):
+        tabla = self._tabla(rol, tipo)
+        return tabla[FESTIVO if momento.date() in self._festivos else momento.weekday()]
+
+    def permitido(self, momento, rol=None, tipo=None):
+        """¿Está `momento` (naive, hora de la app) dentro del horario?"""
+        segundos = momento.hour * 3600 + momento.minute * 60 + momento.second
+        return bisect_right(self._limites(momento, rol, tipo), segundos) % 2 == 1
+
+    def permitido_ahora(self, rol=None, tipo=None):
+        return self.permitido(app_now().replace(tzinfo=None), rol, tipo)
+
+    def describir(self, momento, rol=None, tipo=None):
+        """Franjas del día de `momento` como texto ('08:00 - 18:00'), para mensajes"""
+        limites = self._limites(momento, rol, tipo)
+        if not limites:
+            return 'sin acceso este día'
+        return ', '.join(f"{_texto(inicio)} - {_texto(fin - 1)}" for inicio, fin in zip(limites[::2], limites[1::2]))
+
+    def fuera_de_horario_por_dia(self, cursor, inicio, fin):
+        """
+        Accesos de visitantes fuera del horario vigente en [inicio, fin), por día
+
+        Agrupa por instante y rol del usuario que registró y evalúa cada
+        grupo con `permitido`, igual que el control de acceso. Lo usa el
+        rollup diario al cerrar cada día; el día en curso se cuenta con
+        `contar_fuera_de_horario`.
+
+        Returns:
+            dict: fecha -> cantidad (solo días con accesos fuera de horario)
+        """
+        cursor.execute("""
+            SELECT a.fecha_hora, r.nombre as rol, COUNT(*) as cantidad
+            FROM accesos a
+            LEFT JOIN usuarios u ON a.usuario_id = u.id
+            LEFT JOIN roles r ON u.rol_id = r.id
+            WHERE a.fecha_hora >= %s AND a.fecha_hora < %s
+            AND a.tipo IN ('entrada', 'salida') AND a.visitante_id IS NOT NULL
+            GROUP BY a.fecha_hora, rol
+        """, (inicio, fin))
+        por_dia = {}
+        for fila in cursor.fetchall():
+            if not self.permitido(fila['fecha_hora'], rol=fila['rol']):
+                fecha = fila['fecha_hora'].date()
+                por_dia[fecha] = por_dia.get(fecha, 0) + int(fila['cantidad'])
+        return por_dia
+
+    def contar_fuera_de_horario(self, cursor, inicio, fin):
+        """Total de accesos fuera de horario en [inicio, fin) desde los accesos crudos (para hoy)"""
+        return sum(self.fuera_de_horario_por_dia(cursor, inicio, fin).values())
+
+
+def _texto(segundos):
+    return f"{segundos // 3600:02d}:{segundos % 3600 // 60:02d}"
+
+
+motor_horarios = MotorHorarios()
@@ -0,0 +1,198 @@
+"""Índice en memoria de credenciales activas para validar lecturas sin consultar la base de datos"""
+from mysql.connector import Error
+import threading
+import time
+from models.database import Database, ErrorConexion
+from utils.time_utils import app_now
+import config
+
+# Holgura al pedir cambios desde la última sincronización: una transacción
+# puede confirmarse después de haber sellado `modificado` con una hora anterior
+MARGEN_CAMBIOS_SEGUNDOS = 60
+
+
+class IndiceCredenciales:
+    """
+    codigo -> datos de la credencial activa (de un visitante activo)
+
+    Cada worker guarda una copia completa y, cuando cambia el contador
+    `cache_versiones.credenciales` (consultado como máximo una vez cada
+    `CREDENCIALES_INDICE_SEGUNDOS`), aplica solo las credenciales con
+    `modificado` posterior a su última sincronización; la carga completa se
+    hace una vez al arrancar. Quien emite o desactiva credenciales incrementa
+    el contador en su transacción (`notificar_cambio`) y, tras el commit,
+    actualiza la copia local pasando la versión obtenida (`agregar` /
+    `quitar`), así que el propio worker ve el cambio al instante sin
+    recargar y los demás dentro del intervalo.
+
+    Si la base de datos no responde la consulta de versión, `disponible()`
+    devuelve False y el llamador debe validar contra la base de datos.
+    """
+
+    def __init__(self, intervalo):
+        self.intervalo = intervalo
+        self._codigos = {}
+        self._version = None
+        self._sincronizado = None  # NOW() de la base de datos en la última sincronización
+        self._verificado = 0.0
+        self._lock = threading.Lock()
+        self._recargando = threading.Lock()
+
+    def disponible(self):
+        """Comprobar la versión compartida (como máximo una vez por intervalo) y recargar si cambió"""
+        ahora = time.monotonic()
+        if ahora - self._verificado < self.intervalo:
+            return self._version is not None
+
+        # Una sola recarga a la vez; mientras tanto los demás hilos usan la copia actual
+        if not self._recargando.acquire(blocking=self._version is None):
+            return True
+        try:
+            if time.monotonic() - self._verificado < self.intervalo:
+                return self._version is not None
+            with Database().cursor(dictionary=False) as cursor:
+                cursor.execute("SELECT version FROM cache_versiones WHERE clave = 'credenciales'")
+                fila = cursor.fetchone()
+                version = fila[0] if fila else None
+                if version is not None and version != self._version:
+                    if self._sincronizado is None:
+                        self._cargar(cursor)
+                    else:
+                        self._aplicar_cambios(cursor)
+            with self._lock:
+                self._version = version
+            self._verificado = time.monotonic()
+        except ErrorConexion:
+            self._version = None
+        except Error as e:
+            print(f"Error al sincronizar índice de credenciales: {e}")
+            self._version = None
+            self._sincronizado = None
+        finally:
+            self._recargando.release()
+        return self._version is not None
+
+    def _cargar(self, cursor):
+        cursor.execute("SELECT NOW()")
+        sincronizado = cursor.fetchone()[0]
+        cursor.execute("""
+            SELECT c.codigo, c.id, c.fecha_expiracion, v.id, v.nombre
+            FROM credenciales c
+            JOIN visitantes v ON c.visitante_id = v.id
+            WHERE c.estado = 'activa' AND v.estado = 'activo'
+            AND (c.fecha_expiracion IS NULL OR c.fecha_expiracion > NOW())
+        """)
+        codigos = {}
+        for codigo, credencial_id, fecha_expiracion, visitante_id, nombre in cursor.fetchall():
+            codigos[codigo] = {
+                'credencial_id': credencial_id,
+                'id': visitante_id,
+                'nombre': nombre,
+                'fecha_expiracion': fecha_expiracion,
+            }
+        with self._lock:
+            self._codigos = codigos
+        self._sincronizado = sincronizado
+
+    def _aplicar_cambios(self, cursor):
+        """Releer solo las credenciales modificadas desde la última sincronización"""
+        cursor.execute("SELECT NOW()")
+        sincronizado = cursor.fetchone()[0]
+        cursor.execute("""
+            SELECT c.codigo, c.id, c.fecha_expiracion, v.id, v.nombre,
+                c.estado = 'activa' AND v.estado = 'activo'
+                AND (c.fecha_expiracion IS NULL OR c.fecha_expiracion > NOW()) as vigente
+            FROM credenciales c
+            JOIN visitantes v ON c.visitante_id = v.id
+            WHERE c.modificado >= %s - INTERVAL %s SECOND
+        """, (self._sincronizado, MARGEN_CAMBIOS_SEGUNDOS))
+        filas = cursor.fetchall()
+        with self._lock:
+            for codigo, credencial_id, fecha_expiracion, visitante_id, nombre, vigente in filas:
+                if vigente:
+                    self._codigos[codigo] = {
+                        'credencial_id': credencial_id,
+                        'id': visitante_id,
+                        'nombre': nombre,
+                        'fecha_expiracion': fecha_expiracion,
+                    }
+                else:
+                    self._codigos.pop(codigo, None)
+        self._sincronizado = sincronizado
+
+    def buscar(self, codigo):
+        """Datos de la credencial (claves id, nombre, credencial_id, fecha_expiracion) o None si no es válida"""
+        credencial = self._codigos.get(codigo)
+        if credencial is None:
+            return None
+        expiracion = credencial['fecha_expiracion']
+        if expiracion is not None and expiracion <= app_now().replace(tzinfo=None):
+            # Vencida desde la última carga: se descarta sin esperar a la próxima
+            self.quitar(codigo)
+            return None
+        return credencial
+
+    def agregar(self, codigo, credencial_id, visitante_id, nombre, fecha_expiracion, version=None):
+        """Añadir una credencial emitida; `version` es la devuelta por `notificar_cambio`"""
+        with self._lock:
+            self._codigos[codigo] = {
+                'credencial_id': credencial_id,
+                'id': visitante_id,
+                'nombre': nombre,
+                'fecha_expiracion': fecha_expiracion,
+            }
+            self._adoptar(version)
+
+    def quitar(self, codigo=None, visitante_id=None, version=None):
+        """Quitar una credencial por código o todas las de un visitante"""
+        with self._lock:
+            if codigo is not None:
+                self._codigos.pop(codigo, None)
+            if visitante_id is not None:
+                self._codigos = {c: d for c, d in self._codigos.items() if d['id'] != visitante_id}
+            self._adoptar(version)
+
+    def _adoptar(self, version):
+        # Solo si la copia estaba justo en la versión anterior: cualquier otro
+        # salto incluye cambios ajenos y debe sincronizarse en la próxima consulta
+        if version is not None and self._version is not None and version == self._version + 1:
+            self._version = version
+
+    def forzar_verificacion(self):
+        """Consultar la versión en la próxima lectura (tras confirmar un cambio propio)"""
+        self._verificado = 0.0
+
+    def estadisticas(self):
+        return {'credenciales': len(self._codigos), 'version': self._version}
+
+
+def notificar_cambio(cursor, visitante_id=None):
+    """Incrementar la versión de credenciales dentro de la transacción del llamador.
+
+    Debe invocarse con el cursor de la transacción que emite, desactiva o
+    modifica credenciales, antes del commit. Si lo que cambió es el nombre o
+    el estado de un visitante, se pasa `visitante_id` para marcar sus
+    credenciales como modificadas.
+
+    Returns:
+        int: Nueva versión, para `agregar` / `quitar` tras el commit (None si falló)
+    """
+    try:
+        if visitante_id is not None:
+            cursor.execute("UPDATE credenciales SET modificado = CURRENT_TIMESTAMP WHERE visitante_id = %s",
+                           (visitante_id,))
+        cursor.execute("""
+            INSERT INTO cache_versiones (clave, version) VALUES ('credenciales', 1)
+            ON DUPLICATE KEY UPDATE version = version + 1
+        """)
+        cursor.execute("SELECT version FROM cache_versiones WHERE clave = 'credenciales'")
+        fila = cursor.fetchone()
+        if fila is None:
+            return None
+        return fila['version'] if isinstance(fila, dict) else fila[0]
+    except Error as e:
+        print(f"Error al invalidar índice de credenciales: {e}")
+        return None
+
+
+indice_credenciales = IndiceCredenciales(config.CREDENCIALES_INDICE_SEGUNDOS)
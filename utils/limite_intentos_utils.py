@@ -0,0 +1,184 @@
+"""Límite de intentos fallidos (login) con ventana deslizante compartida entre workers"""
+from collections import OrderedDict, deque
+import os
+import sqlite3
+import threading
+import time
+import config
+
+try:
+    import redis
+except Exception:
+    redis = None
+
+# Cada ventana se divide en cubos de tiempo: contar y expirar cuesta O(CUBOS)
+# por clave, constante, sin recorrer todas las claves en cada intento
+CUBOS_POR_VENTANA = 15
+
+
+class AlmacenMemoria:
+    """Contadores por cubo en memoria del proceso (un solo worker o respaldo)"""
+
+    def __init__(self):
+        self._claves = OrderedDict()  # clave -> deque[[cubo, cantidad]], de la menos a la más reciente
+        self._lock = threading.Lock()
+
+    def _expirar(self, minimo):
+        # Las claves sin intentos recientes quedan al principio: se quitan en O(1) cada una
+        while self._claves:
+            clave, cubos = next(iter(self._claves.items()))
+            if cubos[-1][0] >= minimo:
+                break
+            del self._claves[clave]
+
+    def sumar(self, clave, cubo, minimo):
+        with self._lock:
+            self._expirar(minimo)
+            cubos = self._claves.setdefault(clave, deque())
+            self._claves.move_to_end(clave)
+            if cubos and cubos[-1][0] == cubo:
+                cubos[-1][1] += 1
+            else:
+                cubos.append([cubo, 1])
+            while cubos[0][0] < minimo:
+                cubos.popleft()
+            return sum(cantidad for _, cantidad in cubos)
+
+    def contar(self, clave, minimo):
+        with self._lock:
+            self._expirar(minimo)
+            cubos = self._claves.get(clave, ())
+            return sum(cantidad for c, cantidad in cubos if c >= minimo)
+
+    def borrar(self, clave, minimo):
+        with self._lock:
+            self._claves.pop(clave, None)
+
+
+class AlmacenSQLite:
+    """Contadores en un archivo SQLite local, compartidos por todos los workers del servidor"""
+
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self._local = threading.local()
+        self._ultima_limpieza = None
+
+    def _conexion(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.ruta), exist_ok=True)
+            conn = sqlite3.connect(self.ruta, timeout=2, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS intentos (
+                    clave TEXT NOT NULL, cubo INTEGER NOT NULL, cantidad INTEGER NOT NULL,
+                    PRIMARY KEY (clave, cubo)
+                ) WITHOUT ROWID
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_intentos_cubo ON intentos (cubo)")
+            self._local.conn = conn
+        return conn
+
+    def sumar(self, clave, cubo, minimo):
+        conn = self._conexion()
+        if self._ultima_limpieza != cubo:
+            # Una limpieza por cubo y proceso (por índice), no en cada intento
+            self._ultima_limpieza = cubo
+            conn.execute("DELETE FROM intentos WHERE cubo < ?", (minimo,))
+        conn.execute("""
+            INSERT INTO intentos (clave, cubo, cantidad) VALUES (?, ?, 1)
+            ON CONFLICT (clave, cubo) DO UPDATE SET cantidad = cantidad + 1
+        """, (clave, cubo))
+        return self.contar(clave, minimo)
+
+    def contar(self, clave, minimo):
+        fila = self._conexion().execute(
+            "SELECT COALESCE(SUM(cantidad), 0) FROM intentos WHERE clave = ? AND cubo >= ?",
+            (clave, minimo)).fetchone()
+        return fila[0]
+
+    def borrar(self, clave, minimo):
+        self._conexion().execute("DELETE FROM intentos WHERE clave = ?", (clave,))
+
+
+class AlmacenRedis:
+    """Contadores en Redis (o compatible) para varios servidores; cada cubo expira solo"""
+
+    def __init__(self, url, prefijo='limite:'):
+        if redis is None:
+            raise RuntimeError("El paquete 'redis' no está instalado (LIMITE_INTENTOS_BACKEND=redis)")
+        self._cliente = redis.Redis.from_url(url)
+        self.prefijo = prefijo
+        self.ttl = None  # lo fija LimiteIntentos
+
+    def _claves(self, clave, minimo, cubos):
+        return [f"{self.prefijo}{clave}:{c}" for c in range(minimo, minimo + cubos)]
+
+    def sumar(self, clave, cubo, minimo):
+        tuberia = self._cliente.pipeline()
+        actual = f"{self.prefijo}{clave}:{cubo}"
+        tuberia.incr(actual)
+        tuberia.expire(actual, self.ttl)
+        tuberia.mget(self._claves(clave, minimo, cubo - minimo + 1))
+        return sum(int(v) for v in tuberia.execute()[2] if v)
+
+    def contar(self, clave, minimo):
+        return sum(int(v) for v in self._cliente.mget(self._claves(clave, minimo, CUBOS_POR_VENTANA)) if v)
+
+    def borrar(self, clave, minimo):
+        # Solo existen los cubos de la ventana (los anteriores ya expiraron):
+        # se borran por nombre, sin recorrer el espacio de claves con SCAN
+        self._cliente.delete(*self._claves(clave, minimo, CUBOS_POR_VENTANA))
+
+
+class LimiteIntentos:
+    """
+    Ventana deslizante de intentos fallidos por clave (IP, cuenta, ...)
+
+    La ventana se aproxima con CUBOS_POR_VENTANA cubos de tiempo; un intento
+    deja de contar cuando su cubo sale de la ventana. Si el almacén
+    compartido falla, se sigue contando en memoria del proceso.
+    """
+
+    def __init__(self, almacen, ventana_segundos):
+        self.almacen = almacen
+        self.ventana = ventana_segundos
+        self.ancho = max(1, ventana_segundos // CUBOS_POR_VENTANA)
+        if isinstance(almacen, AlmacenRedis):
+            almacen.ttl = ventana_segundos + self.ancho
+        self._respaldo = AlmacenMemoria()
+
+    def _cubos(self):
+        cubo = int(time.time() // self.ancho)
+        return cubo, cubo - CUBOS_POR_VENTANA + 1
+
+    def _usar(self, operacion, *args):
+        try:
+            return getattr(self.almacen, operacion)(*args)
+        except Exception as e:
+            print(f"Error en límite de intentos ({type(self.almacen).__name__}): {e}")
+            return getattr(self._respaldo, operacion)(*args)
+
+    def registrar(self, clave):
+        """Sumar un intento fallido; devuelve los intentos dentro de la ventana"""
+        cubo, minimo = self._cubos()
+        return self._usar('sumar', clave, cubo, minimo)
+
+    def intentos(self, clave):
+        return self._usar('contar', clave, self._cubos()[1])
+
+    def resetear(self, clave):
+        self._usar('borrar', clave, self._cubos()[1])
+
+
+def _crear_almacen():
+    backend = config.LIMITE_INTENTOS_BACKEND
+    if backend == 'redis':
+        return AlmacenRedis(config.LIMITE_INTENTOS_REDIS_URL)
+    if backend == 'sqlite':
+        return AlmacenSQLite(config.LIMITE_INTENTOS_SQLITE)
+    return AlmacenMemoria()
+
+
+limite_login = LimiteIntentos(_crear_almacen(), config.LOCKOUT_TIME * 60)
@@ -0,0 +1,104 @@
+"""Utilidades para paginación por cursor (keyset)"""
+from datetime import datetime
+
+FORMATO_CURSOR_FECHA = '%Y-%m-%dT%H:%M:%S.%f'
+
+
+def tamano_pagina(valor, por_defecto, minimo=10, maximo=200):
+    """
+    Normaliza el tamaño de página recibido por query string
+
+    Args:
+        valor: Valor crudo (str o None) de `por_pagina`
+        por_defecto: Tamaño a usar si el valor falta o es inválido
+
+    Returns:
+        int: Tamaño acotado a [minimo, maximo]
+    """
+    try:
+        tamano = int(valor)
+    except (TypeError, ValueError):
+        return por_defecto
+    return max(minimo, min(maximo, tamano))
+
+
+def fecha_cursor(texto):
+    """Convierte el valor textual de un cursor en datetime"""
+    return datetime.strptime(texto, FORMATO_CURSOR_FECHA)
+
+
+def codificar_cursor(valor, id):
+    """Codifica la clave (valor de orden, id) de una fila como texto para la URL"""
+    if isinstance(valor, datetime):
+        valor = valor.strftime(FORMATO_CURSOR_FECHA)
+    return f"{valor}_{id}"
+
+
+def decodificar_cursor(cursor, convertir=fecha_cursor):
+    """
+    Decodifica un cursor generado por `codificar_cursor`
+
+    Args:
+        cursor: Texto recibido por query string
+        convertir: Función que reconstruye el valor de orden (por defecto, fecha)
+
+    Returns:
+        tuple: (valor, int) o None si el cursor falta o es inválido
+    """
+    if not cursor:
+        return None
+    try:
+        valor, id = cursor.rsplit('_', 1)
+        return convertir(valor), int(id)
+    except ValueError:
+        return None
+
+
+def clausula_keyset(columna, columna_id, cursor, descendente=True, retroceder=False):
+    """
+    Construye el predicado y el ORDER BY de una página keyset
+
+    La columna de orden debe ser NOT NULL; `columna_id` desempata filas
+    con el mismo valor. Al retroceder se recorre el índice en sentido
+    inverso y `paginar_keyset` devuelve las filas al orden de pantalla.
+
+    Returns:
+        tuple: (condicion o None, parametros, orden)
+    """
+    invertir = descendente != retroceder
+    operador = '<' if invertir else '>'
+    sentido = 'DESC' if invertir else 'ASC'
+    orden = f"{columna} {sentido}" if columna == columna_id else f"{columna} {sentido}, {columna_id} {sentido}"
+    if cursor is None:
+        return None, [], orden
+    if columna == columna_id:
+        return f"{columna} {operador} %s", [cursor[1]], orden
+    condicion = f"({columna} {operador} %s OR ({columna} = %s AND {columna_id} {operador} %s))"
+    return condicion, [cursor[0], cursor[0], cursor[1]], orden
+
+
+def paginar_keyset(filas, por_pagina, hay_cursor, retroceder, columna='fecha_hora', columna_id='id'):
+    """
+    Recorta el resultado de una consulta keyset (pedida con LIMIT por_pagina + 1)
+    y calcula los cursores de navegación.
+
+    Args:
+        filas: Filas (dict) en el orden devuelto por `clausula_keyset`
+        hay_cursor: Si la página se pidió a partir de un cursor
+        retroceder: Si la página se pidió hacia atrás
+
+    Returns:
+        tuple: (filas en orden de pantalla, cursor_anterior, cursor_siguiente)
+    """
+    hay_mas = len(filas) > por_pagina
+    filas = list(filas[:por_pagina])
+
+    if retroceder:
+        filas.reverse()
+        hay_anterior, hay_siguiente = hay_mas, True
+    else:
+        hay_anterior, hay_siguiente = hay_cursor, hay_mas
+
+    cursor_anterior = codificar_cursor(filas[0][columna], filas[0][columna_id]) if filas and hay_anterior else None
+    cursor_siguiente = codificar_cursor(filas[-1][columna], filas[-1][columna_id]) if filas and hay_siguiente else None
+    return filas, cursor_anterior, cursor_siguiente
@@ -1,5 +1,5 @@
 from reportlab.lib.pagesizes import letter, A4
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
+from reportlab.platypus import SimpleDocTemplate, Table, LongTable, TableStyle, Paragraph, Spacer
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib import colors
 from reportlab.lib.units import inch
@@ -7,10 +7,116 @@ from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont
 from io import BytesIO
 from datetime import datetime
+from xml.sax.saxutils import escape
 from utils.time_utils import app_now
 
-def generar_pdf_reporte(accesos, tipo_reporte, fecha_inicio, fecha_fin, titulo="Reporte de Accesos"):
-    """Generar PDF del reporte de accesos"""
+# Estilos construidos una sola vez por proceso: getSampleStyleSheet() y los
+# ParagraphStyle derivados no cambian entre reportes
+ESTILOS = getSampleStyleSheet()
+ESTILO_TITULO_REPORTE = ParagraphStyle(
+    'CustomTitle',
+    parent=ESTILOS['Heading1'],
+    fontSize=16,
+    spaceAfter=30,
+    alignment=1  # Centrado
+)
+
+ENCABEZADOS_ACCESOS = ['Fecha/Hora', 'Visitante', 'Tipo', 'Autorizado', 'Guardia']
+COLUMNAS_ACCESOS = [1.5*inch, 2*inch, 0.8*inch, 0.8*inch, 1.5*inch]
+ESTILO_TABLA_ACCESOS = TableStyle([
+    ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+    ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+    ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, 0), 10),
+    ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+    ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+    ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
+    ('FONTSIZE', (0, 1), (-1, -1), 8),
+    ('GRID', (0, 0), (-1, -1), 1, colors.black)
+])
+
+# Filas por tabla: aproximadamente una página A4 con fuente de 8 puntos.
+# Tablas pequeñas mantienen lineal el costo de maquetación de reportlab,
+# que crece de forma super-lineal con el número de filas de una sola tabla
+FILAS_POR_TABLA = 45
+
+# Textos precalculados para las columnas con pocos valores posibles
+_HORAS = [f"{(h % 12) or 12:02d}:{m:02d} {'AM' if h < 12 else 'PM'}" for h in range(24) for m in range(60)]
+_TIPOS = {'entrada': 'Entrada', 'salida': 'Salida'}
+_AUTORIZADO = ('No', 'Sí')
+
+def _filas_accesos(accesos):
+    """Convertir los accesos en filas de texto sin strftime por fila"""
+    fechas = {}
+    for acceso in accesos:
+        fecha_hora = acceso['fecha_hora']
+        dia = fechas.get(fecha_hora.date())
+        if dia is None:
+            dia = fechas[fecha_hora.date()] = fecha_hora.strftime('%Y-%m-%d ')
+        tipo = acceso['tipo']
+        yield [
+            dia + _HORAS[fecha_hora.hour * 60 + fecha_hora.minute],
+            acceso.get('visitante') or 'N/A',
+            _TIPOS.get(tipo) or tipo.capitalize(),
+            _AUTORIZADO[bool(acceso['autorizado'])],
+            acceso.get('guardia') or 'Sistema'
+        ]
+
+def _tablas_accesos(accesos):
+    """Dividir las filas en tablas de una página con el encabezado repetido"""
+    bloque = []
+    for fila in _filas_accesos(accesos):
+        bloque.append(fila)
+        if len(bloque) == FILAS_POR_TABLA:
+            yield bloque
+            bloque = []
+    if bloque:
+        yield bloque
+
+class _FlujoPerezoso(list):
+    """
+    Lista de flowables que se rellena desde un generador a medida que se consume
+
+    doc.build() toma y borra el primer elemento en cada vuelta y consulta
+    len() antes de cada una: así solo existen las pocas tablas que se están
+    maquetando, no las de todo el reporte.
+    """
+
+    def __init__(self, iniciales, pendientes, reserva=2):
+        super().__init__(iniciales)
+        self._pendientes = iter(pendientes)
+        self._reserva = reserva
+
+    def __len__(self):
+        while self._pendientes is not None and list.__len__(self) < self._reserva:
+            siguiente = next(self._pendientes, None)
+            if siguiente is None:
+                self._pendientes = None
+            else:
+                self.append(siguiente)
+        return list.__len__(self)
+
+
+def _tablas_pdf(accesos):
+    for bloque in _tablas_accesos(accesos):
+        table = LongTable([ENCABEZADOS_ACCESOS] + bloque, colWidths=COLUMNAS_ACCESOS, repeatRows=1)
+        table.setStyle(ESTILO_TABLA_ACCESOS)
+        yield table
+
+def generar_pdf_reporte(accesos, tipo_reporte, fecha_inicio, fecha_fin, titulo="Reporte de Accesos", total=None,
+                        resumen=None):
+    """Generar PDF del reporte de accesos
+
+    `accesos` puede ser un generador (p. ej. filas leídas por tramos); en ese
+    caso hay que indicar `total`. Las filas se convierten en tablas a
+    medida que se maquetan, sin tenerlas todas en memoria.
+
+    Con `resumen` (totales de resumen_accesos) y sin `accesos` se genera
+    solo el resumen, para períodos demasiado grandes para el detalle.
+    """
+    if total is None:
+        total = len(accesos)
     
     # Crear buffer para el PDF
     buffer = BytesIO()
@@ -21,18 +127,8 @@ def generar_pdf_reporte(accesos, tipo_reporte, fecha_inicio, fecha_fin, titulo="
     # Lista de elementos del PDF
     elements = []
     
-    # Estilos
-    styles = getSampleStyleSheet()
-    title_style = ParagraphStyle(
-        'CustomTitle',
-        parent=styles['Heading1'],
-        fontSize=16,
-        spaceAfter=30,
-        alignment=1  # Centrado
-    )
-    
     # Título
-    title = Paragraph(titulo, title_style)
+    title = Paragraph(titulo, ESTILO_TITULO_REPORTE)
     elements.append(title)
     
     # Información del reporte
@@ -40,46 +136,32 @@ def generar_pdf_reporte(accesos, tipo_reporte, fecha_inicio, fecha_fin, titulo="
     <b>Tipo de Reporte:</b> {tipo_reporte.capitalize()}<br/>
     <b>Período:</b> {fecha_inicio} {f' al {fecha_fin}' if tipo_reporte == 'mensual' else ''}<br/>
     <b>Generado el:</b> {app_now().strftime('%Y-%m-%d %I:%M %p')}<br/>
-    <b>Total de registros:</b> {len(accesos)}
+    <b>Total de registros:</b> {total}
     """
     
-    info_paragraph = Paragraph(info_text, styles['Normal'])
+    info_paragraph = Paragraph(info_text, ESTILOS['Normal'])
     elements.append(info_paragraph)
     elements.append(Spacer(1, 20))
     
-    # Tabla de datos
-    if accesos:
-        # Encabezados de la tabla
-        data = [['Fecha/Hora', 'Visitante', 'Tipo', 'Autorizado', 'Guardia']]
-        
-        # Datos
-        for acceso in accesos:
-            fecha_str = acceso['fecha_hora'].strftime('%Y-%m-%d %I:%M %p')
-            visitante = acceso.get('visitante', 'N/A')
-            tipo = acceso['tipo'].capitalize()
-            autorizado = 'Sí' if acceso['autorizado'] else 'No'
-            guardia = acceso.get('guardia', 'Sistema')
-            
-            data.append([fecha_str, visitante, tipo, autorizado, guardia])
-        
-        # Crear tabla
-        table = Table(data, colWidths=[1.5*inch, 2*inch, 0.8*inch, 0.8*inch, 1.5*inch])
-        table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, 0), 10),
-            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-            ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-            ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
-            ('FONTSIZE', (0, 1), (-1, -1), 8),
-            ('GRID', (0, 0), (-1, -1), 1, colors.black)
-        ]))
-        
-        elements.append(table)
-    else:
-        no_data = Paragraph("<b>No hay registros para el período seleccionado</b>", styles['Normal'])
+    if resumen is not None:
+        elements.append(Paragraph(
+            f"<b>Autorizados:</b> {resumen['accesos_autorizados']} &nbsp; "
+            f"<b>Denegados:</b> {resumen['accesos_denegados']}<br/>"
+            f"<b>Entradas:</b> {resumen['total_entradas']} &nbsp; <b>Salidas:</b> {resumen['total_salidas']}<br/>"
+            f"<b>Visitantes únicos:</b> {resumen['visitantes_unicos']}", ESTILOS['Normal']))
+        elements.append(Spacer(1, 12))
+    if accesos is None:
+        if total:
+            elements.append(Paragraph(
+                "<b>El período tiene demasiados registros para incluir el detalle en PDF; "
+                "use la exportación CSV.</b>", ESTILOS['Normal']))
+    elif total:
+        # Tabla de datos en bloques de una página (repeatRows repite el
+        # encabezado si un bloque se parte entre dos páginas), creados a
+        # medida que reportlab los consume
+        elements = _FlujoPerezoso(elements, _tablas_pdf(accesos))
+    if not total:
+        no_data = Paragraph("<b>No hay registros para el período seleccionado</b>", ESTILOS['Normal'])
         elements.append(no_data)
     
     # Generar PDF
@@ -91,6 +173,21 @@ def generar_pdf_reporte(accesos, tipo_reporte, fecha_inicio, fecha_fin, titulo="
     
     return pdf
 
+# Estilos de la credencial, compartidos por todas las páginas de un lote
+ESTILO_TITULO_CREDENCIAL = ParagraphStyle(
+    'CredencialTitle',
+    parent=ESTILOS['Heading1'],
+    fontSize=14,
+    alignment=1
+)
+ESTILO_CODIGO_CREDENCIAL = ParagraphStyle(
+    'CodigoStyle',
+    parent=ESTILOS['Heading1'],
+    fontSize=24,
+    textColor=colors.red,
+    alignment=1
+)
+
 def generar_pdf_credencial(visitante, codigo):
     """Generar PDF de credencial para visitante"""
     
@@ -98,49 +195,33 @@ def generar_pdf_credencial(visitante, codigo):
     doc = SimpleDocTemplate(buffer, pagesize=(300, 400), topMargin=20)
     elements = []
     
-    styles = getSampleStyleSheet()
-    title_style = ParagraphStyle(
-        'CredencialTitle',
-        parent=styles['Heading1'],
-        fontSize=14,
-        alignment=1
-    )
-    
     # Título
-    title = Paragraph("CREDENCIAL DE ACCESO", title_style)
+    title = Paragraph("CREDENCIAL DE ACCESO", ESTILO_TITULO_CREDENCIAL)
     elements.append(title)
     elements.append(Spacer(1, 20))
     
-    # Información del visitante
+    # Información del visitante (escapada: los datos los escribe el usuario)
     info_text = f"""
-    <b>Nombre:</b> {visitante['nombre']}<br/>
-    <b>Identificación:</b> {visitante['identificacion']}<br/>
-    <b>Empresa:</b> {visitante.get('empresa', 'N/A')}<br/>
-    <b>Motivo:</b> {visitante.get('motivo', 'N/A')}<br/>
+    <b>Nombre:</b> {escape(visitante['nombre'])}<br/>
+    <b>Identificación:</b> {escape(visitante['identificacion'])}<br/>
+    <b>Empresa:</b> {escape(visitante.get('empresa') or 'N/A')}<br/>
+    <b>Motivo:</b> {escape(visitante.get('motivo') or 'N/A')}<br/>
     <b>Fecha de registro:</b> {visitante['fecha_registro'].strftime('%Y-%m-%d')}
     """
     
-    info_paragraph = Paragraph(info_text, styles['Normal'])
+    info_paragraph = Paragraph(info_text, ESTILOS['Normal'])
     elements.append(info_paragraph)
     elements.append(Spacer(1, 30))
     
     # Código de acceso (grande y destacado)
-    codigo_style = ParagraphStyle(
-        'CodigoStyle',
-        parent=styles['Heading1'],
-        fontSize=24,
-        textColor=colors.red,
-        alignment=1
-    )
-    
-    codigo_paragraph = Paragraph(f"<b>{codigo}</b>", codigo_style)
+    codigo_paragraph = Paragraph(f"<b>{escape(codigo)}</b>", ESTILO_CODIGO_CREDENCIAL)
     elements.append(codigo_paragraph)
     
     # Instrucciones
     elements.append(Spacer(1, 20))
     instrucciones = Paragraph(
         "<i>Presentar esta credencial al guardia de seguridad para ingresar a las instalaciones</i>",
-        styles['Italic']
+        ESTILOS['Italic']
     )
     elements.append(instrucciones)
     
@@ -157,7 +238,7 @@ def generar_pdf_estadisticas(estadisticas, accesos_7_dias, visitantes_frecuentes
     doc = SimpleDocTemplate(buffer, pagesize=A4, topMargin=30)
     elements = []
     
-    styles = getSampleStyleSheet()
+    styles = ESTILOS
     title_style = ParagraphStyle(
         'TitleStyle',
         parent=styles['Heading1'],
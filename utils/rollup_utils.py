@@ -0,0 +1,307 @@
+"""Resúmenes diarios de accesos (rollup) para reportes y estadísticas"""
+from datetime import datetime, timedelta
+from utils.time_utils import app_now_date, tramos_fechas
+from utils.horarios_utils import motor_horarios
+
+CAMPOS_RESUMEN = ('total_accesos', 'accesos_autorizados', 'accesos_denegados',
+                  'total_entradas', 'total_salidas')
+
+
+def _inicio_dia(fecha):
+    return datetime.combine(fecha, datetime.min.time())
+
+
+def _procesado_hasta(cursor, bloquear=False):
+    cursor.execute("SELECT procesado_hasta FROM rollup_estado WHERE clave = 'accesos_diarios'"
+                   + (" FOR UPDATE" if bloquear else ""))
+    return _valor(cursor.fetchone(), 'procesado_hasta')
+
+
+def _marcar_procesado(cursor, fecha):
+    cursor.execute("""
+        INSERT INTO rollup_estado (clave, procesado_hasta) VALUES ('accesos_diarios', %s)
+        ON DUPLICATE KEY UPDATE procesado_hasta = VALUES(procesado_hasta)
+    """, (fecha,))
+
+
+def actualizar_accesos_diarios(cursor):
+    """
+    Llevar `accesos_diarios` al día hasta ayer (los días cerrados)
+
+    La marca de agua vive en `rollup_estado` y se lee en cada llamada (una
+    lectura por clave primaria), así que una invalidación hecha por
+    cualquier worker se ve en todos. Si está atrasada, se bloquea la fila
+    para que un solo proceso recalcule los días pendientes (normalmente
+    uno: ayer, o el día reenviado).
+
+    El historial completo no se calcula aquí: lo carga la migración
+    (`reconstruir_accesos_diarios`, desde init_db.py).
+
+    Debe llamarse con un cursor de `Database.transaccion()` para que el
+    recálculo y la nueva marca se confirmen juntos.
+
+    Returns:
+        bool: False si el rollup no está inicializado; entonces los días
+        cerrados deben agregarse desde los accesos crudos
+    """
+    hoy = app_now_date()
+    ayer = hoy - timedelta(days=1)
+    procesado_hasta = _procesado_hasta(cursor)
+    if procesado_hasta is not None and procesado_hasta >= ayer:
+        return True
+    if procesado_hasta is None:
+        print("⚠️  Rollup de accesos sin inicializar: ejecute init_db.py para cargar el historial")
+        return False
+
+    # Otro worker pudo terminar mientras se esperaba el bloqueo
+    procesado_hasta = _procesado_hasta(cursor, bloquear=True)
+    if procesado_hasta is None:
+        return False
+    if procesado_hasta >= ayer:
+        return True
+    _recalcular(cursor, _inicio_dia(procesado_hasta + timedelta(days=1)), _inicio_dia(hoy))
+    _marcar_procesado(cursor, ayer)
+    return True
+
+
+def rollup_inicializado(cursor):
+    """¿Hay marca de agua? Sin ella los totales salen de los accesos crudos y no deben cachearse"""
+    return _procesado_hasta(cursor) is not None
+
+
+def _tramos(cursor, fecha_inicio, fecha_fin):
+    """
+    Partir [fecha_inicio, fecha_fin] en días leídos del rollup y días crudos
+
+    Returns:
+        tuple: (último día del rollup, o None si no se usa; inicio y fin
+        (exclusivo) del tramo crudo, o None)
+    """
+    hoy = app_now_date()
+    if actualizar_accesos_diarios(cursor):
+        fin_cerrado = min(fecha_fin, hoy - timedelta(days=1))
+    else:
+        # Sin historial cargado: todo el rango desde los accesos crudos, más lento pero correcto
+        fin_cerrado = fecha_inicio - timedelta(days=1)
+    desde_crudo = max(fecha_inicio, fin_cerrado + timedelta(days=1))
+    crudo = None
+    if desde_crudo <= fecha_fin:
+        crudo = (_inicio_dia(desde_crudo), _inicio_dia(fecha_fin + timedelta(days=1)))
+    return (fin_cerrado if fecha_inicio <= fin_cerrado else None), crudo
+
+
+def reconstruir_accesos_diarios(cursor):
+    """
+    Recalcular todo el historial del rollup hasta ayer (migración)
+
+    Se ejecuta desde init_db.py cuando la marca de agua está vacía, fuera de
+    las peticiones web. Devuelve el último día recalculado (None si ya estaba cargado).
+    """
+    if _procesado_hasta(cursor, bloquear=True) is not None:
+        return None
+    hoy = app_now_date()
+    _recalcular(cursor, datetime.min, _inicio_dia(hoy))
+    _marcar_procesado(cursor, hoy - timedelta(days=1))
+    return hoy - timedelta(days=1)
+
+
+def recalcular_accesos_diarios(cursor):
+    """
+    Recalcular los días ya cargados en el rollup sin mover la marca de agua
+
+    Migración puntual (init_db.py) cuando se agrega una columna al resumen,
+    para rellenarla en los días existentes. Devuelve el último día
+    recalculado (None si el rollup no está inicializado).
+    """
+    procesado_hasta = _procesado_hasta(cursor, bloquear=True)
+    if procesado_hasta is None:
+        return None
+    _recalcular(cursor, datetime.min, _inicio_dia(procesado_hasta + timedelta(days=1)))
+    return procesado_hasta
+
+
+def _recalcular(cursor, desde, hasta):
+    """Reconstruir los resúmenes de los días en [desde, hasta)"""
+    cursor.execute("DELETE FROM accesos_diarios WHERE fecha >= %s AND fecha < %s", (desde.date(), hasta.date()))
+    cursor.execute("DELETE FROM accesos_visitantes_dia WHERE fecha >= %s AND fecha < %s", (desde.date(), hasta.date()))
+    cursor.execute("""
+        INSERT INTO accesos_diarios
+            (fecha, total_accesos, accesos_autorizados, accesos_denegados,
+             total_entradas, total_salidas, visitantes_unicos)
+        SELECT
+            DATE(fecha_hora),
+            COUNT(*),
+            SUM(CASE WHEN autorizado = 1 THEN 1 ELSE 0 END),
+            SUM(CASE WHEN autorizado = 0 THEN 1 ELSE 0 END),
+            SUM(CASE WHEN tipo = 'entrada' THEN 1 ELSE 0 END),
+            SUM(CASE WHEN tipo = 'salida' THEN 1 ELSE 0 END),
+            COUNT(DISTINCT visitante_id)
+        FROM accesos
+        WHERE fecha_hora >= %s AND fecha_hora < %s
+        GROUP BY DATE(fecha_hora)
+    """, (desde, hasta))
+    # Fuera de horario con las reglas vigentes al cerrar el día, por tramos
+    # de un mes para acotar la memoria al reconstruir todo el historial
+    cursor.execute("SELECT MIN(fecha) as primera FROM accesos_diarios WHERE fecha >= %s AND fecha < %s",
+                   (desde.date(), hasta.date()))
+    primera = _valor(cursor.fetchone(), 'primera')
+    if primera is not None:
+        for tramo_desde, tramo_hasta in tramos_fechas(_inicio_dia(primera), hasta, 31):
+            por_dia = motor_horarios.fuera_de_horario_por_dia(cursor, tramo_desde, tramo_hasta)
+            if por_dia:
+                cursor.executemany("UPDATE accesos_diarios SET accesos_fuera_horario = %s WHERE fecha = %s",
+                                   [(cantidad, fecha) for fecha, cantidad in por_dia.items()])
+    cursor.execute("""
+        INSERT IGNORE INTO accesos_visitantes_dia (fecha, visitante_id)
+        SELECT DISTINCT DATE(fecha_hora), visitante_id
+        FROM accesos
+        WHERE fecha_hora >= %s AND fecha_hora < %s AND visitante_id IS NOT NULL
+    """, (desde, hasta))
+
+
+def invalidar_accesos_diarios(cursor, fecha):
+    """
+    Marcar como pendiente el resumen de un día cerrado cuyos accesos cambiaron
+
+    Debe llamarse dentro de la transacción que modifica accesos de días
+    anteriores a hoy (ediciones manuales, reenvíos de lectores sin conexión).
+    """
+    if isinstance(fecha, datetime):
+        fecha = fecha.date()
+    if fecha >= app_now_date():
+        return
+    cursor.execute("""
+        UPDATE rollup_estado SET procesado_hasta = %s
+        WHERE clave = 'accesos_diarios' AND procesado_hasta >= %s
+    """, (fecha - timedelta(days=1), fecha))
+
+
+def resumen_accesos(cursor, fecha_inicio, fecha_fin):
+    """
+    Totales de accesos entre dos fechas (inclusivas)
+
+    Los días cerrados se leen del rollup; solo el día de hoy, si está en el
+    rango, se agrega desde los accesos crudos (todo el rango si el rollup
+    no está inicializado).
+
+    Returns:
+        dict: total_accesos, accesos_autorizados, accesos_denegados,
+        visitantes_unicos, total_entradas, total_salidas
+    """
+    resumen = dict.fromkeys(CAMPOS_RESUMEN, 0)
+    fin_cerrado, crudo = _tramos(cursor, fecha_inicio, fecha_fin)
+
+    if fin_cerrado is not None:
+        cursor.execute("""
+            SELECT
+                SUM(total_accesos) as total_accesos,
+                SUM(accesos_autorizados) as accesos_autorizados,
+                SUM(accesos_denegados) as accesos_denegados,
+                SUM(total_entradas) as total_entradas,
+                SUM(total_salidas) as total_salidas
+            FROM accesos_diarios
+            WHERE fecha BETWEEN %s AND %s
+        """, (fecha_inicio, fin_cerrado))
+        _sumar(resumen, cursor.fetchone())
+
+    if crudo:
+        cursor.execute("""
+            SELECT
+                COUNT(*) as total_accesos,
+                SUM(CASE WHEN autorizado = 1 THEN 1 ELSE 0 END) as accesos_autorizados,
+                SUM(CASE WHEN autorizado = 0 THEN 1 ELSE 0 END) as accesos_denegados,
+                SUM(CASE WHEN tipo = 'entrada' THEN 1 ELSE 0 END) as total_entradas,
+                SUM(CASE WHEN tipo = 'salida' THEN 1 ELSE 0 END) as total_salidas
+            FROM accesos
+            WHERE fecha_hora >= %s AND fecha_hora < %s
+        """, crudo)
+        _sumar(resumen, cursor.fetchone())
+
+    # Los visitantes únicos no se pueden sumar día a día: se cuentan sobre la
+    # tabla (fecha, visitante), mucho más pequeña que accesos
+    consultas, params = [], []
+    if fin_cerrado is not None:
+        consultas.append("SELECT visitante_id FROM accesos_visitantes_dia WHERE fecha BETWEEN %s AND %s")
+        params.extend([fecha_inicio, fin_cerrado])
+    if crudo:
+        consultas.append("SELECT visitante_id FROM accesos WHERE fecha_hora >= %s AND fecha_hora < %s")
+        params.extend(crudo)
+    if consultas:
+        cursor.execute(f"SELECT COUNT(DISTINCT visitante_id) as visitantes_unicos FROM ({' UNION ALL '.join(consultas)}) x", params)
+        resumen['visitantes_unicos'] = int(_valor(cursor.fetchone(), 'visitantes_unicos') or 0)
+    else:
+        resumen['visitantes_unicos'] = 0
+
+    return resumen
+
+
+def fuera_de_horario(cursor, fecha_inicio, fecha_fin):
+    """
+    Accesos fuera de horario entre dos fechas (inclusivas)
+
+    Los días cerrados suman `accesos_fuera_horario` del rollup, calculado con
+    el horario vigente al cerrarse cada día; solo hoy (o todo el rango, sin
+    rollup inicializado) se evalúa sobre los accesos crudos.
+    """
+    total = 0
+    fin_cerrado, crudo = _tramos(cursor, fecha_inicio, fecha_fin)
+    if fin_cerrado is not None:
+        cursor.execute("""
+            SELECT SUM(accesos_fuera_horario) as accesos_fuera_horario
+            FROM accesos_diarios
+            WHERE fecha BETWEEN %s AND %s
+        """, (fecha_inicio, fin_cerrado))
+        total += int(_valor(cursor.fetchone(), 'accesos_fuera_horario') or 0)
+    if crudo:
+        total += motor_horarios.contar_fuera_de_horario(cursor, *crudo)
+    return total
+
+
+def accesos_por_dia(cursor, fecha_inicio, fecha_fin):
+    """
+    Serie diaria (fecha, total, entradas, salidas, denegados), más reciente primero
+
+    Igual que `resumen_accesos`: rollup para días cerrados, crudo solo para hoy.
+    """
+    dias = []
+    fin_cerrado, crudo = _tramos(cursor, fecha_inicio, fecha_fin)
+
+    if crudo:
+        cursor.execute("""
+            SELECT 
+                DATE(fecha_hora) as fecha,
+                COUNT(*) as total,
+                SUM(CASE WHEN tipo = 'entrada' THEN 1 ELSE 0 END) as entradas,
+                SUM(CASE WHEN tipo = 'salida' THEN 1 ELSE 0 END) as salidas,
+                SUM(CASE WHEN autorizado = 0 THEN 1 ELSE 0 END) as denegados
+            FROM accesos
+            WHERE fecha_hora >= %s AND fecha_hora < %s
+            GROUP BY DATE(fecha_hora)
+            ORDER BY fecha DESC
+        """, crudo)
+        dias.extend(cursor.fetchall())
+
+    if fin_cerrado is not None:
+        cursor.execute("""
+            SELECT fecha, total_accesos as total, total_entradas as entradas,
+                   total_salidas as salidas, accesos_denegados as denegados
+            FROM accesos_diarios
+            WHERE fecha BETWEEN %s AND %s
+            ORDER BY fecha DESC
+        """, (fecha_inicio, fin_cerrado))
+        dias.extend(cursor.fetchall())
+
+    return dias
+
+
+def _valor(fila, campo):
+    if fila is None:
+        return None
+    return fila[campo] if isinstance(fila, dict) else fila[0]
+
+
+def _sumar(resumen, fila):
+    if not fila:
+        return
+    for campo in CAMPOS_RESUMEN:
+        resumen[campo] += int(fila.get(campo) or 0)
@@ -1,4 +1,4 @@
-from datetime import datetime
+from datetime import datetime, timedelta
 import config
 try:
     from zoneinfo import ZoneInfo
@@ -6,18 +6,30 @@ except Exception:
     ZoneInfo = None
 
 
+_zonas = {}
+
+
+def app_timezone():
+    """Return the tzinfo for config.APP_TIMEZONE, built once per zone name.
+
+    Returns None if zoneinfo or the configured zone is not available.
+    """
+    nombre = config.APP_TIMEZONE
+    if nombre not in _zonas:
+        try:
+            _zonas[nombre] = ZoneInfo(nombre) if ZoneInfo is not None else None
+        except Exception:
+            _zonas[nombre] = None
+    return _zonas[nombre]
+
+
 def app_now() -> datetime:
     """Return current datetime in application's configured timezone.
 
     Falls back to system local time if zoneinfo or the configured zone is not available.
     """
-    if ZoneInfo is not None:
-        try:
-            tz = ZoneInfo(config.APP_TIMEZONE)
-            return datetime.now(tz)
-        except Exception:
-            return datetime.now()
-    return datetime.now()
+    tz = app_timezone()
+    return datetime.now(tz) if tz is not None else datetime.now()
 
 
 def app_now_date():
@@ -26,3 +38,49 @@ def app_now_date():
 
 def app_now_time():
     return app_now().time()
+
+
+
+def app_utc_offset() -> str:
+    """Return the current UTC offset of the app timezone in MySQL format ('-05:00').
+
+    Used as the connection `time_zone` so NOW(), CURDATE() and TIMESTAMP columns
+    are interpreted in application local time.
+    """
+    offset = app_now().strftime('%z')
+    if not offset:
+        return '+00:00'
+    return f"{offset[:3]}:{offset[3:]}"
+
+
+def rango_fechas(fecha_desde: str, fecha_hasta: str):
+    """Convert inclusive 'YYYY-MM-DD' dates into a half-open [start, end) range.
+
+    Returns naive local-midnight datetimes suitable for sargable
+    `fecha_hora >= %s AND fecha_hora < %s` predicates. Empty bounds are
+    returned as None; malformed dates raise ValueError.
+    """
+    inicio = datetime.strptime(fecha_desde, '%Y-%m-%d') if fecha_desde else None
+    fin = datetime.strptime(fecha_hasta, '%Y-%m-%d') + timedelta(days=1) if fecha_hasta else None
+    return inicio, fin
+
+
+def tramos_fechas(inicio: datetime, fin: datetime, dias: int, descendente: bool = True):
+    """Split the half-open range [inicio, fin) into consecutive [desde, hasta) chunks of `dias` days.
+
+    Chunks are yielded newest first by default, matching reports ordered by
+    `fecha_hora DESC`, so each chunk can be queried and streamed on its own.
+    """
+    paso = timedelta(days=max(1, dias))
+    if descendente:
+        hasta = fin
+        while hasta > inicio:
+            desde = max(inicio, hasta - paso)
+            yield desde, hasta
+            hasta = desde
+    else:
+        desde = inicio
+        while desde < fin:
+            hasta = min(fin, desde + paso)
+            yield desde, hasta
+            desde = hasta
@@ -0,0 +1,147 @@
+"""Ejecución de trabajos en segundo plano con resultado cacheado en disco"""
+from concurrent.futures import ThreadPoolExecutor
+import os
+import threading
+import time
+import config
+
+
+class GestorTrabajos:
+    """
+    Ejecuta trabajos identificados por una clave y guarda su resultado en disco
+
+    El estado se deduce de los archivos (`<clave><ext>` listo, `.tmp` en
+    curso, `.error` fallido), así que cualquier worker puede responder por
+    un trabajo lanzado en otro proceso y los resultados sobreviven reinicios.
+    La misma clave nunca se ejecuta dos veces a la vez en el mismo proceso.
+    Mientras un trabajo corre, su `.tmp` se renueva (latido) cada cuarto de
+    `timeout`; uno que ningún hilo de este proceso atiende y que lleva más
+    de `timeout` segundos sin renovarse se considera abandonado (worker
+    caído a mitad de trabajo) y se borra, para que pueda volver a enviarse.
+    """
+
+    def __init__(self, directorio, hilos, extension, max_edad_dias=None, timeout=None):
+        self.directorio = directorio
+        self.extension = extension
+        self.max_edad = max_edad_dias * 86400 if max_edad_dias else None
+        self.timeout = timeout
+        self._hilos = hilos
+        self._executor = None
+        self._en_curso = set()
+        self._lock = threading.Lock()
+
+    def ruta(self, clave, sufijo=''):
+        return os.path.join(self.directorio, f"{clave}{self.extension}{sufijo}")
+
+    def estado(self, clave):
+        """'listo', 'en_proceso', 'error' o 'desconocido'"""
+        if os.path.exists(self.ruta(clave)):
+            return 'listo'
+        with self._lock:
+            if clave in self._en_curso:
+                return 'en_proceso'
+        if os.path.exists(self.ruta(clave, '.tmp')) and not self._abandonado(clave):
+            return 'en_proceso'
+        if os.path.exists(self.ruta(clave, '.error')):
+            return 'error'
+        return 'desconocido'
+
+    def _abandonado(self, clave):
+        """Borrar la marca `.tmp` si venció `timeout` (solo se llama sin trabajo local en curso)"""
+        if self.timeout is None:
+            return False
+        temporal = self.ruta(clave, '.tmp')
+        try:
+            if time.time() - os.path.getmtime(temporal) < self.timeout:
+                return False
+            os.remove(temporal)
+        except OSError:
+            # Desapareció entre medias: otro proceso terminó o ya la limpió
+            pass
+        print(f"⚠️  Trabajo {clave} abandonado: marca en curso descartada")
+        return True
+
+    def enviar(self, clave, funcion, *args):
+        """
+        Encolar `funcion(*args)` (que devuelve bytes) salvo que ya exista o esté en curso
+
+        Returns:
+            str: Estado del trabajo tras el envío
+        """
+        estado = self.estado(clave)
+        if estado in ('listo', 'en_proceso'):
+            return estado
+        with self._lock:
+            if clave in self._en_curso:
+                return 'en_proceso'
+            self._en_curso.add(clave)
+            if self._executor is None:
+                os.makedirs(self.directorio, exist_ok=True)
+                self._executor = ThreadPoolExecutor(max_workers=self._hilos, thread_name_prefix='trabajo')
+        try:
+            os.remove(self.ruta(clave, '.error'))
+        except OSError:
+            pass
+        # Marca visible para los demás procesos mientras dura el trabajo
+        open(self.ruta(clave, '.tmp'), 'wb').close()
+        self._executor.submit(self._ejecutar, clave, funcion, args)
+        return 'en_proceso'
+
+    def _latido(self, temporal, terminado):
+        """Renovar la fecha de la marca `.tmp` hasta que termine el trabajo"""
+        while not terminado.wait(self.timeout / 4):
+            try:
+                os.utime(temporal)
+            except OSError:
+                pass
+
+    def _ejecutar(self, clave, funcion, args):
+        temporal = self.ruta(clave, '.tmp')
+        terminado = threading.Event()
+        if self.timeout is not None:
+            threading.Thread(target=self._latido, args=(temporal, terminado),
+                             name='trabajo-latido', daemon=True).start()
+        try:
+            contenido = funcion(*args)
+            with open(temporal, 'wb') as archivo:
+                archivo.write(contenido)
+            # Reemplazo atómico: nunca se sirve un archivo a medio escribir
+            os.replace(temporal, self.ruta(clave))
+        except Exception as e:
+            print(f"Error en trabajo {clave}: {e}")
+            with open(self.ruta(clave, '.error'), 'w', encoding='utf-8') as archivo:
+                archivo.write(str(e))
+            try:
+                os.remove(temporal)
+            except OSError:
+                pass
+        finally:
+            terminado.set()
+            with self._lock:
+                self._en_curso.discard(clave)
+            self.purgar()
+
+    def purgar(self):
+        """Eliminar resultados más antiguos que `max_edad_dias` (sin límite, no borra nada)"""
+        if self.max_edad is None:
+            return
+        limite = time.time() - self.max_edad
+        try:
+            nombres = os.listdir(self.directorio)
+        except OSError:
+            return
+        for nombre in nombres:
+            ruta = os.path.join(self.directorio, nombre)
+            try:
+                if os.path.getmtime(ruta) < limite:
+                    os.remove(ruta)
+            except OSError:
+                pass
+
+
+trabajos_pdf = GestorTrabajos(config.REPORTES_CACHE_DIR, config.REPORTES_PDF_HILOS,
+                              '.pdf', config.REPORTES_CACHE_DIAS, config.REPORTES_PDF_TIMEOUT)
+
+# PDFs de períodos cerrados: no caducan, se borran al invalidar el período
+trabajos_pdf_periodos = GestorTrabajos(config.REPORTES_PERIODOS_DIR, config.REPORTES_PDF_HILOS, '.pdf',
+                                       timeout=config.REPORTES_PDF_TIMEOUT)